@@ -1,3 +1,4 @@
+from .context import RunContext
 from .environment import Environment
 from .task_chain import TaskChain
 
@@ -1,13 +1,15 @@
+import asyncio
 from typing import Union, Dict, Any
 
 class Action(object):
-    def __init__(self, name: str, description: str, **kwargs):
+    def __init__(self, name: str, description: str, role=None, **kwargs):
         """
         Initializes an instance of the action class.
 
         Args:
             name (str): The name of the action.
             description (str): The description of the action.
+            role (Role, optional): The role that performs the action.
             **kwargs: Additional keyword arguments.
 
         Returns:
@@ -15,6 +17,12 @@ class Action(object):
         """
         self.name = name
         self.description = description
+        self.role = role
+
+    @property
+    def run_context(self):
+        "The context of the run the action is performed in."
+        return self.role.run_context if self.role is not None else None
 
     def _run(self, **context) -> Union[str, Dict, Any]:
         """
@@ -27,4 +35,19 @@ class Action(object):
         Returns:
             Union[str, Dict, Any]: Either a string, dictionary, or any other type.
         """
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
+
+    async def _a_run(self, **context) -> Union[str, Dict, Any]:
+        """
+        The async version of `_run`, used by roles on the async execution path.
+
+        Override this function to run the action natively on the event loop. By default,
+        the synchronous `_run` is executed in a worker thread.
+
+        Args:
+            context (dict): A dictionary containing the context for the function.
+
+        Returns:
+            Union[str, Dict, Any]: Either a string, dictionary, or any other type.
+        """
+        return await asyncio.to_thread(self._run, **context)
@@ -1,5 +1,14 @@
-from typing import Union, Dict, Any
+from pathlib import Path
+from typing import Union, Dict, Any, Optional, Tuple
+
+from autogen.code_utils import execute_code
+
 from appgen.actions import Action
+from appgen.config import CONFIG
+from appgen.utils.kernel import get_kernel_pool
+
+# The working directory of the code executed by the action.
+WORK_DIR = "coding"
 
 
 class AnalyzeData(Action):
@@ -9,22 +18,46 @@ class AnalyzeData(Action):
             role,
             name: str = "analyze_data",
             description:str = "Analyze the given Data sources to understand what the data shows and how you can possibly use it to fulfill the client's requests.",
+            use_kernel: bool = True,
             **kwargs):
 
-        super().__init__(name, description)
+        super().__init__(name, description, role=role)
 
         self._user = role._user
         self._react_assistant = role._react_assistant
+        # Execute the python code blocks in a persistent kernel of the role for the run,
+        # instead of a new interpreter for each code block.
+        self.use_kernel = use_kernel
+        if self.use_kernel:
+            # Start the kernels of the first analysis now, while the previous tasks run.
+            get_kernel_pool().warm(WORK_DIR)
 
+    def _set_code_execution(self):
+        self._user._code_execution_config={
+            "work_dir": WORK_DIR,
+            "use_docker": False,  # set to True or image name like "python:3" to use docker
+        }
+        if self.use_kernel:
+            self._user.run_code = self._run_code
+
+    def _run_code(self, code: str, lang: str = "python", filename: Optional[str] = None, work_dir: Optional[str] = None, timeout: Optional[int] = None, **kwargs) -> Tuple[int, str, Any]:
+        "Execute the python code in the kernel of the role for the run, and the other languages as autogen does."
+        if lang not in ("python", "Python"):
+            return execute_code(code, lang=lang, filename=filename, work_dir=work_dir, timeout=timeout, **kwargs)
+        if filename is not None:
+            # Keep the file, as autogen does.
+            path = Path(work_dir) / filename
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(code, encoding="utf-8")
+        kernel = get_kernel_pool().get(self.run_context.run_id, self.role.role, work_dir)
+        exitcode, logs = kernel.execute(code, timeout=timeout or CONFIG.kernel_timeout, filename=filename)
+        return exitcode, logs, None
 
     def _run(self, **context) -> Union[str, Dict, Any]:
         messages = context["messages"]
         msg = "\n".join([f"{msg['role']} said: {msg['content']}" for msg in messages])
 
-        self._user._code_execution_config={
-            "work_dir": "coding",
-            "use_docker": False,  # set to True or image name like "python:3" to use docker
-        }
+        self._set_code_execution()
         self._user.initiate_chat(
             self._react_assistant,
             message=msg
@@ -32,3 +65,14 @@ class AnalyzeData(Action):
         rsp = self._user.last_message(agent=self._react_assistant)['content']
         return rsp
 
+    async def _a_run(self, **context) -> Union[str, Dict, Any]:
+        messages = context["messages"]
+        msg = "\n".join([f"{msg['role']} said: {msg['content']}" for msg in messages])
+
+        self._set_code_execution()
+        await self._user.a_initiate_chat(
+            self._react_assistant,
+            message=msg
+        )
+        rsp = self._user.last_message(agent=self._react_assistant)['content']
+        return rsp
@@ -72,6 +72,15 @@ class BacklogSchema(Document):
   )
 
 
+  @classmethod
+  def get_field_groups(cls):
+    # The required packages must match the dependencies and tools.
+    return [
+      ["PythonPackageName", "DependenciesandTools", "RequiredPythonPackages"],
+      ["TaskList"],
+      ["FullAPISpec"],
+    ]
+
   async def parse(self, resources_path:Path=Path("resources")):
         
         self.PythonPackageName = wrap_in_backticks(self.PythonPackageName)
@@ -85,6 +85,14 @@ class DataModelSchema(Document):
     # )
 
 
+    @classmethod
+    def get_field_groups(cls):
+        # The tables and the ER diagram must follow the logical data model.
+        return [
+            ["Standards"],
+            ["LogicalDataModel", "FactTables", "DimensionTables", "ERDiagram"],
+        ]
+
     async def parse(self, resources_path:Path=Path("resources")):
         er_diagram = self.ERDiagram
 
@@ -36,6 +36,20 @@ class Document(BaseModel):
         
         raise NotImplementedError()
     
+    @classmethod
+    def get_field_groups(cls):
+        """
+        Return the groups of fields that can be generated independently of each other,
+        e.g. as concurrent completions. By default, each field except the Title is its
+        own group.
+
+        Override this function to keep the fields that depend on each other in the same group.
+
+        Returns:
+            List[List[str]]: The groups of field names.
+        """
+        return [[name] for name in cls.model_fields if name != "Title"]
+
     async def parse(self, resources_path:Path=Path("resources")):
         """
         Parses the resources and returns a dictionary containing the document content in markdown
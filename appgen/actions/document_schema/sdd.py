@@ -1,6 +1,7 @@
 from pydantic import Field
 from appgen.actions.document_schema import Document
 
+import asyncio
 from pathlib import Path
 from appgen.utils.mermaid import mermaid_to_file
 from appgen.utils import logger, json_to_markdown
@@ -89,12 +90,28 @@ class SDDSchema(Document):
     )
 
     
+    @classmethod
+    def get_field_groups(cls):
+        # The program flow must use the classes of the class diagrams.
+        return [
+            ["HighLevelSystemDesign"],
+            ["DataIngestion"],
+            ["DataCuration"],
+            ["DataTransformation"],
+            ["DataScience"],
+            ["DataVisualization"],
+            ["Orchestration"],
+            ["ClassDiagrams", "ProgramFlow"],
+        ]
+
     async def parse(self, resources_path:Path=Path("resources")):
         class_diagrams = self.ClassDiagrams
         program_flow = self.ProgramFlow
 
-        await mermaid_to_file(class_diagrams, resources_path/"class_diagram")
-        await mermaid_to_file(program_flow, resources_path/"program_flow")
+        await asyncio.gather(
+            mermaid_to_file(class_diagrams, resources_path/"class_diagram"),
+            mermaid_to_file(program_flow, resources_path/"program_flow"),
+        )
 
         class_diagram_png = resources_path/"class_diagram.png"
         program_flow_png = resources_path/"program_flow.png"
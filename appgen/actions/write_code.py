@@ -1,9 +1,14 @@
+import asyncio
+import contextvars
+import json
+
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Dict, Any, Union, Tuple
 
 from appgen.actions import Action
 from appgen.utils import logger
-from appgen.config import CONFIG
-from appgen.utils.cost import estimate_cost_of_completion
+from appgen.utils.llm import create_completion, a_create_completion
+from appgen.utils.stream import ChainlitTokenStream
 
 from autogen.agentchat import Agent, ConversableAgent
 from autogen.code_utils import (
@@ -13,35 +18,81 @@ from autogen.code_utils import (
     execute_code
 )
 
+FILE_PROMPT_TEMPLATE = """The following documents describe the application you are implementing.
+
+# Requirements document:
+{prd}
+
+# Class diagrams of the technical design:
+{class_diagrams}
+
+# Development backlog:
+{backlog}
+-----
+The files of the task list are written separately, in parallel. You are ONLY writing the file `{filename}`:
+{file_description}
+
+The other files of the task list are: {other_files}. Use their paths and the class diagrams for your imports and calls.
+Write the full content of the file in a single code block (guarded by triple backticks) whose first line is `# filename: {filename}`.
+Implement all the classes and functions of the file. No placeholders (such as 'pass' in Python).
+"""
+
+
 class WriteCode(Action):
+    """
+    Write the code of the application and save it to the artifacts.
+
+    By default, the code is written in a pair programming chat between the role and its assistant.
+    With `parallel_files`, each file of the task list of the development backlog is instead written
+    by an independent completion that shares a compact context (the requirements document, the
+    class diagrams and the backlog), and up to `max_workers` files are written concurrently.
+
+    Args:
+        role (Role): The role that performs the action.
+        name (str): The name of the action.
+        description (str): The description of the action.
+        parallel_files (bool): Write the files of the task list as concurrent completions.
+        max_workers (int): The maximum number of files written concurrently.
+    """
 
     def __init__(
             self,
             role,
             name: str = "WriteCode",
             description: str = "Write Code",
+            parallel_files: bool = False,
+            max_workers: int = 4,
             **kwargs
     ):
         
-        super().__init__(name, description)
+        super().__init__(name, description, role=role)
+        self.parallel_files = parallel_files
+        self.max_workers = max_workers
 
         self._user = role._user
         self._react_assistant = role._react_assistant
 
+        if role.use_async:
+            write_code = self._a_write_code
+            check_termination_and_human_reply = ConversableAgent.a_check_termination_and_human_reply
+        else:
+            write_code = self._write_code
+            check_termination_and_human_reply = ConversableAgent.check_termination_and_human_reply
+
         # Simulate pair programming
         self._user.register_reply(
             self._react_assistant.name,
-            self._write_code
+            write_code
         )
 
         self._react_assistant.register_reply(
             self._user.name,
-            self._write_code
+            write_code
         )
 
         # register the termination functions to avoid infinite loops
-        self._user.register_reply(self._react_assistant.name, ConversableAgent.check_termination_and_human_reply)
-        self._react_assistant.register_reply(self._user.name, ConversableAgent.check_termination_and_human_reply)
+        self._user.register_reply(self._react_assistant.name, check_termination_and_human_reply)
+        self._react_assistant.register_reply(self._user.name, check_termination_and_human_reply)
     
         # Disabled code execution so that the user agent will provide feedback on the 
         # written code rather than blindly executing it.
@@ -51,6 +102,17 @@ class WriteCode(Action):
     def _run(self, **context) -> Union[str, Dict, Any]:
         
         logger.info("Writing code!")
+        if self.parallel_files and (files := self._get_task_files()):
+            shared_context = self._get_shared_context()
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run, self._write_file, context["client"], shared_context, files, filename
+                    )
+                    for filename in files
+                ]
+                return "\n\n".join(future.result() for future in futures)
+
         msg = context["messages"][0]
 
         self._user.initiate_chat(
@@ -61,6 +123,29 @@ class WriteCode(Action):
         rsp = self._user.last_message(agent=self._react_assistant)['content']
         return rsp
 
+    async def _a_run(self, **context) -> Union[str, Dict, Any]:
+        
+        logger.info("Writing code!")
+        if self.parallel_files and (files := self._get_task_files()):
+            shared_context = self._get_shared_context()
+            semaphore = asyncio.Semaphore(self.max_workers)
+
+            async def write_file(filename):
+                async with semaphore:
+                    return await self._a_write_file(self.role.a_client, shared_context, files, filename)
+
+            return "\n\n".join(await asyncio.gather(*[write_file(filename) for filename in files]))
+
+        msg = context["messages"][0]
+
+        await self._user.a_initiate_chat(
+            self._react_assistant,
+            message=msg
+        )
+
+        rsp = self._user.last_message(agent=self._react_assistant)['content']
+        return rsp
+
     def _write_code(
         self,
         recipient: Optional[Agent] = None,
@@ -87,15 +172,110 @@ class WriteCode(Action):
         #             "content": f"Executed file {filename} with results: {execute_code(code)}"
         #         })
   
-        response = client.create(
-            context=messages[-1].pop("context", None), messages=recipient._oai_system_message + messages
+        response = create_completion(
+            client, self.run_context, context=messages[-1].pop("context", None), messages=recipient._oai_system_message + messages
         )
-        estimate_cost_of_completion(response)
         rsp = client.extract_text_or_function_call(response)[0]
 
         return True, rsp
 
-    
+    async def _a_write_code(
+        self,
+        recipient: Optional[Agent] = None,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[Any] = None,
+    ):
+        "The async version of `_write_code`."
+        # The client of the role is read at each reply, since the role may have switched to its fallback model.
+        client = self.role.a_client if config is None else config
+        if client is None:
+            return False, None
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+
+        # save code from previous messages to artifacts
+        self._parse_code_blocks(messages)
+
+        oai_context = messages[-1].pop("context", None)
+        # The reply is streamed to show progress, and removed once it is sent as a message.
+        stream = ChainlitTokenStream(author=recipient.name) if self.run_context.stream else None
+        response = await a_create_completion(
+            client, self.run_context, context=oai_context, messages=recipient._oai_system_message + messages, on_token=stream
+        )
+        rsp = client.extract_text_or_function_call(response)[0]
+        if stream is not None:
+            await stream.remove()
+
+        return True, rsp
+
+    def _write_file(self, client, shared_context: Dict[str, str], files: Dict[str, str], filename: str) -> str:
+        "Write a file of the task list with a single completion and save its code blocks."
+        logger.info(f"Writing {filename}")
+        response = create_completion(
+            client, self.run_context, messages=self._get_file_prompt(shared_context, files, filename)
+        )
+        rsp = client.extract_text_or_function_call(response)[0]
+        self._save_file_reply(filename, rsp)
+        return rsp
+
+    async def _a_write_file(self, client, shared_context: Dict[str, str], files: Dict[str, str], filename: str) -> str:
+        "The async version of `_write_file`."
+        logger.info(f"Writing {filename}")
+        response = await a_create_completion(
+            client, self.run_context, messages=self._get_file_prompt(shared_context, files, filename)
+        )
+        rsp = client.extract_text_or_function_call(response)[0]
+        self._save_file_reply(filename, rsp)
+        return rsp
+
+    def _get_task_files(self) -> Dict[str, str]:
+        "Return the files of the task list of the development backlog and their descriptions."
+        backlog = self.run_context.artifacts["docs"].get("backlog")
+        files = {}
+        for task in getattr(backlog, "TaskList", None) or []:
+            if isinstance(task, (tuple, list)) and task:
+                files[str(task[0])] = str(task[1]) if len(task) > 1 else ""
+            elif isinstance(task, dict) and task:
+                filename, description = next(iter(task.items()))
+                files[str(filename)] = str(description)
+            elif isinstance(task, str):
+                files[task] = ""
+        files.pop("...", None)
+        if not files:
+            logger.warning("The development backlog has no task list. Writing the code in a single chat instead.")
+        return files
+
+    def _get_shared_context(self) -> Dict[str, str]:
+        "Return the compact context shared by the completions of all the files."
+        docs = self.run_context.artifacts["docs"]
+        prd, sdd, backlog = docs.get("prd"), docs.get("sdd"), docs["backlog"]
+        return dict(
+            prd=prd.model_dump_json(exclude={"Title"}) if prd is not None else "Not available.",
+            class_diagrams=sdd.ClassDiagrams if sdd is not None else "Not available.",
+            backlog=backlog.model_dump_json(include={"PythonPackageName", "RequiredPythonPackages", "TaskList"}),
+        )
+
+    def _get_file_prompt(self, shared_context: Dict[str, str], files: Dict[str, str], filename: str) -> List[Dict]:
+        prompt = FILE_PROMPT_TEMPLATE.format(
+            filename=filename,
+            file_description=files[filename],
+            other_files=json.dumps([other for other in files if other != filename]),
+            **shared_context
+        )
+        return self._react_assistant._oai_system_message + [{"role": "user", "content": prompt}]
+
+    def _save_file_reply(self, filename: str, rsp: str):
+        "Save the code blocks of the reply, naming the first one after the file if it has no filename."
+        code_blocks = extract_code(rsp)
+        if len(code_blocks) == 1 and code_blocks[0][0] == UNKNOWN:
+            logger.warning(f"No code block was written for {filename}.")
+            return
+        lang, code = code_blocks[0]
+        if not code.startswith("# filename: "):
+            code_blocks[0] = (lang, f"# filename: {filename}\n{code}")
+        self._save_code_blocks(code_blocks)
+
     def _parse_code_blocks(self, messages, last_n_messages=1) -> List[Tuple[str, str, str]]:
         codes = []
         for i in range(min(len(messages), last_n_messages)):
@@ -124,6 +304,6 @@ class WriteCode(Action):
             logger.debug(f"Saving code for {filename}")
             # TODO: get rid of this config and update the environment at each step instead.
             codes.append((lang, filename, code))
-            code_files = CONFIG.artifacts["code"]
+            code_files = self.run_context.artifacts["code"]
             code_files[filename] = code
         return codes
\ No newline at end of file
@@ -1,19 +1,25 @@
 import json
+import contextvars
 
-from typing import Type, Union, Dict, Any
-from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from typing import Type, Union, Dict, Any, List
+from pydantic import BaseModel, TypeAdapter, ValidationError
 import asyncio
 
 from appgen.actions import Action
 from appgen.actions.document_schema import (
+    Document,
     PRDSchema,
     BacklogSchema,
     SDDSchema,
     DataModelSchema
 )
 from appgen.utils import logger, json_to_markdown
-from appgen.utils.cost import estimate_cost_of_completion
+from appgen.utils.llm import create_completion, a_create_completion
+from appgen.utils.mermaid import get_mermaid_renderer
 from appgen.config import CONFIG
+from appgen.utils.stream import ChainlitTokenStream
+from appgen.utils.json_stream import IncrementalJSONObjectParser
 
 DOCUMENT_PROMPT_TEMPLATE = """
 # Format example:
@@ -33,6 +39,23 @@ Output a JSON STRING and do NOT wrap the JSON string in quotes or backticks.
 YOU MUST output JUST the JSON as PLAIN python STRING as in the format example.
 """
 
+FIELD_GROUP_PROMPT = """
+The other sections of the document are written separately. You are ONLY writing the following sections: {fields}.
+Return a JSON object with ONLY these fields, and make sure they are consistent with the conversation records.
+"""
+
+FIELDS_PROMPT_TEMPLATE = """
+# Format example:
+{format_example}
+-----
+The following fields of your document are missing or invalid:
+{errors}
+
+AIM: Fix ONLY these fields and return them in a JSON object with just these fields, as in the format example.
+Keep what you already wrote for these fields where it is correct, and DO NOT return any other field.
+Output a JSON STRING and do NOT wrap the JSON string in quotes or backticks. 
+"""
+
 class WriteDocument(Action):
     """
     Write a Structured Documentation and return the result.
@@ -43,6 +66,11 @@ class WriteDocument(Action):
         document_schema (Type[BaseModel]): The schema of the document. Example: PRDSchema
         document_name (str): The name of the document. Example: prd
         document_prompt_template (str): The prompt template to generate the document.
+        max_field_retries (int): The number of times the missing or invalid fields are re-requested.
+        parallel_fields (Union[bool, List[List[str]]]): Generate the groups of fields of the document
+            as concurrent completions. If True, the field groups of the document schema are used.
+        max_parallel_requests (int): The maximum number of concurrent completions when generating
+            the fields in parallel.
     """
 
     def __init__(
@@ -52,53 +80,259 @@ class WriteDocument(Action):
         document_schema:Type[BaseModel],
         document_name:str,
         document_prompt_template:str = DOCUMENT_PROMPT_TEMPLATE,
+        max_field_retries:int = 2,
+        parallel_fields:Union[bool, List[List[str]]] = False,
+        max_parallel_requests:int = 4,
         **kwargs
     ):
-        super().__init__(name, description)
+        super().__init__(name, description, **kwargs)
 
         self.document_schema = document_schema
         self.document_name = document_name
         self.document_prompt_template = document_prompt_template
+        self.max_field_retries = max_field_retries
+        self.parallel_fields = parallel_fields
+        self.max_parallel_requests = max_parallel_requests
         
     
     def _run(self, client, messages=[], system_message=[], **context) -> Union[str, Dict, Any]:
-        # Initialize the prompt template with the document schema details.
-        prompt = self.document_prompt_template.format(
-            format_example=self.document_schema.get_format_example()
-        )
-        msg = [{
-            "role": "assistant",
-            "content": prompt
-        }]
-
         # Initialize the LLM config and request chat completion using oai.
         config_list = CONFIG.config_list
         logger.debug(config_list)
 
-        rsp = client.create(
-            context=messages[-1].pop("context", None), messages=system_message+messages+msg
-        )
-        estimate_cost_of_completion(rsp)
-        rsp = client.extract_text_or_function_call(rsp)[0]
+        oai_context = messages[-1].pop("context", None)
+        prefix = system_message + self.role.history.compact(messages, client, self.run_context)
+        if self.parallel_fields:
+            # Every group shares the conversation prefix and only differs by its last message.
+            field_groups = self._get_field_groups()
+            with ThreadPoolExecutor(max_workers=self.max_parallel_requests) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._generate_fields, client, prefix, fields, oai_context)
+                    for fields in field_groups
+                ]
+                fields, errors = self._merge_fields([future.result() for future in futures])
+        else:
+            fields, errors = self._generate_fields(client, prefix, context=oai_context)
 
-        # Parse the response using the document schema and save it to the docs artifacts.
-        content = self.document_schema.model_validate_json(rsp)
-        
-        docs = CONFIG.artifacts["docs"]
-        docs[self.document_name] = content
+        content = self._save_document(fields, errors)
 
         # TODO: keep environment memory with own message definitions
         # also define actionmessage to store the document classes in memory
         # and retrieve them later OR use memgpt!
-        if CONFIG.use_chainlit:
+        if self.run_context.use_chainlit:
             content = content.model_copy()
-            parsed_doc = asyncio.run(content.parse())
+            parsed_doc = asyncio.run(self._parse_on_new_loop(content))
             return {
                 "content": json_to_markdown(json.loads(content.model_dump_json())),
                 "parsed_doc": parsed_doc
             }
         return json_to_markdown(json.loads(content.model_dump_json()))
 
+    async def _parse_on_new_loop(self, content: Document) -> Dict:
+        "Parse the document on the event loop of `asyncio.run`, then close the diagram renderer of the loop."
+        try:
+            return await content.parse(resources_path=self.run_context.resources_dir)
+        finally:
+            await get_mermaid_renderer().close()
+
+    async def _a_run(self, client, messages=[], system_message=[], **context) -> Union[str, Dict, Any]:
+        oai_context = messages[-1].pop("context", None)
+        prefix = system_message + await self.role.history.a_compact(messages, client, self.run_context)
+        if self.parallel_fields:
+            # Every group shares the conversation prefix and only differs by its last message.
+            semaphore = asyncio.Semaphore(self.max_parallel_requests)
+
+            async def generate(fields):
+                async with semaphore:
+                    return await self._a_generate_fields(client, prefix, fields, context=oai_context)
+
+            results = await asyncio.gather(*[generate(fields) for fields in self._get_field_groups()])
+            fields, errors = self._merge_fields(results)
+        else:
+            # The raw JSON is streamed to show progress, and removed once the document is parsed.
+            stream = ChainlitTokenStream(author=self.role.role, language="json") if self.run_context.stream else None
+            fields, errors = await self._a_generate_fields(client, prefix, context=oai_context, stream=stream)
+
+        content = self._save_document(fields, errors)
+
+        if self.run_context.use_chainlit:
+            parsed_doc = await content.model_copy().parse(resources_path=self.run_context.resources_dir)
+            return {
+                "content": json_to_markdown(json.loads(content.model_dump_json())),
+                "parsed_doc": parsed_doc
+            }
+        return json_to_markdown(json.loads(content.model_dump_json()))
+
+    def _generate_fields(self, client, prefix: List[Dict], fields: List[str] = None, context: Dict = None):
+        """
+        Request the given fields of the document (all of them by default) and validate them.
+        Only the fields that are missing or invalid are re-requested.
+
+        Returns:
+            Tuple[dict, dict]: The valid fields, and the error of each field that is still missing or invalid.
+        """
+        msg = self._get_document_prompt(fields)
+        rsp = create_completion(client, self.run_context, context=context, messages=prefix+msg)
+        rsp = client.extract_text_or_function_call(rsp)[0]
+        valid_fields, errors = self._validate_members(self._parse_members(rsp), expected=fields)
+
+        for _ in range(self.max_field_retries):
+            if not errors:
+                break
+            retry_msg = self._get_fields_prompt(rsp, errors)
+            retry_rsp = create_completion(client, self.run_context, messages=prefix+msg+retry_msg)
+            retry_rsp = client.extract_text_or_function_call(retry_rsp)[0]
+            retry_fields, errors = self._validate_members(self._parse_members(retry_rsp), expected=errors.keys())
+            valid_fields.update(retry_fields)
+        return valid_fields, errors
+
+    async def _a_generate_fields(self, client, prefix: List[Dict], fields: List[str] = None, context: Dict = None, stream: ChainlitTokenStream = None):
+        """
+        The async version of `_generate_fields`.
+
+        If a stream is given, the response is streamed to it and each field is validated
+        as soon as it is complete in the stream.
+        """
+        msg = self._get_document_prompt(fields)
+        parser = IncrementalJSONObjectParser()
+        valid_fields, errors = {}, {}
+
+        async def on_token(token):
+            for member in parser.feed(token):
+                self._validate_member(valid_fields, errors, *member)
+            await stream(token)
+
+        rsp = await a_create_completion(
+            client, self.run_context, context=context, messages=prefix+msg, on_token=on_token if stream is not None else None
+        )
+        rsp = client.extract_text_or_function_call(rsp)[0]
+        if stream is not None:
+            await stream.remove()
+            for member in parser.close():
+                self._validate_member(valid_fields, errors, *member)
+            errors.update(self._get_missing_fields(valid_fields, errors, fields))
+        else:
+            valid_fields, errors = self._validate_members(self._parse_members(rsp), expected=fields)
+
+        for _ in range(self.max_field_retries):
+            if not errors:
+                break
+            retry_msg = self._get_fields_prompt(rsp, errors)
+            retry_rsp = await a_create_completion(client, self.run_context, messages=prefix+msg+retry_msg)
+            retry_rsp = client.extract_text_or_function_call(retry_rsp)[0]
+            retry_fields, errors = self._validate_members(self._parse_members(retry_rsp), expected=errors.keys())
+            valid_fields.update(retry_fields)
+        return valid_fields, errors
+
+    def _get_field_groups(self) -> List[List[str]]:
+        "Return the groups of fields that are generated as separate completions."
+        if isinstance(self.parallel_fields, list):
+            return self.parallel_fields
+        return self.document_schema.get_field_groups()
+
+    @staticmethod
+    def _merge_fields(results: list):
+        "Merge the (fields, errors) results of the field groups."
+        fields, errors = {}, {}
+        for group_fields, group_errors in results:
+            fields.update(group_fields)
+            errors.update(group_errors)
+        return fields, errors
+
+    def _get_document_prompt(self, fields: List[str] = None):
+        """
+        Initialize the prompt template with the document schema details.
+        If fields are given, only these fields of the document are requested.
+        """
+        format_example = self.document_schema.get_format_example()
+        if fields is not None:
+            format_example = json.loads(format_example)
+            format_example = json.dumps({key: format_example.get(key) for key in fields})
+        prompt = self.document_prompt_template.format(format_example=format_example)
+        if fields is not None:
+            prompt += FIELD_GROUP_PROMPT.format(fields=", ".join(fields))
+        return [{
+            "role": "assistant",
+            "content": prompt
+        }]
+
+    def _get_fields_prompt(self, rsp: str, errors: Dict[str, str]):
+        "Return the messages asking to fix the given fields of the document in the response."
+        format_example = json.loads(self.document_schema.get_format_example())
+        prompt = FIELDS_PROMPT_TEMPLATE.format(
+            format_example=json.dumps({key: format_example.get(key) for key in errors}),
+            errors="\n".join([f"- {key}: {error}" for key, error in errors.items()])
+        )
+        return [{
+            "role": "assistant",
+            "content": rsp
+        }, {
+            "role": "user",
+            "content": prompt
+        }]
+
+    @staticmethod
+    def _parse_members(rsp: str) -> list:
+        "Parse the top-level members of the JSON object in the response."
+        parser = IncrementalJSONObjectParser()
+        return parser.feed(rsp) + parser.close()
+
+    def _validate_members(self, members: list, expected=None):
+        """
+        Validate each member of the response against its field in the document schema.
+
+        Args:
+            members (list): The (key, value, error) tuples parsed from the response.
+            expected (Iterable[str], optional): The fields expected in the response.
+                Defaults to all the fields of the document schema except its Title.
+
+        Returns:
+            Tuple[dict, dict]: The valid fields, and the error of each missing or invalid field.
+        """
+        expected = set(expected) if expected is not None else self._get_expected_fields()
+        fields, errors = {}, {}
+        for key, value, error in members:
+            if key in expected or key not in self.document_schema.model_fields:
+                self._validate_member(fields, errors, key, value, error)
+        errors.update(self._get_missing_fields(fields, errors, expected))
+        return fields, errors
+
+    def _get_expected_fields(self) -> set:
+        "Return the fields the document is expected to fill in: all the fields except its Title."
+        return set(self.document_schema.model_fields) - {"Title"}
+
+    def _get_missing_fields(self, fields: dict, errors: dict, expected=None) -> Dict[str, str]:
+        "Return the error of each expected field that is neither valid nor invalid."
+        expected = set(expected) if expected is not None else self._get_expected_fields()
+        return {key: "The field is missing." for key in expected - fields.keys() - errors.keys()}
+
+    def _validate_member(self, fields: dict, errors: dict, key: str, value: Any, error: str = None):
+        "Validate the value of a field and add it either to the valid fields or to the errors."
+        field = self.document_schema.model_fields.get(key)
+        if field is None:
+            logger.warning(f"Ignoring the unknown field '{key}' of the {self.document_name} document.")
+            return
+        if error is None:
+            try:
+                fields[key] = TypeAdapter(field.annotation).validate_python(value)
+                errors.pop(key, None)
+                return
+            except ValidationError as validation_error:
+                error = str(validation_error)
+        logger.warning(f"The field '{key}' of the {self.document_name} document is invalid: {error}")
+        fields.pop(key, None)
+        errors[key] = error
+
+    def _save_document(self, fields: dict, errors: dict) -> BaseModel:
+        "Build the document from the validated fields and save it to the docs artifacts."
+        if errors:
+            logger.error(f"The fields {list(errors)} of the {self.document_name} document are still invalid. Using their defaults.")
+        content = self.document_schema.model_validate(fields)
+        
+        docs = self.run_context.artifacts["docs"]
+        docs[self.document_name] = content
+        return content
+
 
 
 class WriteRequirementsDocument(WriteDocument):
@@ -112,7 +346,7 @@ class WriteRequirementsDocument(WriteDocument):
         document_prompt_template:str = DOCUMENT_PROMPT_TEMPLATE,
         **kwargs
     ):
-        super().__init__(name, description, document_schema, document_name, document_prompt_template)
+        super().__init__(name, description, document_schema, document_name, document_prompt_template, **kwargs)
 
 
 class WriteDataModelDocument(WriteDocument):
@@ -126,7 +360,7 @@ class WriteDataModelDocument(WriteDocument):
         document_prompt_template:str = DOCUMENT_PROMPT_TEMPLATE,
         **kwargs
     ):
-        super().__init__(name, description, document_schema, document_name, document_prompt_template)
+        super().__init__(name, description, document_schema, document_name, document_prompt_template, **kwargs)
 
 
 class WriteTechnicalDesignDocument(WriteDocument):
@@ -140,7 +374,7 @@ class WriteTechnicalDesignDocument(WriteDocument):
         document_prompt_template:str = DOCUMENT_PROMPT_TEMPLATE,
         **kwargs
     ):
-        super().__init__(name, description, document_schema, document_name, document_prompt_template)
+        super().__init__(name, description, document_schema, document_name, document_prompt_template, **kwargs)
 
 
 class WriteDevelopmentBacklogDocument(WriteDocument):
@@ -154,4 +388,4 @@ class WriteDevelopmentBacklogDocument(WriteDocument):
         document_prompt_template:str = DOCUMENT_PROMPT_TEMPLATE,
         **kwargs
     ):
-        super().__init__(name, description, document_schema, document_name, document_prompt_template)
\ No newline at end of file
+        super().__init__(name, description, document_schema, document_name, document_prompt_template, **kwargs)
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Run a batch of TaskChains from the command line, without the Chainlit UI.
+
+The batch is a JSONL file where each line describes a run:
+    {"idea": "...", "config": "examples/biapp/bi_app.json", "project_name": "sales_report"}
+
+Only `idea` is required; `max_cost` and `max_tokens` set the budget of the run,
+`data_sources` lists the paths of its data files, and `fork_from` is "auto" or the name of a
+past project whose outputs the run edits. The runs are executed in parallel worker processes and the agents
+reply automatically instead of asking the human for input. A summary of each run is written
+to `<project_directory>/.appgen/summary.json` and appended to the summary file of the batch.
+
+Run `python -m appgen.batch --help` for the options.
+"""
+import argparse
+import json
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+import chainlit as cl
+
+from appgen import TaskChain
+from appgen.utils import logger
+from appgen.utils.const import EXAMPLES_ROOT, WORKSPACE_ROOT
+
+DEFAULT_CONFIG_PATH = EXAMPLES_ROOT / "biapp" / "bi_app.json"
+
+
+def load_runs(path: Path) -> List[Dict]:
+    "Return the runs of the JSONL batch file, with a default config and project name."
+    runs = []
+    with open(path, "r", encoding="utf8") as file:
+        for idx, line in enumerate(file):
+            if not line.strip():
+                continue
+            run = json.loads(line)
+            if not run.get("idea"):
+                raise ValueError(f"Line {idx + 1} of {path} has no 'idea'.")
+            run.setdefault("config", str(DEFAULT_CONFIG_PATH))
+            run.setdefault("project_name", f"{Path(path).stem}_{idx}")
+            runs.append(run)
+    return runs
+
+
+def run_task_chain(run: Dict, root_dir: Path, reuse_outputs: bool = True, resume: bool = False) -> Dict:
+    """
+    Execute a TaskChain for the run in the current process and return its summary.
+
+    Args:
+        run (Dict): The idea, config and project name of the run.
+        root_dir (Path): The directory of the projects.
+        reuse_outputs (bool): Skip the tasks whose inputs did not change since the last run.
+        resume (bool): Resume the project from the last completed task of its checkpoint.
+
+    Returns:
+        Dict: The summary of the run.
+    """
+    start = time.perf_counter()
+    summary = dict(run, status="failed", error=None)
+    task_chain = None
+    try:
+        task_chain = TaskChain(
+            config_path=run["config"],
+            idea=run["idea"],
+            project_name=run["project_name"],
+            root_dir=Path(root_dir),
+            use_chainlit=False,
+            reuse_outputs=reuse_outputs,
+            resume=resume,
+            auto_reply=True,
+            max_cost=run.get("max_cost"),
+            max_tokens=run.get("max_tokens"),
+            data_sources=run.get("data_sources"),
+            fork_from=run.get("fork_from")
+        )
+        task_chain.setup_environment()
+        task_chain.execute()
+        if task_chain.budget_error is None:
+            summary["status"] = "done"
+        else:
+            summary.update(status="over_budget", error=str(task_chain.budget_error))
+    except Exception:
+        summary["error"] = traceback.format_exc()
+        logger.error(f"The run of the project '{run['project_name']}' failed: {summary['error']}")
+    finally:
+        if task_chain is not None and hasattr(task_chain, "environment"):
+            task_chain.post_processing(
+                task_status=cl.TaskStatus.DONE.name if summary["status"] == "done" else cl.TaskStatus.FAILED.name
+            )
+            artifacts = task_chain.run_context.artifacts
+            summary.update(
+                project_directory=str(task_chain.environment.project_directory),
+                completed_tasks=list(task_chain._completed),
+                forked_from=(task_chain.environment.fork or {}).get("project"),
+                documents=sorted(artifacts["docs"]),
+                code_files=sorted(name for name in artifacts["code"] if name),
+                total_cost=task_chain.run_context.total_cost,
+            )
+        summary["duration"] = time.perf_counter() - start
+
+    if "project_directory" in summary:
+        summary_path = Path(summary["project_directory"]) / ".appgen" / "summary.json"
+        summary_path.parent.mkdir(parents=True, exist_ok=True)
+        summary_path.write_text(json.dumps(summary, indent=2), encoding="utf8")
+    return summary
+
+
+def run_batch(
+        runs: List[Dict],
+        root_dir: Path,
+        summary_path: Path,
+        max_workers: int = 2,
+        reuse_outputs: bool = True,
+        resume: bool = False
+    ) -> List[Dict]:
+    """
+    Execute the runs in parallel worker processes and append their summaries to the summary file
+    as soon as they finish.
+
+    Returns:
+        List[Dict]: The summaries of the runs, in the order they finished.
+    """
+    summaries = []
+    summary_path = Path(summary_path)
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, open(summary_path, "a", encoding="utf8") as file:
+        futures = {
+            executor.submit(run_task_chain, run, root_dir, reuse_outputs, resume): run
+            for run in runs
+        }
+        for future in as_completed(futures):
+            run = futures[future]
+            try:
+                summary = future.result()
+            except Exception:
+                # The worker process itself died, e.g. it ran out of memory.
+                summary = dict(run, status="failed", error=traceback.format_exc())
+            summaries.append(summary)
+            file.write(json.dumps(summary) + "\n")
+            file.flush()
+            logger.info(f"The run of the project '{run['project_name']}' is {summary['status']} ({len(summaries)}/{len(runs)}).")
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of TaskChains from a JSONL file of {idea, config, project_name}.")
+    parser.add_argument("runs", type=Path, help="Path to the JSONL batch file")
+    parser.add_argument("--root_dir", type=Path, help="The directory of the projects", default=WORKSPACE_ROOT / "batch")
+    parser.add_argument("--summary", type=Path, help="The JSONL file the summaries are appended to", default=None)
+    parser.add_argument("--max_workers", type=int, help="The number of runs executed in parallel", default=2)
+    parser.add_argument("--rerun_all", action="store_true", help="Re-execute all the tasks, even those whose inputs did not change")
+    parser.add_argument("--resume", action="store_true", help="Resume each project from the last completed task of its checkpoint")
+    args = parser.parse_args()
+
+    runs = load_runs(args.runs)
+    summary_path = args.summary or args.root_dir / f"{args.runs.stem}_summary.jsonl"
+    summaries = run_batch(
+        runs,
+        root_dir=args.root_dir,
+        summary_path=summary_path,
+        max_workers=args.max_workers,
+        reuse_outputs=not args.rerun_all,
+        resume=args.resume
+    )
+    n_done = sum(summary["status"] == "done" for summary in summaries)
+    total_cost = sum(summary.get("total_cost", 0) for summary in summaries)
+    print(f"{n_done}/{len(summaries)} runs are done. Total estimated cost: ${total_cost:.2f}. Summaries: {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -30,8 +30,11 @@ class Config(metaclass=Singleton):
         self.mermaid_engine = self._get("MERMAID_ENGINE", "nodejs")
         self.puppeteer_config = self._get("PUPPETEER_CONFIG", "")
         self.mmdc = self._get("MMDC", "mmdc")
-        
-        self.total_cost = 0.0
+        # The rendered diagrams are cached by their code and size; set MERMAID_CACHE_DIR to "" to disable the cache.
+        self.mermaid_cache_dir = self._get("MERMAID_CACHE_DIR", str(WORKSPACE_ROOT / ".cache" / "mermaid"))
+        self.mermaid_max_workers = self._get_int("MERMAID_MAX_WORKERS", 4)
+        # The mermaid script loaded by the pages of the `playwright` engine.
+        self.mermaid_js_url = self._get("MERMAID_JS_URL", "https://cdn.jsdelivr.net/npm/mermaid@10/dist/mermaid.min.js")
         
         self.github_token = self._get("GITHUB_TOKEN", "")
         self.config_list = self._get("OAI_CONFIG_LIST", {})
@@ -42,12 +45,63 @@ class Config(metaclass=Singleton):
             "timeout": 250,
             "stream": False,
         }
+        # The model used by the roles to choose their next state; defaults to the models of the config list.
+        self.router_model = self._get("ROUTER_MODEL", "")
+        # Stream the tokens of the LLM calls made by the roles and actions to the Chainlit UI.
+        self.llm_stream = str(self._get("LLM_STREAM", False)).lower() in ["true", "1", "yes"]
         logger.info(f"Config is loaded: {self.config_list}")
 
-        self.artifacts = dict(docs={}, code={})
+        # LLM response cache shared across roles and runs.
+        self.llm_cache_enabled = str(self._get("LLM_CACHE_ENABLED", True)).lower() in ["true", "1", "yes"]
+        self.llm_cache_path = self._get("LLM_CACHE_PATH", str(WORKSPACE_ROOT / ".cache" / "llm_cache.db"))
+        self.llm_cache_ttl = self._get_int("LLM_CACHE_TTL", 7 * 24 * 60 * 60)
+        self.llm_cache_max_entries = self._get_int("LLM_CACHE_MAX_ENTRIES", 10000)
+
+        # The cost (in dollars) and token ceilings of a run; a run stops once it reaches one.
+        self.run_max_cost = self._get_float("RUN_MAX_COST", None)
+        self.run_max_tokens = self._get_int("RUN_MAX_TOKENS", None)
+        # The fraction of a budget from which the roles switch to the fallback model and a shorter history.
+        self.budget_soft_limit = self._get_float("BUDGET_SOFT_LIMIT", 0.8)
+        self.budget_fallback_model = self._get("BUDGET_FALLBACK_MODEL", "")
+        # The prices of the models in dollars per 1K tokens, e.g. {"gpt-4o": [0.0025, 0.01]}, on top of
+        # the defaults, and the model of each alias, e.g. {"my-azure-deployment": "gpt-4o"}.
+        self.model_prices = self._get("MODEL_PRICES", {})
+        self.model_aliases = self._get("MODEL_ALIASES", {})
+        # The completion tokens assumed when predicting the cost of a request without max_tokens,
+        # and the smallest completion a request is still sent for when its budget is almost spent.
+        self.expected_completion_tokens = self._get_int("EXPECTED_COMPLETION_TOKENS", 1000)
+        self.min_completion_tokens = self._get_int("MIN_COMPLETION_TOKENS", 256)
+        # Caps the consecutive auto replies of the agents of every role.
+        self.max_consecutive_auto_reply = self._get_int("MAX_CONSECUTIVE_AUTO_REPLY", None)
+
+        # The profiles of the data sources are cached by path, and computed again when the size and
+        # mtime (or the content, with PROFILE_CACHE_CONTENT_HASH) of a source change; "" disables the cache.
+        self.profile_cache_dir = self._get("PROFILE_CACHE_DIR", str(WORKSPACE_ROOT / ".cache" / "profiles"))
+        self.profile_cache_content_hash = str(self._get("PROFILE_CACHE_CONTENT_HASH", False)).lower() in ["true", "1", "yes"]
+
+        # The persistent kernels that execute the python code of the AnalyzeData action: the modules
+        # they import as they start, the number started in advance and their limits (MB and seconds).
+        self.kernel_preload = self._get("KERNEL_PRELOAD", ["pandas", "numpy"])
+        self.kernel_pool_size = self._get_int("KERNEL_POOL_SIZE", 1)
+        self.kernel_memory_limit = self._get_int("KERNEL_MEMORY_LIMIT", 4096)
+        self.kernel_cpu_limit = self._get_int("KERNEL_CPU_LIMIT", 300)
+        self.kernel_timeout = self._get_int("KERNEL_TIMEOUT", 600)
+
+        # The knowledge base of the documents and the code of the past runs, retrieved into the
+        # `past_artifacts` placeholder, with local hashing embeddings or the 'openai' embeddings.
+        self.knowledge_base_enabled = str(self._get("KNOWLEDGE_BASE_ENABLED", True)).lower() in ["true", "1", "yes"]
+        self.knowledge_base_path = self._get("KNOWLEDGE_BASE_PATH", str(WORKSPACE_ROOT / ".cache" / "knowledge_base"))
+        self.knowledge_base_embeddings = self._get("KNOWLEDGE_BASE_EMBEDDINGS", "hashing")
+        self.knowledge_base_embedding_model = self._get("KNOWLEDGE_BASE_EMBEDDING_MODEL", "text-embedding-3-small")
+
+        # A request whose similarity to the request of a past run (on data with the same columns) is at
+        # least FORK_MIN_SIMILARITY may be forked from it; its tasks then get the outputs of the past
+        # run, each truncated to FORK_MAX_TOKENS, to edit them.
+        self.fork_min_similarity = self._get_float("FORK_MIN_SIMILARITY", 0.8)
+        self.fork_max_tokens = self._get_int("FORK_MAX_TOKENS", 4000)
+
         self.project_dir = WORKSPACE_ROOT
         self.package_dir = WORKSPACE_ROOT
-        self.use_chainlit = False
         
 
     def _init_with_config_files_and_env(self, configs: dict, yaml_file):
@@ -62,12 +116,26 @@ class Config(metaclass=Singleton):
             yaml_data = yaml.safe_load(file)
             if not yaml_data:
                 return
-            os.environ.update({k: v for k, v in yaml_data.items() if isinstance(v, str) or isinstance(v, dict)})
+            os.environ.update({k: v for k, v in yaml_data.items() if isinstance(v, str)})
             configs.update(yaml_data)
 
     def _get(self, *args, **kwargs):
         return self._configs.get(*args, **kwargs)
 
+    def _get_int(self, key, default=None):
+        "Return the value as an int, or None if it is set to an empty value."
+        value = self._get(key, default)
+        if value is None or value == "":
+            return None
+        return int(value)
+
+    def _get_float(self, key, default=None):
+        "Return the value as a float, or None if it is set to an empty value."
+        value = self._get(key, default)
+        if value is None or value == "":
+            return None
+        return float(value)
+
     def get(self, key, *args, **kwargs):
         """Search for a value in config/key.yaml, config/config.yaml, and env; raise an error if not found"""
         value = self._get(key, *args, **kwargs)
@@ -0,0 +1,64 @@
+import threading
+import uuid
+from pathlib import Path
+
+from appgen.utils.budget import BudgetTracker
+from appgen.utils.outputs import OutputDict
+from appgen.utils.telemetry import Tracer
+
+
+class RunContext:
+    """
+    The state of a single TaskChain run.
+
+    The run context is created by the TaskChain and threaded through the Environment, the
+    Roles and the Actions, so that several runs can be served by the same process without
+    sharing their artifacts or their costs.
+
+    Args:
+        use_chainlit (bool): Whether the run displays its progress on the Chainlit UI.
+        project_directory (Path, optional): The directory where the run saves its artifacts.
+        stream (bool): Whether the LLM calls of the async execution path stream their tokens
+            to the Chainlit UI.
+        auto_reply (bool): Whether the agents reply automatically instead of asking the human
+            for input, e.g. in batch mode.
+        budget (BudgetTracker, optional): The cost and token budgets of the run, its tasks
+            and its roles. Defaults to no limit.
+    """
+
+    def __init__(
+            self,
+            use_chainlit: bool = False,
+            project_directory: Path = None,
+            stream: bool = False,
+            auto_reply: bool = False,
+            budget: BudgetTracker = None
+        ):
+        self.run_id = uuid.uuid4().hex
+        self.use_chainlit = use_chainlit
+        self.stream = use_chainlit and stream
+        self.auto_reply = auto_reply
+        # The spans of the tasks, roles, actions and LLM calls of the run.
+        self.tracer = Tracer(trace_id=self.run_id)
+        self.budget = budget or BudgetTracker()
+        self.project_directory = project_directory
+        self.artifacts = dict(docs=OutputDict(), code=OutputDict())
+        self.total_cost = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def resources_dir(self) -> Path:
+        "The directory where the run saves the resources (e.g. diagrams) displayed on the UI."
+        return Path("resources") / self.run_id
+
+    def add_cost(self, cost: float) -> float:
+        "Add the cost to the running total of the run and return the new total."
+        with self._lock:
+            self.total_cost += cost
+            return self.total_cost
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"run_id:{self.run_id}\nuse_chainlit:{self.use_chainlit}\nproject_directory:{self.project_directory}\ntotal_cost:{self.total_cost:.2f}"
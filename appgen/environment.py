@@ -3,10 +3,13 @@ import chainlit as cl
 import pprint
 
 from appgen.utils import logger
-from appgen.config import CONFIG
+from appgen.context import RunContext
 from appgen.utils.write_utils import save_document, save_code
 from appgen.utils.github_utils import push_to_github
+from appgen.utils.outputs import OutputDict, OutputList
 
+# The list fields of the environment that tasks append their outputs to.
+OUTPUT_FIELDS = ["requirements", "design", "backlog"]
 
 class Environment:
 
@@ -19,16 +22,29 @@ class Environment:
             backlog: list = None,
             team: dict = None,
             project_directory: Path = None,
+            run_context: RunContext = None,
+            data_sources: list = None,
+            data_profile: str = None,
+            fork: dict = None,
             **kwargs
         ):
         
         self.request_prompt = request_prompt
-        self.codebase = codebase
-        self.requirements = requirements
-        self.design = design
-        self.backlog = backlog
+        # The outputs of the tasks remember the task that wrote them, see `get_outputs`.
+        self.codebase = OutputDict(codebase) if codebase is not None else None
+        self.requirements = OutputList(requirements) if requirements is not None else None
+        self.design = OutputList(design) if design is not None else None
+        self.backlog = OutputList(backlog) if backlog is not None else None
         self.team = team
         self.project_directory = project_directory
+        self.run_context = run_context or RunContext(project_directory=project_directory)
+        # The paths of the data sources given with the request, and the Markdown summary of
+        # their profiles (see `appgen.utils.profiler`), used as the `data_profile` placeholder.
+        self.data_sources = data_sources or []
+        self.data_profile = data_profile or "No data source was given yet."
+        # The past run this run is forked from, if any: its project, its request and the outputs
+        # of each of its tasks, which the tasks edit instead of starting over (see `Task.get_delta_prompt`).
+        self.fork = fork
 
 
     def __repr__(self):
@@ -49,9 +65,55 @@ class Environment:
             "design": self.design,
             "backlog": self.backlog,
             "team": self.team,
-            "project_directory": self.project_directory
+            "project_directory": self.project_directory,
+            "data_sources": self.data_sources,
+            "data_profile": self.data_profile
         }
 
+    def get_outputs(self, task_name: str) -> dict:
+        """
+        Return what the task added to the environment fields and the artifacts. The outputs are
+        told apart by the task that wrote them, so that tasks running at the same time are not
+        credited with each other's outputs.
+        """
+        outputs = {field: getattr(self, field).written_by(task_name) for field in OUTPUT_FIELDS}
+        outputs["codebase"] = self.codebase.written_by(task_name)
+        outputs["docs"] = self.run_context.artifacts["docs"].written_by(task_name)
+        outputs["code"] = self.run_context.artifacts["code"].written_by(task_name)
+        return outputs
+
+    def apply_outputs(self, outputs: dict):
+        "Apply the outputs of a task returned by `get_outputs`, e.g. to reload them from a previous run."
+        for field in OUTPUT_FIELDS:
+            items = getattr(self, field)
+            items.extend([item for item in outputs.get(field, []) if item not in items])
+        self.codebase.update(outputs.get("codebase", {}))
+        self.run_context.artifacts["docs"].update(outputs.get("docs", {}))
+        self.run_context.artifacts["code"].update(outputs.get("code", {}))
+
+    def get_state(self) -> dict:
+        "Return the state of the environment, the artifacts and the conversations of the team, e.g. to checkpoint it."
+        return dict(
+            fields={field: getattr(self, field) for field in OUTPUT_FIELDS},
+            codebase=self.codebase,
+            artifacts=self.run_context.artifacts,
+            total_cost=self.run_context.total_cost,
+            conversations={name: role.get_conversations() for name, role in self.team.items()},
+        )
+
+    def set_state(self, state: dict):
+        "Restore the state returned by `get_state`."
+        for field in OUTPUT_FIELDS:
+            setattr(self, field, OutputList(state["fields"][field]))
+        self.codebase = OutputDict(state["codebase"])
+        self.run_context.artifacts.update(
+            {name: OutputDict(artifacts) for name, artifacts in state["artifacts"].items()}
+        )
+        self.run_context.total_cost = state["total_cost"]
+        for name, conversations in state["conversations"].items():
+            if name in self.team:
+                self.team[name].set_conversations(conversations, self.team)
+
     def get_role(self, role_name: str):
         role = self.team.get(role_name, None)
         if not role:
@@ -78,7 +140,7 @@ class Environment:
     def _setup_project_env(self):
         "Setup the package directory and write the requirements.txt."
         doc_name = "backlog"
-        backlog_class = CONFIG.artifacts["docs"].get(doc_name, None)
+        backlog_class = self.run_context.artifacts["docs"].get(doc_name, None)
         if backlog_class is None:
             logger.warning(f"The Development Backlog document named '{doc_name}' wasn't found. Cannot save the requirements.txt.")
         else:
@@ -90,12 +152,13 @@ class Environment:
     def _save_artifacts(self):
         logger.info("Saving artifacts...")
 
-        if "docs" in CONFIG.artifacts:
-            docs = CONFIG.artifacts["docs"]
+        artifacts = self.run_context.artifacts
+        if "docs" in artifacts:
+            docs = artifacts["docs"]
             for name, content_class in docs.items():
                 save_document(content_class, name+".md", self.project_directory)
-        if "code" in CONFIG.artifacts:
-            code = CONFIG.artifacts["code"]
+        if "code" in artifacts:
+            code = artifacts["code"]
             for filename, code in code.items():
                 logger.debug("Filename:{}. Code:{}".format(filename, code))
                 save_code(code, filename, self.project_directory)
@@ -13,6 +13,10 @@ async def ask_helper(func, **kwargs):
 
 
 def show_message(assistant, message, recipient):
+    cl.run_sync(a_show_message(assistant, message, recipient))
+
+
+async def a_show_message(assistant, message, recipient):
     if isinstance(message, dict):
         parsed_doc = message.get("parsed_doc", None)
         
@@ -31,42 +35,34 @@ def show_message(assistant, message, recipient):
             doc = make_pretty(doc)
             
         if not doc.startswith("The Client makes the following request:"):
-            cl.run_sync(cl.Message(
+            await cl.Message(
                 content=doc,
                 author=assistant.name,
                 elements=elements
             ).send()
-            )
 
-
-            cl.run_sync(
-                cl.Message(
-                    content=f'**The {assistant.name} wants you to review their work above before handing off.**',
-                ).send()
-            )
-    
-    elif recipient.human_input_mode != "NEVER" and "The Client makes the following request: " not in message:
-        cl.run_sync(
-            cl.Message(
-                content=f'{make_pretty(message)}',
-                author=assistant.name
-            ).send()
-        )
-        cl.run_sync(
-            cl.Message(
+            await cl.Message(
                 content=f'**The {assistant.name} wants you to review their work above before handing off.**',
             ).send()
-        )
+    
+    elif recipient.human_input_mode != "NEVER" and "The Client makes the following request: " not in message:
+        await cl.Message(
+            content=f'{make_pretty(message)}',
+            author=assistant.name
+        ).send()
+        await cl.Message(
+            content=f'**The {assistant.name} wants you to review their work above before handing off.**',
+        ).send()
     elif assistant.name == "CodingAssistant" or recipient.name == "CodingAssistant":
         language = "bash" if message.startswith("exitcode:") else None
         if message.startswith("user said:") or "TERMINATE" in message: return
-        cl.run_sync(
-            cl.Message(
-                content=f'{make_pretty(message)}',
-                author=assistant.name,
-                language=language
-            ).send()
-        )
+        await cl.Message(
+            content=f'{make_pretty(message)}',
+            author=assistant.name,
+            language=language
+        ).send()
+
+
 class ChainlitAssistantAgent(AssistantAgent):
 
 
@@ -86,37 +82,54 @@ class ChainlitAssistantAgent(AssistantAgent):
             silent=silent,
         )
 
+    async def a_send(
+        self,
+        message: Union[Dict, str],
+        recipient: Agent,
+        request_reply: Optional[bool] = None,
+        silent: Optional[bool] = False,
+    ):
+        await a_show_message(self, message, recipient)
+
+        await super(ChainlitAssistantAgent, self).a_send(
+            message=message,
+            recipient=recipient,
+            request_reply=request_reply,
+            silent=silent,
+        )
+
 
 class ChainlitUserProxyAgent(UserProxyAgent):
     def get_human_input(self, prompt: str) -> str:
+        return cl.run_sync(self.a_get_human_input(prompt))
+
+    async def a_get_human_input(self, prompt: str) -> str:
         if prompt.startswith(
             ("Provide feedback to", "Please give feedback to")
         ):
-            res = cl.run_sync(
-                ask_helper(
-                    cl.AskActionMessage,
-                    content="**Please make a selection from the options below:**\n**Continue Without Feedback or Provide Feedback?**",
-                    actions=[
-                        cl.Action(
-                            name="continue", 
-                            value="continue", 
-                            label="✅ Continue"
-                        ),
-                        cl.Action(
-                            name="feedback",
-                            value="feedback",
-                            label="💬 Provide feedback",
-                        ),  
-                    ],
-                    timeout=2000
-                )
+            res = await ask_helper(
+                cl.AskActionMessage,
+                content="**Please make a selection from the options below:**\n**Continue Without Feedback or Provide Feedback?**",
+                actions=[
+                    cl.Action(
+                        name="continue", 
+                        value="continue", 
+                        label="✅ Continue"
+                    ),
+                    cl.Action(
+                        name="feedback",
+                        value="feedback",
+                        label="💬 Provide feedback",
+                    ),  
+                ],
+                timeout=2000
             )
             if res.get("value") == "continue":
                 return "exit"
             # if res.get("value") == "exit":
             #     return "exit"
 
-        reply = cl.run_sync(ask_helper(cl.AskUserMessage, content="", timeout=2000))
+        reply = await ask_helper(cl.AskUserMessage, content="", timeout=2000)
         return reply["content"].strip()
     
 
@@ -136,3 +149,18 @@ class ChainlitUserProxyAgent(UserProxyAgent):
             silent=silent,
         )
 
+    async def a_send(
+        self,
+        message: Union[Dict, str],
+        recipient: Agent,
+        request_reply: Optional[bool] = None,
+        silent: Optional[bool] = False,
+    ):
+        await a_show_message(self, message, recipient)
+
+        await super(ChainlitUserProxyAgent, self).a_send(
+            message=message,
+            recipient=recipient,
+            request_reply=request_reply,
+            silent=silent,
+        )
@@ -1,16 +1,23 @@
-from pydantic import BaseModel
-from typing import Dict, List, Optional, Union, Any
+import asyncio
+import json
+import re
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Union, Any, Tuple
 
 from appgen.config import CONFIG
 from appgen.utils.logs import logger
-from appgen.utils.cost import estimate_cost_of_completion
+from appgen.utils.llm import create_completion, a_create_completion, AsyncOpenAIWrapper
 from appgen.actions import get_action
 from appgen.roles.chainlit_wrappers import (
     ChainlitUserProxyAgent, 
     ChainlitAssistantAgent
 )
+from appgen.utils.stream import ChainlitTokenStream
+from appgen.utils.history import HistoryManager, format_history
+from autogen import OpenAIWrapper
 from autogen.agentchat import (
     Agent,
+    ConversableAgent,
     GroupChat, 
     UserProxyAgent, 
     AssistantAgent
@@ -27,9 +34,7 @@ STATE_TEMPLATE = """Conversation records:
 
 Based on your conversation records so far, reflect and decide which stage you should enter or stay in based on these records.
 Remember that the last message in the conversation records is the most recent message sent to you.
-You must return a reply like the format below:
-STATE: <INFO>
-RESPONSE: <RESPONSE>
+{reply_format}
 
 <INFO> is a number between 0-{n_states} to choose the most suitable next state to follow according to the understanding
 of the conversation.
@@ -43,6 +48,21 @@ how you will handle the request with your expertise. Just explain your plan in a
 explain your rationale for choosing a particular state to follow here.
 """
 
+TEXT_REPLY_FORMAT = """You must return a reply like the format below:
+STATE: <INFO>
+RESPONSE: <RESPONSE>"""
+
+TOOL_REPLY_FORMAT = """You must reply by calling the `choose_state` function with <INFO> as the `state` and <RESPONSE> as the `response`."""
+
+STATE_RETRY_TEMPLATE = """Your reply could not be used: {error}
+{reply_format}"""
+
+# Sent back to the sender when the router never returned a valid state.
+STATE_CLARIFICATION_MESSAGE = """I could not decide how to handle your last message. Could you rephrase it, or tell me what you expect me to do next?"""
+
+# The history of a role once a budget reaches its soft limit, unless the role sets its own.
+DEFAULT_FALLBACK_HISTORY = {"max_tokens": 4000, "keep_last_n": 2}
+
 DEFAULT_SYSTEM_MESSAGE = """You are a helpful AI assistant.
 Solve tasks using your coding and language skills.
 In the following cases, suggest python code (in a python coding block) or shell script (in a sh coding block) for the user to execute.
@@ -69,23 +89,71 @@ class RoleSetting(BaseModel):
         return self.__str__()
     
 
+class StateDecision(BaseModel):
+    """The next state chosen by a role and its response to the sender."""
+    state: int = Field(description="The index of the next state, or -1 if the goal is completed.")
+    response: str = Field(description="The response to the sender explaining the plan and the chosen state.")
+
+    @classmethod
+    def as_tool(cls) -> Dict:
+        "Return the `choose_state` tool that the router is forced to call."
+        return {
+            "type": "function",
+            "function": {
+                "name": "choose_state",
+                "description": "Choose the next state and respond to the sender.",
+                "parameters": cls.model_json_schema(),
+            }
+        }
+
+
 class Role:
     """Role/Agent"""
 
-    def __init__(self, role="", goal="", constraints="", **kwargs):
+    def __init__(self, role="", goal="", constraints="", run_context=None, use_async=False, history=None, router=None, budget=None, **kwargs):
         self._setting = RoleSetting(role=role, goal=goal, constraints=constraints)
         self._role_id = str(self._setting)
         self.llm_config = CONFIG.llm_config.copy()
+        self.run_context = run_context
+        # When use_async is set, the role reacts through the async reply functions and
+        # must be driven with `a_initiate_chat` (see Task.a_execute).
+        self.use_async = use_async
+        self.a_client = AsyncOpenAIWrapper(**self.llm_config) if use_async else None
+        # Keeps the history sent to the LLM within the token budget of the role, if any.
+        self.history = HistoryManager(**(history or {}))
+        # The router chooses the next state of the role, usually with a smaller and faster
+        # model than the one writing the documents and the code.
+        router = dict(router or {})
+        self.single_action_shortcut = router.pop("single_action_shortcut", False)
+        # The state is returned as the arguments of a tool call, unless the backend does not support tools.
+        self.use_tools = router.pop("use_tools", True)
+        self.max_state_retries = router.pop("max_state_retries", 2)
+        self.router_config = self._get_router_config(router)
+        self.router_client = None
+        if self.router_config is not None:
+            self.router_client = (AsyncOpenAIWrapper if use_async else OpenAIWrapper)(**self.router_config)
+        # Once a budget of the run, the task or the role reaches its soft limit, the role
+        # switches to the fallback model and history for the rest of the run.
+        budget = dict(budget or {})
+        self.fallback_model = budget.pop("fallback_model", CONFIG.budget_fallback_model)
+        self.fallback_history = budget.pop("fallback_history", DEFAULT_FALLBACK_HISTORY)
+        self.is_degraded = False
+        if budget:
+            self.run_context.budget.set_role_budget(self.role, **budget)
         self._user = None
         self.actions = []
         self.watch_list = []
 
     @classmethod
-    def from_dict(cls, data):
-        role_class = cls(**data)
+    def from_dict(cls, data, run_context=None, use_async=False):
+        role_class = cls(**data, run_context=run_context, use_async=use_async)
         role_class.init_react_agent(**data)
         if actions:=data.get("actions"):
-            actions = [get_action(action_name)(role=role_class) for action_name in actions]
+            action_options = data.get("action_options", {})
+            actions = [
+                get_action(action_name)(role=role_class, **action_options.get(action_name, {}))
+                for action_name in actions
+            ]
             role_class.add_actions(actions)
         if watch_list:=data.get("watch_list"):
             role_class.watch(watch_list)
@@ -98,6 +166,54 @@ class Role:
     def get_user(self):
         return self._user
 
+    def get_conversations(self) -> Dict:
+        "Return the chat messages of the agents of the role, keyed by the name of the other agent."
+        return {
+            "user": {agent.name: messages for agent, messages in self._user._oai_messages.items()},
+            "assistant": {agent.name: messages for agent, messages in self._react_assistant._oai_messages.items()},
+        }
+
+    def set_conversations(self, conversations: Dict, team: Dict):
+        "Restore the chat messages returned by `get_conversations`, given the team of the role."
+        peers = {name: role.get_user() for name, role in team.items()}
+        peers[self._react_assistant.name] = self._react_assistant
+        for name, messages in conversations.get("user", {}).items():
+            if name in peers:
+                self._user._oai_messages[peers[name]] = messages
+        for name, messages in conversations.get("assistant", {}).items():
+            if name == self._user.name:
+                self._react_assistant._oai_messages[self._user] = messages
+
+    def _get_router_config(self, router: Dict) -> Optional[Dict]:
+        """
+        Return the llm_config of the router, or None if the router uses the llm_config of the role.
+
+        The router settings (e.g. model, temperature, max_tokens) of the role take precedence over
+        the ROUTER_MODEL of the config, and override every config of the config list.
+        """
+        overrides = {"model": CONFIG.router_model} if CONFIG.router_model else {}
+        overrides.update(router)
+        if not overrides:
+            return None
+        llm_config = self.llm_config.copy()
+        llm_config["config_list"] = [{**config, **overrides} for config in self.llm_config["config_list"]]
+        return llm_config
+
+    def _degrade_if_over_budget(self):
+        "Switch the role to its fallback model and history once a budget reaches its soft limit."
+        if self.is_degraded or not self.run_context.budget.is_soft_exceeded():
+            return
+        self.is_degraded = True
+        logger.warning(f"{self.role} reached the soft limit of its budget. Switching to the model '{self.fallback_model}' and a shorter history.")
+        self.history = HistoryManager(**self.fallback_history)
+        if not self.fallback_model:
+            return
+        self.llm_config["config_list"] = [{**config, "model": self.fallback_model} for config in self.llm_config["config_list"]]
+        for agent in (self._user, self._react_assistant):
+            agent.client = OpenAIWrapper(**self.llm_config)
+        if self.use_async:
+            self.a_client = AsyncOpenAIWrapper(**self.llm_config)
+
     def _get_prefix(self):
         return PREFIX_TEMPLATE.format(**self._setting.model_dump())
 
@@ -107,7 +223,7 @@ class Role:
     def watch(self, watch_list:list):
         self._user.register_reply(
             watch_list,
-            self._react
+            self._a_react if self.use_async else self._react
         )
 
     def init_react_agent(
@@ -132,6 +248,10 @@ class Role:
             None
         """
         self.num_of_react_loops = num_of_react_loops
+        if CONFIG.max_consecutive_auto_reply is not None:
+            max_consecutive_auto_reply = min(max_consecutive_auto_reply, CONFIG.max_consecutive_auto_reply)
+        if self.run_context.auto_reply:
+            human_input_mode = "NEVER"
 
         user_agent_params = dict(  
             name=self.role,
@@ -146,7 +266,7 @@ class Role:
             llm_config=self.llm_config
         )
 
-        if CONFIG.use_chainlit:
+        if self.run_context.use_chainlit:
             self._user = ChainlitUserProxyAgent(**user_agent_params)
         else:
             self._user = UserProxyAgent(**user_agent_params)
@@ -160,11 +280,81 @@ class Role:
             max_consecutive_auto_reply=max_consecutive_auto_reply,
         )
 
-        if CONFIG.use_chainlit:
+        if self.run_context.use_chainlit:
             self._react_assistant = ChainlitAssistantAgent(**react_agent_params)
         else:
             self._react_assistant = AssistantAgent(**react_agent_params)
 
+        self._register_replies()
+
+    def _register_replies(self):
+        """
+        Register the reply functions of the agents of the role in front of autogen's defaults (the
+        replies registered last are tried first). The LLM replies go through `create_completion`,
+        so that they are cached, traced and admitted and charged to the budgets like the actions.
+        The async roles also get async termination and code execution replies, since
+        `a_generate_reply` would call the sync ones inline and block the event loop.
+        """
+        for agent in (self._user, self._react_assistant):
+            if self.use_async:
+                agent.register_reply([Agent, None], self._a_generate_oai_reply)
+                agent.register_reply([Agent, None], self._a_generate_code_execution_reply)
+                agent.register_reply([Agent, None], ConversableAgent.a_check_termination_and_human_reply)
+            else:
+                agent.register_reply([Agent, None], self._generate_oai_reply)
+                agent.register_reply([Agent, None], ConversableAgent.generate_code_execution_reply)
+                agent.register_reply([Agent, None], ConversableAgent.check_termination_and_human_reply)
+
+    def _generate_oai_reply(
+            self,
+            recipient: Agent,
+            messages: Optional[List[Dict]] = None,
+            sender: Optional[Agent] = None,
+            config: Optional[Any] = None
+        ) -> Tuple[bool, Union[str, Dict, None]]:
+        "autogen's `generate_oai_reply`, through `create_completion` and in a span of the role."
+        if recipient.client is None:
+            return False, None
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+        with self.run_context.tracer.span(self.role, kind="role"):
+            self._degrade_if_over_budget()
+            client = recipient.client if config is None else config
+            response = create_completion(
+                client, self.run_context, context=messages[-1].pop("context", None), messages=recipient._oai_system_message + messages
+            )
+        return True, client.extract_text_or_function_call(response)[0]
+
+    async def _a_generate_oai_reply(
+            self,
+            recipient: Agent,
+            messages: Optional[List[Dict]] = None,
+            sender: Optional[Agent] = None,
+            config: Optional[Any] = None
+        ) -> Tuple[bool, Union[str, Dict, None]]:
+        "The async version of `_generate_oai_reply`, with the async client of the role."
+        if recipient.client is None:
+            return False, None
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+        with self.run_context.tracer.span(self.role, kind="role"):
+            self._degrade_if_over_budget()
+            client = self.a_client if config is None else config
+            response = await a_create_completion(
+                client, self.run_context, context=messages[-1].pop("context", None), messages=recipient._oai_system_message + messages
+            )
+        return True, client.extract_text_or_function_call(response)[0]
+
+    async def _a_generate_code_execution_reply(
+            self,
+            recipient: Agent,
+            messages: Optional[List[Dict]] = None,
+            sender: Optional[Agent] = None,
+            config: Optional[Any] = None
+        ) -> Tuple[bool, Union[str, Dict, None]]:
+        "Execute the code blocks of the last messages in a worker thread, since an execution may take minutes."
+        return await asyncio.to_thread(recipient.generate_code_execution_reply, messages, sender, config)
+
     def _react(self,
             recipient: Optional[Agent] = None,
             messages: Optional[List[Dict]] = None,
@@ -185,12 +375,15 @@ class Role:
         Returns:
             Union[str, Dict, None]: The reaction response, or None if there was no reaction.
         """
-        
-    
-        client = recipient.client if config is None else config
         if messages is None:
             messages = recipient._oai_messages[sender]
 
+        with self.run_context.tracer.span(recipient.name, kind="role"):
+            self._degrade_if_over_budget()
+            client = recipient.client if config is None else config
+            return self._react_loop(recipient, messages, sender, client)
+
+    def _react_loop(self, recipient: Agent, messages: List[Dict], sender: Agent, client: Any) -> Tuple[bool, Union[str, Dict, None]]:
         for _ in range(self.num_of_react_loops):
             rsp, state = self._think(messages, recipient, sender, client)
         
@@ -201,7 +394,7 @@ class Role:
                 if state == -1:
                     return True, rsp
                 logger.info(f"{recipient.name}: {rsp}")
-                if CONFIG.use_chainlit:
+                if self.run_context.use_chainlit:
                     cl.run_sync(cl.Message(
                         content=rsp,
                         author=recipient.name
@@ -213,11 +406,65 @@ class Role:
             if state != -1:
                 msg = f"**{recipient.name} is performing the following action: {self.actions[state].name}.**"
                 logger.info(msg)
-                if CONFIG.use_chainlit:
+                if self.run_context.use_chainlit:
                     cl.run_sync(cl.Message(
                         content=msg
                     ).send())
-                rsp = self.actions[state]._run(client=client, messages=messages, system_message=recipient._oai_system_message)
+                with self.run_context.tracer.span(self.actions[state].name, kind="action"):
+                    rsp = self.actions[state]._run(client=client, messages=messages, system_message=recipient._oai_system_message)
+                return True, rsp
+            
+            return False, "TERMINATE"    
+
+    async def _a_react(self,
+            recipient: Optional[Agent] = None,
+            messages: Optional[List[Dict]] = None,
+            sender: Optional[Agent] = None,
+            config: Optional[GroupChat] = None
+        ) -> Union[str, Dict, None]:
+        """
+        The async version of `_react`, registered as the reply function of async roles.
+        """
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+
+        with self.run_context.tracer.span(recipient.name, kind="role"):
+            self._degrade_if_over_budget()
+            client = self.a_client if config is None else config
+            return await self._a_react_loop(recipient, messages, sender, client)
+
+    async def _a_react_loop(self, recipient: Agent, messages: List[Dict], sender: Agent, client: Any) -> Tuple[bool, Union[str, Dict, None]]:
+        for _ in range(self.num_of_react_loops):
+            stream = ChainlitTokenStream(author=recipient.name) if self.run_context.stream else None
+            rsp, state = await self._a_think(messages, recipient, sender, client, stream=stream)
+        
+            if rsp == "" and state == -1:
+                return True, "TERMINATE" 
+            
+            if rsp != "":
+                if state == -1:
+                    return True, rsp
+                logger.info(f"{recipient.name}: {rsp}")
+                if stream is not None and stream.has_tokens:
+                    await stream.send()
+                elif self.run_context.use_chainlit:
+                    await cl.Message(
+                        content=rsp,
+                        author=recipient.name
+                    ).send()
+                messages.append({
+                    "role": "assistant",
+                    "content": rsp
+                })
+            if state != -1:
+                msg = f"**{recipient.name} is performing the following action: {self.actions[state].name}.**"
+                logger.info(msg)
+                if self.run_context.use_chainlit:
+                    await cl.Message(
+                        content=msg
+                    ).send()
+                with self.run_context.tracer.span(self.actions[state].name, kind="action"):
+                    rsp = await self.actions[state]._a_run(client=client, messages=messages, system_message=recipient._oai_system_message)
                 return True, rsp
             
             return False, "TERMINATE"    
@@ -245,50 +492,300 @@ class Role:
         Raises:
             None: This function does not raise any exceptions.
         """
-        # if len(self.tools) == 1:
-        #     return "", 0
         is_empty_msg = messages[-1].get("content", "").lower() == ""
         is_terminate_msg = messages[-1].get("content", "").lower() in ["terminate", "exit"]
 
         if is_empty_msg or is_terminate_msg:
             return "", -1
+        if (shortcut := self._get_shortcut_state(messages)) is not None:
+            return "", shortcut
+        client = self.router_client or client
 
         info_msg = f"**{recipient.name} is thinking...**"
         logger.info(info_msg)
-        if CONFIG.use_chainlit:
+        if self.run_context.use_chainlit:
                 cl.run_sync(cl.Message(
                     content=info_msg
                 ).send()
             )
 
+        oai_context = messages[-1].pop("context", None)
+        history = self.history.compact(messages, client, self.run_context)
+        prompt = recipient._oai_system_message + self._get_state_prompt(history, recipient, sender)
+
+        for attempt in range(self.max_state_retries + 1):
+            response = create_completion(
+                client, self.run_context, context=oai_context, messages=prompt, **self._get_state_kwargs()
+            )
+            try:
+                return self._parse_state_decision(response)
+            except ValueError as error:
+                logger.warning(f"{recipient.name} returned an invalid state (attempt {attempt + 1}): {error}")
+                prompt = prompt + self._get_state_retry_prompt(response, error)
+        return self._get_fallback_decision(response)
+
+    async def _a_think(
+            self, 
+            messages: List[Dict], 
+            recipient: Optional[Agent] = None, 
+            sender: Optional[Agent] = None, 
+            client: Optional[AsyncOpenAIWrapper] = None,
+            stream: Optional[ChainlitTokenStream] = None
+        ) -> None:
+        """
+        The async version of `_think`.
+
+        If a stream is given, the completion is streamed and the response is forwarded
+        to the stream as soon as its state is known to be an action.
+        """
+        is_empty_msg = messages[-1].get("content", "").lower() == ""
+        is_terminate_msg = messages[-1].get("content", "").lower() in ["terminate", "exit"]
+
+        if is_empty_msg or is_terminate_msg:
+            return "", -1
+        if (shortcut := self._get_shortcut_state(messages)) is not None:
+            return "", shortcut
+        client = self.router_client or client
+
+        info_msg = f"**{recipient.name} is thinking...**"
+        logger.info(info_msg)
+        if self.run_context.use_chainlit:
+            await cl.Message(
+                content=info_msg
+            ).send()
+
+        oai_context = messages[-1].pop("context", None)
+        history = await self.history.a_compact(messages, client, self.run_context)
+        prompt = recipient._oai_system_message + self._get_state_prompt(history, recipient, sender)
+
+        for attempt in range(self.max_state_retries + 1):
+            on_token = None
+            if stream is not None:
+                on_token = (ToolStateStreamParser if self.use_tools else StateStreamParser)(stream).feed
+            response = await a_create_completion(
+                client, self.run_context, context=oai_context, messages=prompt, on_token=on_token, **self._get_state_kwargs()
+            )
+            try:
+                return self._parse_state_decision(response)
+            except ValueError as error:
+                logger.warning(f"{recipient.name} returned an invalid state (attempt {attempt + 1}): {error}")
+                prompt = prompt + self._get_state_retry_prompt(response, error)
+                if stream is not None:
+                    await stream.remove()
+        return self._get_fallback_decision(response)
+
+    def _get_shortcut_state(self, messages: List[Dict]) -> Optional[int]:
+        """
+        Return the next state without asking the router when it is known in advance, i.e. when
+        the shortcut is enabled and the role has a single action: the action is performed for
+        every message unless the sender asked to terminate.
+        """
+        if not self.single_action_shortcut or len(self.actions) != 1:
+            return None
+        if messages[-1].get("content", "").rstrip().endswith("TERMINATE"):
+            return -1
+        return 0
+
+    def _get_state_kwargs(self) -> Dict:
+        "Return the parameters of the request that force the router to call the `choose_state` tool."
+        if not self.use_tools:
+            return {}
+        tool = StateDecision.as_tool()
+        return {
+            "tools": [tool],
+            "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}}
+        }
+
+    def _parse_state_decision(self, response) -> Tuple[str, int]:
+        """
+        Return the response and the state chosen by the router, either as the arguments of
+        a `choose_state` tool call or as a `STATE:`/`RESPONSE:` text reply.
+
+        Raises:
+            ValueError: The reply could not be parsed or the state is out of range.
+        """
+        message = response.choices[0].message
+        if message.tool_calls:
+            decision = StateDecision.model_validate_json(message.tool_calls[0].function.arguments)
+            rsp, state = decision.response, decision.state
+        else:
+            rsp, state = extract_state_info(message.content or "")
+        if not -1 <= state < len(self.actions):
+            raise ValueError(f"The state must be between -1 and {len(self.actions) - 1}, got {state}.")
+        return rsp, state
+
+    def _get_state_retry_prompt(self, response, error: Exception) -> List[Dict]:
+        "Return the invalid reply and the messages asking the router to fix it."
+        retry_msg = []
+        if content := response.choices[0].message.content:
+            retry_msg.append({"role": "assistant", "content": content})
+        retry_msg.append({
+            "role": "user",
+            "content": STATE_RETRY_TEMPLATE.format(error=error, reply_format=self._get_reply_format())
+        })
+        return retry_msg
+
+    def _get_fallback_decision(self, response) -> Tuple[str, int]:
+        """
+        Return the state of the last invalid reply parsed leniently as a `STATE:`/`RESPONSE:` text,
+        from either its content or the arguments of its tool call.
+
+        If no valid state can be found, a request for clarification is sent back to the sender
+        instead, so that an invalid reply neither terminates the conversation nor stops the run.
+        """
+        message = response.choices[0].message
+        replies = [message.content or ""] + [call.function.arguments or "" for call in message.tool_calls or []]
+        for reply in replies:
+            try:
+                rsp, state = extract_state_info(reply)
+            except ValueError:
+                continue
+            if -1 <= state < len(self.actions):
+                logger.warning(f"Falling back to the state {state} parsed from the text of the last invalid reply.")
+                return rsp, state
+        logger.error(f"No valid state was returned after {self.max_state_retries + 1} attempts. Asking the sender to clarify.")
+        return STATE_CLARIFICATION_MESSAGE, -1
+
+    def _get_reply_format(self) -> str:
+        return TOOL_REPLY_FORMAT if self.use_tools else TEXT_REPLY_FORMAT
+
+    def _get_state_prompt(self, messages: List[Dict], recipient: Agent, sender: Agent) -> List[Dict]:
+        "Return the messages asking the LLM to choose the next state."
         prompt = STATE_TEMPLATE.format(
-            history=messages,
+            history=format_history(messages),
+            reply_format=self._get_reply_format(),
             recipient_name=recipient.name,
             sender_name=sender.name,
             n_states=len(self.actions),
             states=[f"{idx}: {action.name} --> {action.description}" for idx, action in enumerate(self.actions)],
         )
-        msg = [{
+        return [{
             "role": "user",
             "content": prompt
         }]
 
-        response = client.create(
-            context=messages[-1].pop("context", None), messages=recipient._oai_system_message + msg
-        )
-        estimate_cost_of_completion(response)
-        rsp = client.extract_text_or_function_call(response)[0]
-        rsp, state = extract_state_info(rsp)
 
-        if state != -1 and state >= len(self.actions):
-            logger.error(f"Invalid state index provided: {state}")
-        return rsp, state
+class StateStreamParser:
+    """
+    Parses the `STATE:`/`RESPONSE:` header of a streamed reply as soon as it arrives
+    and forwards the tokens of the response to the stream.
+
+    The response is only forwarded when the state is an action (not -1), since a
+    final response is displayed when it is sent to the other agent.
+    """
+
+    state_pattern = re.compile(r"STATE:\s*(-?\d+)\s")
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.text = ""
+        self.state = None
+        self._position = None
+
+    async def feed(self, token: str):
+        self.text += token
+        if self.state is None:
+            match = self.state_pattern.search(self.text)
+            if match is None:
+                return
+            self.state = int(match.group(1))
+        if self.state == -1:
+            return
+        if self._position is None:
+            idx = self.text.find("RESPONSE:")
+            if idx == -1:
+                return
+            self._position = idx + len("RESPONSE:")
+        new_text = self.text[self._position:]
+        if not self.stream.has_tokens:
+            # Skip the whitespace between the header and the response.
+            new_text = new_text.lstrip()
+        if new_text:
+            self._position = len(self.text)
+            await self.stream(new_text)
+
+
+class ToolStateStreamParser(StateStreamParser):
+    """
+    Parses the streamed arguments of a `choose_state` tool call as soon as they arrive
+    and forwards the decoded tokens of the response to the stream, like `StateStreamParser`.
+    """
+
+    state_pattern = re.compile(r'"state"\s*:\s*(-?\d+)\D')
+    response_pattern = re.compile(r'"response"\s*:\s*"')
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self._sent = 0
+
+    async def feed(self, token: str):
+        self.text += token
+        if self.state is None:
+            match = self.state_pattern.search(self.text)
+            if match is None:
+                return
+            self.state = int(match.group(1))
+        if self.state == -1:
+            return
+        if self._position is None:
+            match = self.response_pattern.search(self.text)
+            if match is None:
+                return
+            self._position = match.end()
+        response = decode_partial_json_string(self.text[self._position:])
+        new_text = response[self._sent:]
+        if not self.stream.has_tokens:
+            new_text = new_text.lstrip()
+        if new_text:
+            self._sent = len(response)
+            await self.stream(new_text)
+
+
+def decode_partial_json_string(raw: str) -> str:
+    """
+    Decode the content of a JSON string received so far, up to its closing quote. An escape
+    sequence cut at the end of the content (e.g. `\\` or `\\u00`) is left for the next tokens.
+    """
+    end, escaped = len(raw), False
+    for idx, char in enumerate(raw):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"':
+            end = idx
+            break
+    for cut in range(end, max(end - 6, 0) - 1, -1):
+        try:
+            return json.loads('"' + raw[:cut] + '"')
+        except ValueError:
+            continue
+    return ""
+
+
+STATE_PATTERN = re.compile(r"STATE\W*?(-?\d+)", re.IGNORECASE)
+RESPONSE_PATTERN = re.compile(r"RESPONSE[*_\s]*:[*_\s]*(.*)", re.IGNORECASE | re.DOTALL)
 
 
 def extract_state_info(input_string):
-    response = input_string.split("RESPONSE: ")
-    rsp = response[1]
-    state = response[0]
-    state = state.split("STATE: ")[1].strip()
-    return rsp, int(state)
+    """
+    Return the response and the state of a `STATE:`/`RESPONSE:` text reply.
+
+    The parsing tolerates the usual deviations of LLMs, e.g. markdown around the labels,
+    missing spaces or a JSON object with `state` and `response` keys.
+
+    Raises:
+        ValueError: The reply does not contain a state.
+    """
+    try:
+        decision = StateDecision.model_validate_json(input_string.strip().strip("`").removeprefix("json"))
+        return decision.response, decision.state
+    except ValueError:
+        pass
+    state = STATE_PATTERN.search(input_string)
+    if state is None:
+        raise ValueError("The reply does not contain a STATE.")
+    response = RESPONSE_PATTERN.search(input_string, state.end())
+    rsp = response.group(1).strip() if response else input_string[state.end():].strip()
+    return rsp, int(state.group(1))
    
\ No newline at end of file
@@ -1,14 +1,26 @@
 import json
+import asyncio
+import contextlib
+from typing import Optional
 
 from pathlib import Path
 import chainlit as cl
 
 from appgen import Environment
+from appgen.context import RunContext
 from appgen.utils import logger
+from appgen.utils.serialization import digest
+from appgen.utils.checkpoint import save_checkpoint, load_checkpoint
+from appgen.utils.task_store import TaskStore
+from appgen.utils.budget import BudgetTracker, BudgetExceededError
+from appgen.utils.kernel import close_kernel_session
+from appgen.utils.profiler import profile_sources, format_profiles, get_schema_fingerprint
+from appgen.utils.knowledge_base import get_knowledge_base
 from appgen.utils.const import AVATARS_ROOT
 from appgen.config import CONFIG
 from appgen.tasks import get_task
 from appgen.roles.role import Role
+from appgen.roles.chainlit_wrappers import ask_helper
 
 class TaskChain:
 
@@ -20,6 +32,15 @@ class TaskChain:
             root_dir: Path = None,
             use_chainlit: bool = False,
             github_token: str = None,
+            max_concurrent_tasks: int = None,
+            use_async: bool = None,
+            reuse_outputs: bool = True,
+            resume: bool = False,
+            auto_reply: bool = False,
+            max_cost: float = None,
+            max_tokens: int = None,
+            data_sources: list = None,
+            fork_from: str = None,
             **kwargs
         ):
 
@@ -27,12 +48,49 @@ class TaskChain:
         self.idea = idea
         self.project_name = project_name
         self.root_dir = root_dir
+        # The paths of the CSV, Parquet or Excel files the app is built on. They are profiled
+        # once and the profiles are given to the tasks with the `data_profile` placeholder.
+        self.data_sources = [str(path) for path in data_sources or []]
 
         with open(self.config_path, 'r', encoding="utf8") as file:
             self.config = json.load(file)
 
+        # The maximum number of tasks from the DAG that may run at the same time.
+        self.max_concurrent_tasks = max_concurrent_tasks or self.config.get("max_concurrent_tasks", 1)
+
         self.use_chainlit = use_chainlit
-        CONFIG.use_chainlit = self.use_chainlit
+
+        # Async roles must be driven with `a_execute`, sync roles with `execute`.
+        self.use_async = use_chainlit if use_async is None else use_async
+        self.run_context = RunContext(
+            use_chainlit=self.use_chainlit,
+            stream=self.use_async and CONFIG.llm_stream,
+            auto_reply=auto_reply,
+            budget=BudgetTracker(
+                max_cost=max_cost or CONFIG.run_max_cost,
+                max_tokens=max_tokens or CONFIG.run_max_tokens,
+                soft_limit=CONFIG.budget_soft_limit
+            )
+        )
+        # The error that stopped the run before all its tasks were completed, if any.
+        self.budget_error = None
+
+        # Skip the tasks whose inputs did not change since the last run of the project
+        # and reload their outputs instead.
+        self.reuse_outputs = reuse_outputs
+        self._fingerprints = {}
+        self._output_digests = {}
+
+        # The environment and the conversations are checkpointed after every task, so that
+        # a run can be resumed from the last completed task.
+        self.resume = resume
+        self._completed = []
+
+        # A new request that is a near-duplicate of a past run (see `_find_similar_run`) may be forked
+        # from it: its tasks then edit the outputs of the past run instead of starting over. `fork_from`
+        # is "auto" to fork the most similar past run, or the name of the project to fork; otherwise
+        # the similar run is only offered (in the Chat UI) or logged.
+        self.fork_from = fork_from
 
         self.use_github = github_token is not None
         if self.use_github:
@@ -43,10 +101,13 @@ class TaskChain:
 
 
         
-    def setup_environment(self):
+    def _setup(self):
         # Initialize the team 
         team = self._initialize_team()
         project_directory = self._initialize_directory()
+        self.run_context.project_directory = project_directory
+        self.task_store = TaskStore(project_directory)
+        self.checkpoint_path = project_directory / ".appgen" / "checkpoint.json.gz"
 
         # Initialize the environment
         self.environment = Environment(
@@ -56,39 +117,327 @@ class TaskChain:
             design=[],
             backlog=[],
             team=team,
-            project_directory=project_directory
+            project_directory=project_directory,
+            run_context=self.run_context,
+            data_sources=self.data_sources,
+            data_profile=self._profile_data_sources()
         )
 
 
         # Initialize the tasks
         self.tasks = []
         for task in self.config["tasks"]:
+            task = dict(task)
             task_class_name = task.pop("name")
             task_class = get_task(task_class_name)
-            self.tasks.append(task_class(**task))
+            task = task_class(name=task.pop("id", task_class_name), **task)
+            if task.budget:
+                self.run_context.budget.set_task_budget(task.name, **task.budget)
+            self.tasks.append(task)
+        self.dag = self._build_dag()
 
+    def setup_environment(self):
+        "Set up the team, the environment and the tasks, then resume the last checkpoint or fork a similar past run."
+        self._setup()
+        if self.resume:
+            self._resume()
+        else:
+            run = self._get_fork_candidate()
+            if run is not None and self._accept_fork(run):
+                self._fork(run)
+        if self.use_chainlit:
+            self.environment.create_task_list()
 
+    async def a_setup_environment(self):
+        """
+        The async version of `setup_environment`, awaited by the Chat UI: the user is asked
+        whether to fork a similar past run without blocking the event loop.
+        """
+        self._setup()
+        if self.resume:
+            self._resume()
+        else:
+            run = self._get_fork_candidate()
+            if run is not None and await self._a_accept_fork(run):
+                self._fork(run)
         if self.use_chainlit:
             self.environment.create_task_list()
 
 
     def execute(self):
-        for task in self.tasks:
-            task.execute(self.environment)
+        for task in self._topological_order():
+            if task.name in self._completed:
+                continue
+            try:
+                with self.run_context.tracer.span(task.name, kind="task") as span:
+                    if self._reload_task(task):
+                        span.set(reloaded=True)
+                    else:
+                        task.execute(self.environment)
+                        self._save_task(task)
+            except BudgetExceededError as error:
+                self._stop(error)
+                return
+            self._checkpoint(task)
 
     
     async def a_execute(self):
-        # logger.warning(cl.TaskStatus.RUNNING.name)
-        await self.environment._update_tasks_status(cl.TaskStatus.RUNNING.name)
+        if self.use_chainlit:
+            await self.environment._update_tasks_status(cl.TaskStatus.RUNNING.name)
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_tasks)
+        # The tasks that share a role do not run at the same time, since they would interleave
+        # the conversations of its agents.
+        role_locks = {name: asyncio.Lock() for name in self.environment.team}
+        running = {}
+
+        async def run(task):
+            async with semaphore:
+                with self.run_context.tracer.span(task.name, kind="task") as span:
+                    if self._reload_task(task):
+                        span.set(reloaded=True)
+                        if self.use_chainlit:
+                            await cl.Message(
+                                content=f"**Skipping the task: *{task.description}*. Its inputs did not change since the last run.**",
+                            ).send()
+                    else:
+                        async with contextlib.AsyncExitStack() as stack:
+                            # The locks are acquired in the same order by all the tasks to avoid deadlocks.
+                            for name in sorted({task.assistant_role_name, task.user_role_name} & role_locks.keys()):
+                                await stack.enter_async_context(role_locks[name])
+                            await task.a_execute(self.environment)
+                        self._save_task(task)
+                self._checkpoint(task)
+
+        def schedule():
+            for task in self.tasks:
+                if task.name in done or task.name in running.values():
+                    continue
+                if self.dag[task.name] <= done:
+                    running[asyncio.ensure_future(run(task))] = task.name
+
+        done = set(self._completed)
+        schedule()
+        try:
+            while running:
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    task_name = running.pop(future)
+                    try:
+                        future.result()
+                    except BudgetExceededError as error:
+                        self._stop(error)
+                        if self.use_chainlit:
+                            await cl.Message(
+                                content=f"**The run is stopped: {error} Resume it once the budget is raised.**",
+                            ).send()
+                        return
+                    done.add(task_name)
+                    logger.info(f"Task '{task_name}' is done.")
+                schedule()
+        finally:
+            for future in running:
+                future.cancel()
+
+    def _profile_data_sources(self) -> str:
+        "Return the Markdown summary of the profiles of the data sources, if any."
+        self.data_fingerprint = get_schema_fingerprint([])
+        if not self.data_sources:
+            return None
+        with self.run_context.tracer.span("profile_data_sources", kind="task"):
+            profiles = profile_sources(self.data_sources)
+        self.data_fingerprint = get_schema_fingerprint(profiles)
+        logger.info(f"Profiled {len(profiles)} of {len(self.data_sources)} data sources.")
+        return format_profiles(profiles)
+
+    def _get_fingerprint(self, task) -> str:
+        "Return the fingerprint of the task, including its roles and the outputs of its upstream tasks."
+        roles = [role for role in self.config["team"] if role.get("role") in (task.assistant_role_name, task.user_role_name)]
+        upstream = {name: self._output_digests.get(name) for name in sorted(self.dag[task.name])}
+        models = [config.get("model") for config in CONFIG.config_list]
+        return task.fingerprint(self.environment, roles=roles, upstream=upstream, models=models)
+
+    def _reload_task(self, task) -> bool:
+        "Reload the outputs of the task if its fingerprint did not change since they were saved, and return whether they were."
+        fingerprint = self._fingerprints[task.name] = self._get_fingerprint(task)
+        record = self.task_store.load(task.name) if self.reuse_outputs else None
+        if record is None or record["fingerprint"] != fingerprint:
+            return False
+        self.environment.apply_outputs(record["outputs"])
+        self._output_digests[task.name] = digest(record["outputs"])
+        logger.info(f"Skipping the task '{task.name}': its inputs did not change since the last run.")
+        return True
+
+    def _save_task(self, task):
+        "Save the fingerprint of the task and what it added to the environment."
+        outputs = self.environment.get_outputs(task.name)
+        self.task_store.save(task.name, self._fingerprints[task.name], outputs)
+        self._output_digests[task.name] = digest(outputs)
+
+    def _checkpoint(self, task):
+        "Mark the task as completed, checkpoint the run and save the artifacts so far."
+        self._completed.append(task.name)
+        self._save_checkpoint()
+        logger.info(f"Checkpoint saved after the task '{task.name}'.")
+
+    def _save_checkpoint(self):
+        save_checkpoint(self.checkpoint_path, dict(
+            request=self.idea,
+            completed=self._completed,
+            output_digests=self._output_digests,
+            environment=self.environment.get_state(),
+            fork=self.environment.fork,
+            budget=self.run_context.budget.get_usage(),
+        ))
+        self.environment._save_artifacts()
+
+    def _stop(self, error: BudgetExceededError):
+        "Stop the run cleanly when a budget is exhausted, with a checkpoint of the completed tasks."
+        self.budget_error = error
+        self._save_checkpoint()
+        logger.error(f"The run is stopped after the tasks {self._completed}: {error} Use --resume once the budget is raised.")
+
+    def _resume(self):
+        "Restore the last checkpoint of the project, so that the completed tasks are not executed again."
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint is None:
+            logger.warning(f"No checkpoint found at {self.checkpoint_path}. Starting from the first task.")
+            return
+        self.environment.set_state(checkpoint["environment"])
+        self._completed = [name for name in checkpoint["completed"] if name in self.dag]
+        self._output_digests.update(checkpoint["output_digests"])
+        self.environment.fork = checkpoint.get("fork")
+        # The cost and token ceilings include what was used before the checkpoint.
+        if "budget" in checkpoint:
+            self.run_context.budget.set_usage(checkpoint["budget"])
+        else:
+            self.run_context.budget.run.cost = self.run_context.total_cost
+        logger.info(f"Resuming the run after the tasks: {self._completed}")
+
+    def _get_run_metadata(self) -> dict:
+        "Return what a past run must have in common with this one to be forked: its data and its tasks."
+        return dict(
+            data_fingerprint=self.data_fingerprint,
+            pipeline=digest(sorted(task.name for task in self.tasks)),
+        )
+
+    def _find_similar_run(self):
+        "Return the entry of the past run whose request is a near-duplicate of this one, if any."
+        knowledge_base = get_knowledge_base()
+        if knowledge_base is None:
+            return None
+        try:
+            return knowledge_base.find_similar_run(
+                self.idea,
+                min_similarity=CONFIG.fork_min_similarity,
+                exclude_run_id=self.run_context.run_id,
+                **self._get_run_metadata()
+            )
+        except Exception as error:
+            logger.warning(f"Failed to search the knowledge base for a similar run: {error}")
+            return None
+
+    def _get_fork_candidate(self) -> Optional[dict]:
+        "Return the past run to fork: the project given with `fork_from`, or else the similar past run, if any."
+        if self.fork_from and self.fork_from != "auto":
+            return dict(project=self.fork_from, project_directory=self.root_dir / self.fork_from, text=None)
+        return self._find_similar_run()
+
+    def _accept_fork(self, run: dict) -> bool:
+        "Return whether to fork the past run: when it is given with `fork_from`, or with `fork_from='auto'`."
+        if self.fork_from:
+            return True
+        logger.info(f"The request is similar to the one of the past project '{run['project']}' ({run['score']:.2f}). Use --fork_from auto to edit its outputs instead of starting from scratch.")
+        return False
+
+    async def _a_accept_fork(self, run: dict) -> bool:
+        "The async version of `_accept_fork`, which also asks the user in the Chat UI whether to fork the similar past run."
+        if self.fork_from or not self.use_chainlit:
+            return self._accept_fork(run)
+        res = await ask_helper(
+            cl.AskActionMessage,
+            content=f"**This request is similar to the one of the past project *{run['project']}* ({run['score']:.0%}):**\n*{run['text']}*\n**Edit the outputs of that project instead of starting from scratch?**",
+            actions=[
+                cl.Action(name="fork", value="fork", label="♻️ Edit the past project"),
+                cl.Action(name="new", value="new", label="🆕 Start from scratch"),
+            ],
+            timeout=2000
+        )
+        return res.get("value") == "fork"
+
+    def _fork(self, run: dict):
+        """
+        Fork the run from a past run with a similar request: the outputs of each of its tasks are
+        loaded from its checkpoint and task store, and each task edits them for the new request.
+        """
+        project, source_directory = run["project"], Path(run["project_directory"])
+        checkpoint = load_checkpoint(source_directory / ".appgen" / "checkpoint.json.gz")
+        if checkpoint is None:
+            logger.warning(f"Cannot fork the project '{project}': it has no checkpoint in {source_directory}.")
+            return
+        task_store = TaskStore(source_directory)
+        outputs = {}
         for task in self.tasks:
-            await task.a_execute(self.environment)
+            record = task_store.load(task.name) if task.name in checkpoint["completed"] else None
+            if record is not None:
+                outputs[task.name] = record["outputs"]
+        self.environment.fork = dict(project=project, request=checkpoint.get("request") or run["text"], outputs=outputs)
+        logger.info(f"Forked the run from the project '{project}': the tasks {sorted(outputs)} edit its outputs.")
+
+    def _build_dag(self) -> dict:
+        """
+        Build the task dependency graph as a mapping of task name to the set of task names
+        it depends on.
+
+        A task depends on the tasks listed in its `depends_on` and on any earlier task that
+        `produces` an environment field used in its prompt. If the dependencies of a task
+        are not declared at all, it depends on the task before it to keep the order of the
+        config file.
+        """
+        dag = {}
+        declared = any(task.depends_on is not None or task.produces for task in self.tasks)
+        for idx, task in enumerate(self.tasks):
+            if task.name in dag:
+                raise ValueError(f"Task name '{task.name}' is not unique. Set a unique 'id' for each task of the same type.")
+            if not declared:
+                dag[task.name] = {self.tasks[idx - 1].name} if idx > 0 else set()
+                continue
+            dependencies = set(task.depends_on or [])
+            for previous_task in self.tasks[:idx]:
+                if set(previous_task.produces) & task.consumes():
+                    dependencies.add(previous_task.name)
+            unknown = dependencies - set(dag.keys())
+            if unknown:
+                raise ValueError(f"Task '{task.name}' depends on unknown or later tasks: {sorted(unknown)}")
+            dag[task.name] = dependencies
+        logger.debug(f"Task DAG: {dag}")
+        return dag
+
+    def _topological_order(self) -> list:
+        """
+        Return the tasks in an order that respects the DAG (the config order for ties).
+
+        Raises:
+            ValueError: The DAG has a cycle, so the remaining tasks can never start.
+        """
+        done, order = set(), []
+        while len(order) < len(self.tasks):
+            for task in self.tasks:
+                if task.name not in done and self.dag[task.name] <= done:
+                    order.append(task)
+                    done.add(task.name)
+                    break
+            else:
+                remaining = [task.name for task in self.tasks if task.name not in done]
+                raise ValueError(f"The tasks {remaining} depend on each other in a cycle.")
+        return order
     
 
 
     def _initialize_team(self):
         team = {}
         for role_dict in self.config["team"]:
-            role_class = Role.from_dict(role_dict)
+            role_class = Role.from_dict(role_dict, run_context=self.run_context, use_async=self.use_async)
             # role_class = get_role(role_name)
             # role = role_class(profile=role_name)
             role_name = role_dict.get("role")
@@ -115,6 +464,11 @@ class TaskChain:
     def post_processing(self, task_status=cl.TaskStatus.DONE.name):
         self.environment._setup_project_env()
         self.environment._save_artifacts()
+        self._export_traces()
+        close_kernel_session(self.run_context.run_id)
+        # Only the runs that completed all their tasks are reused by the later runs.
+        if task_status == cl.TaskStatus.DONE.name and self.budget_error is None and len(self._completed) == len(self.tasks):
+            self._add_to_knowledge_base()
         if self.use_github:
             github_url = self.environment._push_project_to_repo(self.github_token, self.project_name)
         if self.use_chainlit and self.use_github:
@@ -129,6 +483,36 @@ class TaskChain:
             )
 
 
+    def _export_traces(self):
+        "Export the spans of the run to `.appgen/traces` and log their summary."
+        tracer = self.run_context.tracer
+        if not tracer.spans:
+            return
+        traces_dir = self.environment.project_directory / ".appgen" / "traces"
+        tracer.export_jsonl(traces_dir / "spans.jsonl")
+        tracer.export_otlp(traces_dir / "traces.otlp.json")
+        logger.info(f"Summary of the run:\n{tracer.format_summary()}")
+
+
+    def _add_to_knowledge_base(self):
+        "Add the documents and the code of the finished run to the knowledge base, if it is enabled."
+        knowledge_base = get_knowledge_base()
+        if knowledge_base is None:
+            return
+        try:
+            knowledge_base.add_run(
+                project=self.project_name,
+                run_id=self.run_context.run_id,
+                request=self.idea,
+                docs=self.run_context.artifacts["docs"],
+                code=self.run_context.artifacts["code"],
+                project_directory=str(self.environment.project_directory),
+                **self._get_run_metadata()
+            )
+        except Exception as error:
+            logger.warning(f"Failed to add the artifacts of the run to the knowledge base: {error}")
+
+
     def __repr__(self) -> str:
         return self.__str__()
     
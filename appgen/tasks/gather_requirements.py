@@ -1,5 +1,4 @@
 from appgen.tasks import Task
-from appgen.config import CONFIG
 
 class GatherRequirements(Task):
 
@@ -8,6 +7,6 @@ class GatherRequirements(Task):
     
 
     def update_environment(self, environment, rsp):
-        reqs = CONFIG.artifacts["docs"]["prd"]
+        reqs = environment.run_context.artifacts["docs"]["prd"]
         environment.requirements.append(reqs)
 
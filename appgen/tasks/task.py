@@ -1,32 +1,65 @@
 from appgen import Environment
 from appgen.utils.logs import logger
+from appgen.utils.serialization import digest
+from appgen.utils.knowledge_base import ARTIFACT_KINDS, get_knowledge_base, format_artifacts
+from appgen.utils.token_counter import truncate_tokens
+from appgen.utils.write_utils import json_to_markdown
+from appgen.config import CONFIG
 
+import json
 import pprint
+import string
 import chainlit as cl
 
+# Appended to the prompt of a task when the run is forked from a similar past run.
+DELTA_PROMPT = """
+
+This project is forked from the past project '{project}', which was made for a similar request: {request}
+The outputs of this task for that request were:
+
+{outputs}
+
+Do not start over: edit these outputs for the new request. Keep what still applies, change only what differs between the two requests, and reply with the complete edited outputs in the format asked above."""
+
 class Task:
 
     def __init__(self,
+                 name: str = None,
                  description: str = None,
                  assistant_role_name: str = None,
                  user_role_name: str = None,
                  max_consecutive_auto_reply: int = 5,
                  task_prompt: str = None,
-                 placeholders: dict = {},):
+                 placeholders: dict = {},
+                 depends_on: list = None,
+                 produces: list = None,
+                 budget: dict = None,
+                 knowledge_base: dict = None,):
 
+        self.name = name or self.__class__.__name__
         self.description = description
         self.assistant_role_name = assistant_role_name
         self.user_role_name = user_role_name
         self.max_consecutive_auto_reply = max_consecutive_auto_reply
         self.task_prompt = task_prompt
         self.placeholders = placeholders
+        # `depends_on` lists the names of the tasks that must finish before this one starts.
+        # `produces` lists the environment fields this task writes to. Both are used by the
+        # TaskChain to build the DAG of tasks; None means "not declared".
+        self.depends_on = depends_on
+        self.produces = produces or []
+        # The cost and token ceilings of the task, e.g. {"max_cost": 1.0, "max_tokens": 200000}.
+        self.budget = budget
+        # How the `past_artifacts` placeholder is filled from the knowledge base of the past runs,
+        # e.g. {"kinds": ["requirements", "design"], "top_k": 3, "max_tokens": 1500}.
+        self.knowledge_base = knowledge_base or {}
 
 
     def __repr__(self) -> str:
         return self.__str__()
     
     def __str__(self):
-        return f"Description: {pprint.pformat(self.description)}\nAssistant Role Name: {self.assistant_role_name}\nUser Role Name: {self.user_role_name}\nMax Consecutive Auto Reply: {self.max_consecutive_auto_reply}\nTask Prompt: {pprint.pformat(self.task_prompt)}\nPlaceholders: {pprint.pformat(self.placeholders)}"
+        return f"Name: {self.name}\nDescription: {pprint.pformat(self.description)}\nDepends On: {self.depends_on}\nProduces: {self.produces}\nAssistant Role Name: {self.assistant_role_name}\nUser Role Name: {self.user_role_name}\nMax Consecutive Auto Reply: {self.max_consecutive_auto_reply}\nTask Prompt: {pprint.pformat(self.task_prompt)}\nPlaceholders: {pprint.pformat(self.placeholders)}"
     
 
     def execute(
@@ -46,7 +79,7 @@ class Task:
         assistant_agent = environment.get_role(self.assistant_role_name).get_user()
 
         prompt = self.initialize_prompt(environment)
-        user_agent.human_input_mode = "ALWAYS"
+        user_agent.human_input_mode = self._get_human_input_mode(environment)
         self.log()
         user_agent.initiate_chat(
             assistant_agent,
@@ -69,18 +102,29 @@ class Task:
         self, 
         environment: Environment
     ):
+        """
+        Executes the conversation between the user and the assistant on the given task
+        on the event loop. The roles of the environment must be async roles.
+
+        Parameters:
+            environment (Environment): The environment in which the conversation takes place.
+
+        Returns:
+            None
+        """
         user_agent = environment.get_role(self.user_role_name).get_user()
         assistant_agent = environment.get_role(self.assistant_role_name).get_user()
 
-        task = await environment._display_task(self.description)
-
-        cl.run_sync(cl.Message(
-            content=f"**The *{self.assistant_role_name}* is starting on the task: *{self.description}*.**",
-        ).send())
+        use_chainlit = environment.run_context.use_chainlit
+        if use_chainlit:
+            task = await environment._display_task(self.description)
+            await cl.Message(
+                content=f"**The *{self.assistant_role_name}* is starting on the task: *{self.description}*.**",
+            ).send()
         prompt = self.initialize_prompt(environment)
-        user_agent.human_input_mode = "ALWAYS"  
+        user_agent.human_input_mode = self._get_human_input_mode(environment)
         self.log()
-        await cl.make_async(user_agent.initiate_chat)(
+        await user_agent.a_initiate_chat(
             assistant_agent,
             message=prompt,
             clear_history=True
@@ -91,21 +135,100 @@ class Task:
         # Update the env variables with the returned details (shared knowledge)
         self.update_environment(environment, rsp)
 
-        await environment._finish_task(task)
+        if use_chainlit:
+            await environment._finish_task(task)
         environment.log(msg=f"{self.description}")
 
 
 
     def dict(self):
         return {
+            "name": self.name,
             "description": self.description,
             "assistant_role_name": self.assistant_role_name,
             "user_role_name": self.user_role_name,
             "max_consecutive_auto_reply": self.max_consecutive_auto_reply,
-            "task_prompt": self.task_prompt
+            "task_prompt": self.task_prompt,
+            "depends_on": self.depends_on,
+            "produces": self.produces
         }
     
 
+    def consumes(self) -> set:
+        """
+        Returns the names of the placeholders used in the task prompt that are not
+        custom placeholders, i.e. the environment fields this task reads.
+        """
+        if not self.task_prompt:
+            return set()
+        fields = {field for _, field, _, _ in string.Formatter().parse(self.task_prompt) if field}
+        return fields - set(self.placeholders.keys())
+
+    def fingerprint(self, environment: Environment, **inputs) -> str:
+        """
+        Returns a hash of everything the outputs of the task depend on: its configuration,
+        its custom placeholders, the environment fields used in its prompt, the past run
+        it is forked from and any additional inputs (e.g. the outputs of the upstream tasks).
+        """
+        fields = environment.dict()
+        fork = None
+        if environment.fork:
+            fork = dict(
+                project=environment.fork["project"],
+                request=environment.fork["request"],
+                outputs=environment.fork.get("outputs", {}).get(self.name),
+            )
+        return digest(dict(
+            task=self.dict(),
+            placeholders=self.placeholders,
+            environment={field: fields.get(field) for field in sorted(self.consumes())},
+            fork=fork,
+            **inputs
+        ))
+
+    def get_past_artifacts(self, environment: Environment) -> str:
+        "Return the past artifacts most similar to the request and the task, from the knowledge base."
+        try:
+            knowledge_base = get_knowledge_base()
+            if knowledge_base is None:
+                return format_artifacts([])
+            entries = knowledge_base.search(
+                f"{environment.request_prompt}\n{self.description or ''}",
+                top_k=self.knowledge_base.get("top_k", 3),
+                kinds=self.knowledge_base.get("kinds", ARTIFACT_KINDS),
+                exclude_run_id=environment.run_context.run_id,
+            )
+        except Exception as error:
+            logger.warning(f"Failed to search the knowledge base for the task '{self.name}': {error}")
+            entries = []
+        logger.info(f"Retrieved {len(entries)} past artifacts for the task '{self.name}'.")
+        return format_artifacts(entries, max_tokens=self.knowledge_base.get("max_tokens", 1500))
+
+    def get_delta_prompt(self, environment: Environment) -> str:
+        "Return the instructions to edit the outputs of this task in the run the environment is forked from, if any."
+        outputs = (environment.fork or {}).get("outputs", {}).get(self.name)
+        if not outputs:
+            return ""
+        max_tokens = CONFIG.fork_max_tokens
+        sections = []
+        for field, items in outputs.items():
+            # The documents of the fields are also in "docs"; the other items are e.g. the data analysis.
+            if isinstance(items, list):
+                sections.extend(truncate_tokens(item, max_tokens) for item in items if isinstance(item, str))
+        for name, doc in outputs.get("docs", {}).items():
+            sections.append(truncate_tokens(json_to_markdown(json.loads(doc.model_dump_json())), max_tokens))
+        for filename, code in outputs.get("code", {}).items():
+            if filename and code:
+                sections.append(f"{filename}:\n```\n{truncate_tokens(code, max_tokens)}\n```")
+        if not sections:
+            return ""
+        return DELTA_PROMPT.format(project=environment.fork["project"], request=environment.fork["request"], outputs="\n\n".join(sections))
+
+    @staticmethod
+    def _get_human_input_mode(environment: Environment) -> str:
+        "The human reviews the replies of the assistant, unless the run replies automatically."
+        return "NEVER" if environment.run_context.auto_reply else "ALWAYS"
+
     def log(self):
         logger.debug(f"**Executing a new task**\n\nThe task configurations:\n\n--\n\n{self.__str__()}\n\n--\n\n")
     
@@ -142,8 +265,10 @@ class Task:
         """
         
         try:
-            self.placeholders = {**self.placeholders, **environment.dict()}
-            return self.task_prompt.format(**self.placeholders)
+            placeholders = {**self.placeholders, **environment.dict()}
+            if "past_artifacts" in self.consumes():
+                placeholders["past_artifacts"] = self.get_past_artifacts(environment)
+            return self.task_prompt.format(**placeholders) + self.get_delta_prompt(environment)
         except:
             logger.error(f"Failed to initialize the prompt '{self.task_prompt}'. Please check if the placeholders are correct '{self.placeholders}'. Then try again!")
     
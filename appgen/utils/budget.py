@@ -0,0 +1,175 @@
+"""
+Cost and token budgets of a run, of its tasks and of its roles.
+
+Every LLM call is charged to the budget of the run and to the budgets of the task and the
+role it was made for (found from the current span of the tracer). Once a budget reaches its
+soft limit (a fraction of its ceilings), the roles degrade to a cheaper model and a shorter
+history. Before a call is sent, its predicted tokens and cost are checked against what remains
+of the budgets: its completion is capped to fit, or the call is refused with a
+BudgetExceededError if even a short completion would not fit.
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from appgen.utils.telemetry import current_span
+
+
+class BudgetExceededError(Exception):
+    "Raised when the run, a task or a role reached its cost or token ceiling."
+
+    def __init__(self, scope: str, name: str, message: str):
+        self.scope = scope
+        self.name = name
+        super().__init__(f"The budget of the {scope} '{name}' is exhausted: {message}")
+
+
+class Budget:
+    """
+    The cost and token ceilings of a run, a task or a role, and their usage so far.
+
+    Args:
+        max_cost (float, optional): The ceiling of the estimated cost in dollars.
+        max_tokens (int, optional): The ceiling of the prompt and completion tokens.
+        soft_limit (float): The fraction of the ceilings from which the roles degrade.
+    """
+
+    def __init__(self, max_cost: Optional[float] = None, max_tokens: Optional[int] = None, soft_limit: float = 0.8):
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.soft_limit = soft_limit
+        self.cost = 0.0
+        self.tokens = 0
+
+    @property
+    def usage(self) -> float:
+        "The largest fraction of the ceilings used so far, 0 if there is no ceiling."
+        usage = 0.0
+        if self.max_cost:
+            usage = max(usage, self.cost / self.max_cost)
+        if self.max_tokens:
+            usage = max(usage, self.tokens / self.max_tokens)
+        return usage
+
+    @property
+    def is_soft_exceeded(self) -> bool:
+        return self.usage >= self.soft_limit
+
+    @property
+    def is_exceeded(self) -> bool:
+        return self.usage >= 1.0
+
+    def get_affordable_tokens(self, n_input_tokens: int, price: Optional[Tuple[float, float]]) -> Optional[int]:
+        "Return the number of completion tokens that fit in the budget after the prompt, or None if there is no ceiling."
+        tokens = []
+        if self.max_tokens:
+            tokens.append(self.max_tokens - self.tokens - n_input_tokens)
+        if self.max_cost and price is not None and price[1] > 0:
+            tokens.append(int((1000 * (self.max_cost - self.cost) - price[0] * n_input_tokens) / price[1]))
+        return min(tokens) if tokens else None
+
+    def describe(self) -> str:
+        limits = []
+        if self.max_cost:
+            limits.append(f"${self.cost:.2f} of ${self.max_cost:.2f}")
+        if self.max_tokens:
+            limits.append(f"{self.tokens} of {self.max_tokens} tokens")
+        return ", ".join(limits) or "no limit"
+
+
+class BudgetTracker:
+    """
+    Charges the LLM calls of a run to the budgets of the run, of its tasks and of its roles.
+
+    Args:
+        max_cost (float, optional): The cost ceiling of the run in dollars.
+        max_tokens (int, optional): The token ceiling of the run.
+        soft_limit (float): The default fraction of the ceilings from which the roles degrade.
+    """
+
+    def __init__(self, max_cost: Optional[float] = None, max_tokens: Optional[int] = None, soft_limit: float = 0.8):
+        self.soft_limit = soft_limit
+        self.run = Budget(max_cost, max_tokens, soft_limit)
+        self.tasks: Dict[str, Budget] = {}
+        self.roles: Dict[str, Budget] = {}
+        self._lock = threading.Lock()
+
+    def set_task_budget(self, name: str, max_cost: Optional[float] = None, max_tokens: Optional[int] = None, soft_limit: Optional[float] = None):
+        self.tasks[name] = Budget(max_cost, max_tokens, soft_limit or self.soft_limit)
+
+    def set_role_budget(self, name: str, max_cost: Optional[float] = None, max_tokens: Optional[int] = None, soft_limit: Optional[float] = None):
+        self.roles[name] = Budget(max_cost, max_tokens, soft_limit or self.soft_limit)
+
+    @property
+    def has_limits(self) -> bool:
+        return bool(self.run.max_cost or self.run.max_tokens or self.tasks or self.roles)
+
+    def _get_budgets(self) -> List[Tuple[str, str, Budget]]:
+        "Return the budgets the current LLM call is charged to, as (scope, name, budget)."
+        budgets = [("run", "run", self.run)]
+        span = current_span()
+        task = span.get_ancestor("task") if span is not None else None
+        role = span.get_ancestor("role") if span is not None else None
+        if task is not None and task.name in self.tasks:
+            budgets.append(("task", task.name, self.tasks[task.name]))
+        if role is not None and role.name in self.roles:
+            budgets.append(("role", role.name, self.roles[role.name]))
+        return budgets
+
+    def check(self):
+        "Raise a BudgetExceededError if a budget of the current call reached its ceiling."
+        for scope, name, budget in self._get_budgets():
+            if budget.is_exceeded:
+                raise BudgetExceededError(scope, name, budget.describe())
+
+    def admit(self, n_input_tokens: int, n_output_tokens: int, price: Optional[Tuple[float, float]], min_output_tokens: int = 0) -> int:
+        """
+        Return the number of completion tokens the current call may use, at most n_output_tokens.
+
+        Args:
+            n_input_tokens (int): The predicted prompt tokens of the call.
+            n_output_tokens (int): The completion tokens the call asks for.
+            price (Tuple[float, float], optional): The (input, output) prices per 1K tokens of the model.
+            min_output_tokens (int): The smallest completion worth sending the call for.
+
+        Raises:
+            BudgetExceededError: If a budget cannot afford the prompt and min_output_tokens.
+        """
+        allowed = n_output_tokens
+        for scope, name, budget in self._get_budgets():
+            affordable = budget.get_affordable_tokens(n_input_tokens, price)
+            if affordable is None:
+                continue
+            if affordable < min(min_output_tokens, n_output_tokens):
+                raise BudgetExceededError(scope, name, f"{budget.describe()}, and the next call needs {n_input_tokens} prompt tokens.")
+            allowed = min(allowed, affordable)
+        return allowed
+
+    def charge(self, cost: float, tokens: int):
+        "Add the cost and the tokens of an LLM call to the budgets of the current call."
+        with self._lock:
+            for _, _, budget in self._get_budgets():
+                budget.cost += cost
+                budget.tokens += tokens
+
+    def get_usage(self) -> Dict:
+        "Return the cost and the tokens used so far by the run, its tasks and its roles, e.g. to checkpoint them."
+        with self._lock:
+            return dict(
+                run=dict(cost=self.run.cost, tokens=self.run.tokens),
+                tasks={name: dict(cost=budget.cost, tokens=budget.tokens) for name, budget in self.tasks.items()},
+                roles={name: dict(cost=budget.cost, tokens=budget.tokens) for name, budget in self.roles.items()},
+            )
+
+    def set_usage(self, usage: Dict):
+        "Restore the usage returned by `get_usage`. The budgets that are no longer set are ignored."
+        with self._lock:
+            budgets = [(self.run, usage.get("run", {}))]
+            budgets += [(self.tasks[name], used) for name, used in usage.get("tasks", {}).items() if name in self.tasks]
+            budgets += [(self.roles[name], used) for name, used in usage.get("roles", {}).items() if name in self.roles]
+            for budget, used in budgets:
+                budget.cost = used.get("cost", 0.0)
+                budget.tokens = used.get("tokens", 0)
+
+    def is_soft_exceeded(self) -> bool:
+        "Return whether a budget of the current call reached its soft limit."
+        return any(budget.is_soft_exceeded for _, _, budget in self._get_budgets())
@@ -0,0 +1,35 @@
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from appgen.utils import logger
+from appgen.utils.serialization import to_jsonable, from_jsonable
+
+
+def save_checkpoint(path: Path, state: Dict):
+    """
+    Save the state to a gzipped JSON checkpoint. The file is replaced atomically, so that
+    a process killed while saving leaves the previous checkpoint intact.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = json.dumps(to_jsonable(state), separators=(",", ":"), ensure_ascii=False)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+        file.write(payload)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: Path) -> Optional[Dict]:
+    "Return the state saved by `save_checkpoint`, or None if there is no valid checkpoint."
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            return from_jsonable(json.load(file))
+    except (OSError, ValueError, AttributeError) as error:
+        logger.error(f"Failed to load the checkpoint {path}: {error}")
+        return None
@@ -1,9 +1,16 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from appgen.config import CONFIG
 from appgen.utils import logger 
-from appgen.config import CONFIG 
+from appgen.utils.token_counter import count_message_tokens
 from openai.types.chat import ChatCompletion
 
 import chainlit as cl
 
+# The default prices in dollars per 1K tokens, as (input, output) or a single price for both.
+# They can be overridden and extended with MODEL_PRICES in config.yaml.
 price1K = {
         "text-ada-001": 0.0004,
         "text-babbage-001": 0.0005,
@@ -12,10 +19,12 @@ price1K = {
         "code-davinci-002": 0.1,
         "text-davinci-002": 0.02,
         "text-davinci-003": 0.02,
-        "gpt-3.5-turbo": (0.0015, 0.002),
+        "gpt-3.5-turbo": (0.0005, 0.0015),
         "gpt-3.5-turbo-instruct": (0.0015, 0.002),
         "gpt-3.5-turbo-0301": (0.0015, 0.002),  # deprecate in Sep
         "gpt-3.5-turbo-0613": (0.0015, 0.002),
+        "gpt-3.5-turbo-1106": (0.001, 0.002),
+        "gpt-3.5-turbo-0125": (0.0005, 0.0015),
         "gpt-3.5-turbo-16k": (0.003, 0.004),
         "gpt-3.5-turbo-16k-0613": (0.003, 0.004),
         "gpt-35-turbo": (0.0015, 0.002),
@@ -29,32 +38,138 @@ price1K = {
         "gpt-4-32k-0613": (0.06, 0.12),
         "gpt-4-1106-preview": (0.01, 0.03),
         "gpt-4-1106-vision-preview": (0.01, 0.03),
+        "gpt-4-0125-preview": (0.01, 0.03),
+        "gpt-4-turbo-preview": (0.01, 0.03),
+        "gpt-4-turbo": (0.01, 0.03),
+        "gpt-4o": (0.0025, 0.01),
+        "gpt-4o-2024-05-13": (0.005, 0.015),
+        "gpt-4o-mini": (0.00015, 0.0006),
 }
 
-def estimate_cost_of_completion(rsp:ChatCompletion):
+# The suffix of the dated snapshots of a model, e.g. `-0613` or `-2024-04-09`.
+SNAPSHOT_SUFFIX = re.compile(r"-\d{4}(-\d{2}-\d{2})?")
+
+
+class PriceRegistry:
+    """
+    The prices of the models in dollars per 1K tokens.
+
+    A model is looked up by its name, then by its alias (e.g. the name of an Azure deployment),
+    then as a dated snapshot of a known model (e.g. `gpt-4-turbo-2024-04-09`). Other models are
+    not priced as a known model they merely start with (e.g. `gpt-4.5-preview` is not `gpt-4`):
+    the cost of an unknown model is 0, with a warning.
+
+    Args:
+        prices (Dict): The price of each model, as (input, output) or a single price for both.
+        aliases (Dict): The model name of each alias.
+    """
+
+    def __init__(self, prices: Dict = None, aliases: Dict = None):
+        self.prices = {}
+        for model, price in (prices or {}).items():
+            self.register(model, price)
+        self.aliases = dict(aliases or {})
+        self._warned = set()
+
+    def register(self, model: str, price):
+        "Set the price of the model, given as (input, output) or a single price for both."
+        if isinstance(price, (list, tuple)):
+            self.prices[model] = (float(price[0]), float(price[1]))
+        else:
+            self.prices[model] = (float(price), float(price))
+
+    def resolve(self, model: str) -> Optional[str]:
+        "Return the name of the priced model that the model or alias refers to, if any."
+        if not model:
+            return None
+        model = self.aliases.get(model, model)
+        if model in self.prices:
+            return model
+        candidates = [
+            name for name in self.prices
+            if model.startswith(name) and SNAPSHOT_SUFFIX.fullmatch(model[len(name):])
+        ]
+        return max(candidates, key=len) if candidates else None
+
+    def get(self, model: str) -> Optional[Tuple[float, float]]:
+        "Return the (input, output) prices per 1K tokens of the model, or None if it is unknown."
+        name = self.resolve(model)
+        if name is None:
+            if model not in self._warned:
+                self._warned.add(model)
+                logger.warning(f"The price of the model '{model}' is unknown; its cost is counted as 0. Set it in MODEL_PRICES or MODEL_ALIASES.")
+            return None
+        return self.prices[name]
+
+    def estimate(self, model: str, n_input_tokens: int, n_output_tokens: int) -> float:
+        price = self.get(model)
+        if price is None:
+            return 0.0
+        return (price[0] * n_input_tokens + price[1] * n_output_tokens) / 1000
+
+
+_price_registry = None
+_price_registry_lock = threading.Lock()
+
+
+def get_price_registry() -> PriceRegistry:
+    "Return the price registry of the process, with the MODEL_PRICES and MODEL_ALIASES of the config."
+    global _price_registry
+    with _price_registry_lock:
+        if _price_registry is None:
+            _price_registry = PriceRegistry(
+                prices={**price1K, **(CONFIG.model_prices or {})},
+                aliases=CONFIG.model_aliases,
+            )
+    return _price_registry
+
+
+def estimate_cost_of_completion(rsp:ChatCompletion, run_context):
+    cost, cost_msg = _add_cost_of_completion(rsp, run_context)
+    if run_context.use_chainlit:
+        cl.run_sync(
+            cl.Message(
+                content=cost_msg
+            ).send()
+        )
+    return cost
+
+async def a_estimate_cost_of_completion(rsp:ChatCompletion, run_context):
+    cost, cost_msg = _add_cost_of_completion(rsp, run_context)
+    if run_context.use_chainlit:
+        await cl.Message(
+            content=cost_msg
+        ).send()
+    return cost
+
+def _add_cost_of_completion(rsp:ChatCompletion, run_context):
+    "Add the cost of the completion to the running total of the run and return the cost with its chat message."
     model = rsp.model
     usage = rsp.usage
     n_input_tokens = usage.prompt_tokens
     n_output_tokens = usage.completion_tokens
     cost = estimate_cost(model, n_input_tokens, n_output_tokens)
-    CONFIG.total_cost += cost 
-    msg = f"*Model: {model}. Estimated cost: ${cost:.2f}. Number of Input tokens: {n_input_tokens}. Number of Output tokens: {n_output_tokens}. Running total: ${CONFIG.total_cost:.2f}.*"
-    cost_msg = f"**Estimated cost of last API call:** \${cost:.2f}. **Running total:** \${CONFIG.total_cost:.2f}."
+    total_cost = run_context.add_cost(cost)
+    run_context.budget.charge(cost, n_input_tokens + n_output_tokens)
+    msg = f"*Model: {model}. Estimated cost: ${cost:.2f}. Number of Input tokens: {n_input_tokens}. Number of Output tokens: {n_output_tokens}. Running total: ${total_cost:.2f}.*"
+    cost_msg = f"**Estimated cost of last API call:** \${cost:.2f}. **Running total:** \${total_cost:.2f}."
     logger.info(cost_msg)
     logger.debug(msg)
-    if CONFIG.use_chainlit:
-        cl.run_sync(
-            cl.Message(
-                content=cost_msg
-            ).send()
-        )
-    return cost
+    return cost, cost_msg
 
 def estimate_cost(model:str, n_input_tokens, n_output_tokens):
-    if model in price1K:
-        if isinstance(price1K[model], tuple):
-            return (price1K[model][0] * n_input_tokens + price1K[model][1] * n_output_tokens) / 1000
-        else:
-            return price1K[model] * (n_input_tokens + n_output_tokens) / 1000
-    else:
-        return 0
\ No newline at end of file
+    return get_price_registry().estimate(model, n_input_tokens, n_output_tokens)
+
+def estimate_request(model: str, messages: List[Dict], max_tokens: Optional[int] = None) -> Tuple[int, int, float]:
+    """
+    Predict the tokens and the cost of a request before it is sent, with the local tokenizer.
+
+    The completion is assumed to use `max_tokens` tokens, or EXPECTED_COMPLETION_TOKENS when
+    the request does not bound it.
+
+    Returns:
+        Tuple[int, int, float]: The prompt tokens, the completion tokens and the cost.
+    """
+    n_input_tokens = count_message_tokens(messages, model or "gpt-4")
+    n_output_tokens = max_tokens or CONFIG.expected_completion_tokens
+    return n_input_tokens, n_output_tokens, estimate_cost(model, n_input_tokens, n_output_tokens)
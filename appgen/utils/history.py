@@ -0,0 +1,173 @@
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from appgen.utils.logs import logger
+from appgen.utils.llm import create_completion, a_create_completion
+from appgen.utils.token_counter import TRUNCATION_MARKER, count_message_tokens, count_tokens, truncate_tokens
+
+SUMMARY_PROMPT_TEMPLATE = """Below are the earlier records of a conversation and the summary of the records before them.
+Update the summary so that it covers all of the records. Keep every requirement, decision, answer,
+data source, file name and open question, and drop the small talk. Reply with the summary only.
+
+Summary so far:
+===
+{summary}
+===
+
+New records:
+===
+{history}
+===
+"""
+
+SUMMARY_MESSAGE_TEMPLATE = """Summary of the earlier conversation records:
+{summary}"""
+
+
+def format_history(messages: List[Dict]) -> str:
+    "Render the chat messages as a transcript, one message per paragraph."
+    return "\n\n".join(
+        f"{message.get('name', message.get('role', 'user'))}: {message.get('content') or ''}"
+        for message in messages
+    )
+
+
+class HistoryManager:
+    """
+    Keeps the conversation history sent to the LLM within a token budget.
+
+    When the history exceeds `max_tokens`, the first `keep_first_n` messages (the task
+    prompt) and the last `keep_last_n` messages are kept verbatim, and the messages in
+    between are replaced by a rolling summary. The summary is updated incrementally: only
+    the messages that were not summarized yet are sent to the LLM. Finally, the longest
+    remaining messages are truncated if the history still does not fit in the budget.
+
+    Args:
+        max_tokens (int, optional): The token budget of the history per LLM call.
+            Defaults to None, which disables the compaction.
+        keep_last_n (int): The number of most recent messages kept verbatim. Defaults to 6.
+        keep_first_n (int): The number of leading messages kept verbatim. Defaults to 1.
+        summary_max_tokens (int): The maximum length of the summary. Defaults to 500.
+        model (str): The model used to count the tokens. Defaults to "gpt-4".
+    """
+
+    def __init__(
+            self,
+            max_tokens: Optional[int] = None,
+            keep_last_n: int = 6,
+            keep_first_n: int = 1,
+            summary_max_tokens: int = 500,
+            model: str = "gpt-4"
+    ):
+        self.max_tokens = max_tokens
+        self.keep_last_n = keep_last_n
+        self.keep_first_n = keep_first_n
+        self.summary_max_tokens = summary_max_tokens
+        self.model = model
+        # conversation key -> (number of summarized messages, summary)
+        self._summaries: Dict[str, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def compact(self, messages: List[Dict], client, run_context) -> List[Dict]:
+        """
+        Return the messages to send to the LLM, compacted to fit in the token budget.
+
+        Args:
+            messages (List[Dict]): The conversation history. It is not modified.
+            client: The client used to summarize the older messages.
+            run_context (RunContext): The run context the cost of the summary is added to.
+
+        Returns:
+            List[Dict]: The compacted history.
+        """
+        if not self._needs_compaction(messages):
+            return messages
+        key, start, end, summary = self._get_pending(messages)
+        if end > start:
+            response = create_completion(
+                client, run_context, messages=self._get_summary_prompt(summary, messages[start:end]),
+                max_tokens=self.summary_max_tokens
+            )
+            summary = client.extract_text_or_function_call(response)[0]
+            self._set_summary(key, end, summary)
+        return self._build(messages, summary, end)
+
+    async def a_compact(self, messages: List[Dict], client, run_context) -> List[Dict]:
+        "The async version of `compact`."
+        if not self._needs_compaction(messages):
+            return messages
+        key, start, end, summary = self._get_pending(messages)
+        if end > start:
+            response = await a_create_completion(
+                client, run_context, messages=self._get_summary_prompt(summary, messages[start:end]),
+                max_tokens=self.summary_max_tokens
+            )
+            summary = client.extract_text_or_function_call(response)[0]
+            self._set_summary(key, end, summary)
+        return self._build(messages, summary, end)
+
+    def _needs_compaction(self, messages: List[Dict]) -> bool:
+        return self.max_tokens is not None and count_message_tokens(messages, self.model) > self.max_tokens
+
+    def _get_key(self, messages: List[Dict]) -> str:
+        "Identify the conversation by its leading messages, which are kept verbatim."
+        head = format_history(messages[:max(self.keep_first_n, 1)])
+        return hashlib.sha256(head.encode("utf-8")).hexdigest()
+
+    def _get_pending(self, messages: List[Dict]):
+        "Return the key of the conversation, the range of messages to summarize and the current summary."
+        key = self._get_key(messages)
+        first = min(self.keep_first_n, len(messages))
+        end = max(len(messages) - self.keep_last_n, first)
+        with self._lock:
+            n_summarized, summary = self._summaries.get(key, (first, ""))
+        if n_summarized > end:
+            # The conversation was restarted with the same task prompt.
+            n_summarized, summary = first, ""
+        return key, n_summarized, end, summary
+
+    def _set_summary(self, key: str, n_summarized: int, summary: str):
+        with self._lock:
+            self._summaries[key] = (n_summarized, summary)
+
+    def _get_summary_prompt(self, summary: str, messages: List[Dict]) -> List[Dict]:
+        history = truncate_tokens(format_history(messages), self.max_tokens, self.model)
+        return [{
+            "role": "user",
+            "content": SUMMARY_PROMPT_TEMPLATE.format(summary=summary or "None", history=history)
+        }]
+
+    def _build(self, messages: List[Dict], summary: str, end: int) -> List[Dict]:
+        "Assemble the leading messages, the summary and the recent messages, and enforce the budget."
+        first = min(self.keep_first_n, len(messages))
+        compacted = [self._copy(message) for message in messages[:first]]
+        if summary:
+            compacted.append({
+                "role": "user",
+                "content": SUMMARY_MESSAGE_TEMPLATE.format(summary=summary)
+            })
+        compacted.extend(self._copy(message) for message in messages[end:])
+
+        n_tokens = count_message_tokens(compacted, self.model)
+        # The marker inserted by `truncate_tokens` takes some of the room of the truncated text.
+        n_marker_tokens = count_tokens(TRUNCATION_MARKER, self.model)
+        while n_tokens > self.max_tokens:
+            longest = max(compacted, key=lambda message: count_tokens(message.get("content") or "", self.model))
+            length = count_tokens(longest.get("content") or "", self.model)
+            # A message shorter than the excess is cut to a quarter, and the next longest one follows.
+            target = max(length - (n_tokens - self.max_tokens) - n_marker_tokens, length // 4)
+            if target <= n_marker_tokens:
+                break
+            longest["content"] = truncate_tokens(longest["content"], target, self.model)
+            previous, n_tokens = n_tokens, count_message_tokens(compacted, self.model)
+            if n_tokens >= previous:
+                logger.warning(f"Cannot truncate the history below {n_tokens} tokens (budget: {self.max_tokens}).")
+                break
+        logger.info(f"Compacted {len(messages)} messages into {len(compacted)} messages ({n_tokens} tokens).")
+        return compacted
+
+    @staticmethod
+    def _copy(message: Dict) -> Dict:
+        "Copy the fields of the message sent to the LLM, leaving out e.g. the autogen context."
+        return {key: value for key, value in message.items() if key in ("role", "content", "name", "function_call")}
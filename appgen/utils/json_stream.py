@@ -0,0 +1,85 @@
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+from appgen.utils import logger
+
+KEY_PATTERN = re.compile(r'^\s*"((?:[^"\\]|\\.)*)"\s*:')
+
+
+class IncrementalJSONObjectParser:
+    """
+    Parses a JSON object incrementally and returns each of its top-level members
+    as soon as the member is complete.
+
+    Feed the text of the object in chunks (e.g. the tokens of a streamed completion)
+    with `feed`, then call `close` when there is no more text. Anything before the
+    first "{" (e.g. a ```json fence) and after the matching "}" is ignored.
+
+    Each member is returned as a tuple of (key, value, error). If the member is not
+    valid JSON, the value is None and the error explains why.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any, Optional[str]]]:
+        "Feed the next chunk of text and return the members completed by it."
+        members = []
+        self._buffer += chunk
+        while self._pos < len(self._buffer) and not self.done:
+            char = self._buffer[self._pos]
+            if self._member_start is None:
+                if char == "{":
+                    self._depth = 1
+                    self._member_start = self._pos + 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    members.extend(self._close_member(self._pos))
+                    self.done = True
+            elif char == "," and self._depth == 1:
+                members.extend(self._close_member(self._pos))
+                self._member_start = self._pos + 1
+            self._pos += 1
+        return members
+
+    def close(self) -> List[Tuple[str, Any, Optional[str]]]:
+        "Return the last member if the object was never closed (e.g. the output was truncated)."
+        if self.done or self._member_start is None:
+            return []
+        self.done = True
+        members = self._close_member(len(self._buffer))
+        return [(key, None, error or "The JSON object is incomplete.") for key, _, error in members]
+
+    def _close_member(self, end: int) -> List[Tuple[str, Any, Optional[str]]]:
+        segment = self._buffer[self._member_start:end].strip()
+        if not segment:
+            return []
+        try:
+            # strict=False allows the raw newlines that LLMs often write inside strings.
+            member = json.loads("{" + segment + "}", strict=False)
+            return [(key, value, None) for key, value in member.items()]
+        except json.JSONDecodeError as error:
+            match = KEY_PATTERN.match(segment)
+            if match is None:
+                logger.warning(f"Failed to parse a member of the JSON object: {segment[:100]}")
+                return []
+            return [(match.group(1), None, str(error))]
@@ -0,0 +1,241 @@
+"""
+A pool of persistent, resource-limited Python kernels to execute the code suggested by the agents.
+
+Each kernel is a Python subprocess that keeps its variables between executions, like a
+notebook kernel, so that the modules imported and the data loaded by a code block are still
+there for the next one. The kernels import the PRELOAD modules (e.g. pandas and numpy) as
+they start, and the pool keeps some of them started in advance, so that an analysis step only
+pays for its own code.
+
+The memory of a kernel and the CPU time of each execution are bounded with `resource` limits
+(on POSIX systems), and an execution that takes longer than its timeout kills the kernel.
+"""
+import json
+import queue
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from appgen.config import CONFIG
+from appgen.utils import logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+KERNEL_SCRIPT = r'''
+import contextlib, io, json, os, signal, sys, traceback
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The replies are written to a copy of stdout; what the executed code or its subprocesses
+# write to the file descriptors 1 and 2 is discarded, and what it prints is captured.
+replies = os.fdopen(os.dup(1), "w")
+devnull = os.open(os.devnull, os.O_WRONLY)
+os.dup2(devnull, 1)
+os.dup2(devnull, 2)
+
+def on_cpu_limit(signum, frame):
+    raise TimeoutError("The execution exceeded its CPU time limit.")
+
+if resource is not None and hasattr(signal, "SIGXCPU"):
+    signal.signal(signal.SIGXCPU, on_cpu_limit)
+
+namespace = {"__name__": "__main__"}
+for module in json.loads(sys.argv[1]):
+    try:
+        exec(f"import {module}", namespace)
+    except Exception:
+        pass
+replies.write(json.dumps({"ready": True}) + "\n")
+replies.flush()
+
+cpu_limit = json.loads(sys.argv[2])
+for line in sys.stdin:
+    request = json.loads(line)
+    output, exitcode = io.StringIO(), 0
+    if cpu_limit and resource is not None:
+        used = resource.getrusage(resource.RUSAGE_SELF).ru_utime + resource.getrusage(resource.RUSAGE_SELF).ru_stime
+        resource.setrlimit(resource.RLIMIT_CPU, (int(used) + cpu_limit, resource.RLIM_INFINITY))
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            exec(compile(request["code"], request.get("filename") or "<code>", "exec"), namespace)
+        except SystemExit as error:
+            exitcode = error.code if isinstance(error.code, int) else 1
+        except BaseException:
+            exitcode = 1
+            traceback.print_exc()
+    replies.write(json.dumps({"exitcode": exitcode, "output": output.getvalue()}) + "\n")
+    replies.flush()
+'''
+
+
+class Kernel:
+    """
+    A persistent Python subprocess that executes code in the same namespace.
+
+    Args:
+        work_dir (Path): The working directory of the kernel.
+        preload (List[str]): The modules imported when the kernel starts.
+        memory_limit (int, optional): The maximum address space of the kernel in MB.
+        cpu_limit (int, optional): The maximum CPU time of each execution in seconds.
+    """
+
+    def __init__(self, work_dir: Path, preload: List[str] = (), memory_limit: Optional[int] = None, cpu_limit: Optional[int] = None):
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_limit = memory_limit
+        self._replies = queue.Queue()
+        self._process = subprocess.Popen(
+            [sys.executable, "-u", "-c", KERNEL_SCRIPT, json.dumps(list(preload)), json.dumps(cpu_limit)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.work_dir,
+            text=True,
+            preexec_fn=self._set_limits if resource is not None else None,
+        )
+        threading.Thread(target=self._read_replies, daemon=True).start()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _set_limits(self):
+        "Limit the memory of the kernel process, before it starts."
+        if self.memory_limit:
+            limit = self.memory_limit * 2**20
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    def _read_replies(self):
+        for line in self._process.stdout:
+            self._replies.put(json.loads(line))
+        self._replies.put(None)
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    def wait_until_ready(self, timeout: Optional[float] = None):
+        "Wait until the kernel imported its preloaded modules."
+        if not self._ready:
+            reply = self._replies.get(timeout=timeout)
+            if reply is None:
+                raise RuntimeError("The kernel exited while it was starting.")
+            self._ready = True
+
+    def execute(self, code: str, timeout: Optional[float] = None, filename: Optional[str] = None) -> Tuple[int, str]:
+        """
+        Execute the code in the namespace of the kernel.
+
+        Returns:
+            Tuple[int, str]: The exit code (0 if the code ran without error) and the output of the code.
+        """
+        with self._lock:
+            try:
+                self.wait_until_ready(timeout)
+                self._process.stdin.write(json.dumps({"code": code, "filename": filename}) + "\n")
+                self._process.stdin.flush()
+                reply = self._replies.get(timeout=timeout)
+            except queue.Empty:
+                self.shutdown()
+                return 1, f"Timeout: the execution took more than {timeout} seconds, and its kernel was restarted."
+            except (OSError, RuntimeError):
+                reply = None
+            if reply is None:
+                self.shutdown()
+                return 1, "The kernel died, e.g. because it exceeded its memory limit, and was restarted."
+            return reply["exitcode"], reply["output"]
+
+    def shutdown(self):
+        if self.is_alive:
+            self._process.kill()
+            self._process.wait()
+
+
+class KernelPool:
+    """
+    Keeps a kernel per session and a few kernels started in advance for the new sessions.
+
+    A session is e.g. an analysis of a role during a run, so that its code blocks share their
+    variables, while the sessions of different runs or roles do not.
+
+    Args:
+        size (int): The number of kernels started in advance.
+        work_dirs (List[str]): The working directories to start kernels in advance for right away.
+        **kernel_kwargs: The arguments of the kernels, see `Kernel`.
+    """
+
+    def __init__(self, size: int = 1, work_dirs: List[str] = (), **kernel_kwargs):
+        self.size = size
+        self.kernel_kwargs = kernel_kwargs
+        self._sessions: Dict[Tuple[str, str], Kernel] = {}
+        self._spares: Dict[str, List[Kernel]] = {}
+        self._lock = threading.Lock()
+        for work_dir in work_dirs:
+            self.warm(work_dir)
+
+    def warm(self, work_dir: str):
+        "Start kernels in advance in the working directory, so that its first session does not wait for them."
+        with self._lock:
+            self._start_spares(str(work_dir))
+
+    def _start_spares(self, work_dir: str):
+        "Start kernels in advance for the next sessions in the working directory."
+        spares = self._spares.setdefault(work_dir, [])
+        spares[:] = [kernel for kernel in spares if kernel.is_alive]
+        while len(spares) < self.size:
+            spares.append(Kernel(work_dir, **self.kernel_kwargs))
+
+    def get(self, session: str, name: str, work_dir: str) -> Kernel:
+        "Return the kernel of the session, with a spare kernel for a new session."
+        with self._lock:
+            kernel = self._sessions.get((session, name))
+            if kernel is None or not kernel.is_alive:
+                spares = [kernel for kernel in self._spares.get(str(work_dir), []) if kernel.is_alive]
+                kernel = spares.pop(0) if spares else Kernel(work_dir, **self.kernel_kwargs)
+                self._spares[str(work_dir)] = spares
+                self._sessions[(session, name)] = kernel
+            self._start_spares(str(work_dir))
+            return kernel
+
+    def close_session(self, session: str):
+        "Shut down the kernels of the session."
+        with self._lock:
+            for key in [key for key in self._sessions if key[0] == session]:
+                self._sessions.pop(key).shutdown()
+
+    def shutdown(self):
+        with self._lock:
+            for kernel in list(self._sessions.values()) + [kernel for spares in self._spares.values() for kernel in spares]:
+                kernel.shutdown()
+            self._sessions.clear()
+            self._spares.clear()
+
+
+_kernel_pool = None
+_kernel_pool_lock = threading.Lock()
+
+
+def get_kernel_pool() -> KernelPool:
+    "Return the kernel pool shared by the process, configured with the KERNEL_* settings."
+    global _kernel_pool
+    with _kernel_pool_lock:
+        if _kernel_pool is None:
+            _kernel_pool = KernelPool(
+                size=CONFIG.kernel_pool_size,
+                preload=CONFIG.kernel_preload,
+                memory_limit=CONFIG.kernel_memory_limit,
+                cpu_limit=CONFIG.kernel_cpu_limit,
+            )
+            logger.info(f"Kernel pool is started with the modules {CONFIG.kernel_preload} preloaded.")
+    return _kernel_pool
+
+
+def close_kernel_session(session: str):
+    "Shut down the kernels of the session, if the kernel pool was started."
+    if _kernel_pool is not None:
+        _kernel_pool.close_session(session)
@@ -0,0 +1,352 @@
+"""
+A local knowledge base of the documents and the code of the past runs.
+
+At the end of a run, its requirements, data model, design and backlog documents and its code
+files are embedded and added to an index on disk. The tasks whose prompt uses the
+`past_artifacts` placeholder get the most similar past artifacts, so that a new request can
+start from the curated outputs of a similar one. Each run is also indexed by its request, so
+that a near-duplicate request can fork the whole run (see `TaskChain._fork`).
+
+The embeddings are computed locally by hashing the words and word pairs of the texts, or with
+the OpenAI embeddings API (`KNOWLEDGE_BASE_EMBEDDINGS: 'openai'`). The index is an approximate
+nearest neighbour index with random hyperplane LSH: the entries are short-listed by the number
+of bits their signatures differ from the query's (which estimates the angle between their
+embeddings), and the short list is ranked by the exact cosine similarity. The embeddings are
+memory-mapped from disk, and only those of the short list are read. No external service is needed.
+
+    python -m appgen.utils.knowledge_base search "sales dashboard per region" --kinds requirements
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from appgen.config import CONFIG
+from appgen.utils import logger, json_to_markdown
+from appgen.utils.token_counter import truncate_tokens
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# The kind of artifact of each document class, see `KnowledgeBase.add_run`.
+DOCUMENT_KINDS = {
+    "PRDSchema": "requirements",
+    "DataModelSchema": "data_model",
+    "SDDSchema": "design",
+    "BacklogSchema": "backlog",
+}
+# The kinds of the entries retrieved into the prompts; the "request" entries index the runs themselves.
+ARTIFACT_KINDS = list(DOCUMENT_KINDS.values()) + ["code"]
+WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+class HashingEmbedder:
+    """
+    Embeds texts locally by hashing their words and word pairs into a fixed number of dimensions.
+
+    Args:
+        dim (int): The number of dimensions of the embeddings.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD_PATTERN.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        # Damp the frequent features, then normalize for the cosine similarity.
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class OpenAIEmbedder:
+    """
+    Embeds texts with the OpenAI embeddings API, with the first config of the config list.
+
+    Args:
+        model (str): The embedding model.
+    """
+
+    name = "openai"
+
+    def __init__(self, model: str = "text-embedding-3-small"):
+        from openai import OpenAI
+
+        config = CONFIG.config_list[0] if CONFIG.config_list else {}
+        self.client = OpenAI(api_key=config.get("api_key"), base_url=config.get("base_url"))
+        self.model = model
+        self.name = f"openai:{model}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        texts = [truncate_tokens(text, 8000) for text in texts]
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+# The number of bits set in each byte, to count the bits of the signature differences.
+_BIT_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+class KnowledgeBase:
+    """
+    The index of the past artifacts on disk: their embeddings, their LSH signatures and their entries.
+
+    Args:
+        directory (Path): The directory of the index.
+        embedder: The embedder of the texts (`HashingEmbedder` or `OpenAIEmbedder`).
+        n_bits (int): The number of bits of the signatures, i.e. of random hyperplanes (a multiple of 8).
+        n_candidates (int): The minimum size of the short list ranked by the exact cosine similarity.
+        seed (int): The seed of the random hyperplanes.
+    """
+
+    def __init__(self, directory: Path, embedder=None, n_bits: int = 256, n_candidates: int = 200, seed: int = 0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.embedder = embedder or HashingEmbedder()
+        self.n_bits = n_bits
+        self.n_candidates = n_candidates
+        self.seed = seed
+        self._lock = threading.Lock()
+        with self._lock_index():
+            self._load()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.directory / "vectors.npy"
+
+    @property
+    def _signatures_path(self) -> Path:
+        return self.directory / "signatures.npy"
+
+    @property
+    def _entries_path(self) -> Path:
+        return self.directory / "entries.jsonl"
+
+    @contextlib.contextmanager
+    def _lock_index(self):
+        "Hold an exclusive lock on the index files across the processes, e.g. the workers of a batch."
+        with open(self.directory / ".lock", "a+b") as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+                else:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load(self):
+        "Load the entries of the index, and the vectors and signatures as memory maps."
+        meta_path = self.directory / "meta.json"
+        meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else None
+        if meta is not None and meta["embedder"] != self.embedder.name:
+            raise ValueError(f"The knowledge base at {self.directory} was built with the '{meta['embedder']}' embeddings, not '{self.embedder.name}'.")
+        self.entries = []
+        if self._entries_path.exists():
+            with open(self._entries_path, "r", encoding="utf-8") as file:
+                self.entries = [json.loads(line) for line in file if line.strip()]
+        self.vectors = np.load(self._vectors_path, mmap_mode="r") if self._vectors_path.exists() else None
+        self.signatures = np.load(self._signatures_path, mmap_mode="r") if self._signatures_path.exists() else None
+        if self.vectors is not None and len(self.vectors) != len(self.entries):
+            # A run stopped while it was adding its artifacts: keep the entries that have their vectors.
+            size = min(len(self.vectors), len(self.signatures), len(self.entries))
+            self.entries, self.vectors, self.signatures = self.entries[:size], self.vectors[:size], self.signatures[:size]
+        self._planes = None
+        if meta is None:
+            meta_path.write_text(json.dumps({"embedder": self.embedder.name}), encoding="utf-8")
+
+    def _get_planes(self, dim: int) -> np.ndarray:
+        if self._planes is None:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal((self.n_bits, dim)).astype(np.float32)
+        return self._planes
+
+    def _sign(self, vectors: np.ndarray) -> np.ndarray:
+        "Return the LSH signature of each vector, the side of each random hyperplane it is on, packed in bytes."
+        return np.packbits(vectors @ self._get_planes(vectors.shape[1]).T > 0, axis=1)
+
+    def add(self, entries: List[Dict]):
+        """
+        Embed and add the entries to the index. Each entry has a `text`, a `kind` and any other
+        metadata (e.g. the project and the title). An entry whose `hash` (by default the hash of
+        its text) is already in the index for the same project is skipped.
+        """
+        # The whole read-modify-write holds the lock of the index, so that the entries and the
+        # vectors added by concurrent processes are neither lost nor paired with each other's.
+        with self._lock, self._lock_index():
+            # Load the index again, for the artifacts added by the other processes.
+            self._load()
+            known = {(entry.get("project"), entry["hash"]) for entry in self.entries}
+            new_entries = []
+            for entry in entries:
+                entry = dict(entry)
+                entry.setdefault("hash", hashlib.sha256(entry["text"].encode("utf-8")).hexdigest())
+                if (entry.get("project"), entry["hash"]) not in known:
+                    known.add((entry.get("project"), entry["hash"]))
+                    new_entries.append(entry)
+            if not new_entries:
+                return
+            vectors = self.embedder.embed([entry["text"] for entry in new_entries])
+            signatures = self._sign(vectors)
+            if self.vectors is not None:
+                vectors = np.concatenate([np.asarray(self.vectors), vectors])
+                signatures = np.concatenate([np.asarray(self.signatures), signatures])
+            self._save_array(self._vectors_path, vectors)
+            self._save_array(self._signatures_path, signatures)
+            self.entries.extend(new_entries)
+            tmp_path = self._entries_path.with_suffix(".tmp.jsonl")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for entry in self.entries:
+                    file.write(json.dumps(entry) + "\n")
+            tmp_path.replace(self._entries_path)
+            self.vectors = np.load(self._vectors_path, mmap_mode="r")
+            self.signatures = np.load(self._signatures_path, mmap_mode="r")
+            logger.info(f"Added {len(new_entries)} artifacts to the knowledge base at {self.directory}.")
+
+    @staticmethod
+    def _save_array(path: Path, array: np.ndarray):
+        tmp_path = path.with_suffix(".tmp.npy")
+        np.save(tmp_path, array)
+        tmp_path.replace(path)
+
+    def search(self, query: str, top_k: int = 3, kinds: Optional[List[str]] = None, exclude_run_id: Optional[str] = None) -> List[Dict]:
+        """
+        Return the top_k entries most similar to the query, with their `score`.
+
+        Args:
+            query (str): The text to search for, e.g. the request of the client.
+            top_k (int): The maximum number of entries to return.
+            kinds (List[str], optional): Only return the entries of these kinds.
+            exclude_run_id (str, optional): Do not return the entries of this run, e.g. of the run searching.
+        """
+        with self._lock:
+            if not self.entries:
+                return []
+            vector = self.embedder.embed([query])
+            candidates = np.array([
+                idx for idx, entry in enumerate(self.entries)
+                if (kinds is None or entry["kind"] in kinds)
+                and (exclude_run_id is None or entry.get("run_id") != exclude_run_id)
+            ], dtype=np.int64)
+            if candidates.size == 0:
+                return []
+            n_candidates = max(self.n_candidates, 10 * top_k)
+            if candidates.size > n_candidates:
+                # Short-list the entries whose signatures differ from the query's by the fewest bits.
+                differences = np.bitwise_xor(np.asarray(self.signatures[candidates]), self._sign(vector))
+                distances = _BIT_COUNTS[differences].sum(axis=1, dtype=np.int64)
+                candidates = np.sort(candidates[np.argpartition(distances, n_candidates)[:n_candidates]])
+            scores = np.asarray(self.vectors[candidates]) @ vector[0]
+            best = np.argsort(-scores)[:top_k]
+            return [dict(self.entries[candidates[idx]], score=float(scores[idx])) for idx in best]
+
+    def add_run(self, project: str, run_id: str, request: str, docs: Dict, code: Dict[str, str], **metadata):
+        """
+        Add the documents and the code files of a finished run, and the run itself as a "request"
+        entry with the metadata (e.g. its project directory), see `find_similar_run`.
+        """
+        entries = [dict(kind="request", title=project, text=request, hash=hashlib.sha256(json.dumps([request, metadata], sort_keys=True).encode("utf-8")).hexdigest(), **metadata)]
+        for name, doc in docs.items():
+            kind = DOCUMENT_KINDS.get(type(doc).__name__, name)
+            text = json_to_markdown(json.loads(doc.model_dump_json()))
+            entries.append(dict(kind=kind, title=getattr(doc, "Title", name), text=text))
+        for filename, content in code.items():
+            if filename and content:
+                entries.append(dict(kind="code", title=filename, text=content))
+        created = time.time()
+        self.add([dict(entry, project=project, run_id=run_id, request=request, created=created) for entry in entries])
+
+    def find_similar_run(self, request: str, min_similarity: float, exclude_run_id: Optional[str] = None, **metadata) -> Optional[Dict]:
+        """
+        Return the "request" entry of the past run most similar to the request, if its similarity is
+        at least min_similarity and its metadata (e.g. the fingerprint of its data sources) match.
+        """
+        entries = self.search(request, top_k=10, kinds=["request"], exclude_run_id=exclude_run_id)
+        for entry in entries:
+            if entry["score"] >= min_similarity and all(entry.get(key) == value for key, value in metadata.items()):
+                return entry
+        return None
+
+
+def format_artifacts(entries: List[Dict], max_tokens: int = 1500) -> str:
+    "Return the entries as Markdown for the prompts, each truncated to max_tokens."
+    if not entries:
+        return "No similar past artifact was found."
+    sections = []
+    for entry in entries:
+        text = truncate_tokens(entry["text"], max_tokens)
+        sections.append(
+            f"### {entry['kind']}: {entry['title']} (project: {entry.get('project')}, similarity: {entry['score']:.2f})\n"
+            f"Request: {entry.get('request')}\n\n{text}"
+        )
+    return "\n\n".join(sections)
+
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base() -> Optional[KnowledgeBase]:
+    "Return the knowledge base shared by the process, or None if it is disabled."
+    global _knowledge_base
+    if not CONFIG.knowledge_base_enabled:
+        return None
+    with _knowledge_base_lock:
+        if _knowledge_base is None:
+            if CONFIG.knowledge_base_embeddings == "openai":
+                embedder = OpenAIEmbedder(CONFIG.knowledge_base_embedding_model)
+            else:
+                embedder = HashingEmbedder()
+            _knowledge_base = KnowledgeBase(CONFIG.knowledge_base_path, embedder=embedder)
+    return _knowledge_base
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the knowledge base of the past artifacts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search_parser = subparsers.add_parser("search", help="Print the past artifacts most similar to a query")
+    search_parser.add_argument("query", type=str)
+    search_parser.add_argument("--top_k", type=int, default=3)
+    search_parser.add_argument("--kinds", type=str, nargs="*", default=None)
+    subparsers.add_parser("stats", help="Print the number of artifacts of each kind")
+    args = parser.parse_args()
+
+    knowledge_base = get_knowledge_base()
+    if knowledge_base is None:
+        print("The knowledge base is disabled (KNOWLEDGE_BASE_ENABLED).")
+        return
+    if args.command == "search":
+        print(format_artifacts(knowledge_base.search(args.query, top_k=args.top_k, kinds=args.kinds)))
+    else:
+        kinds = {}
+        for entry in knowledge_base.entries:
+            kinds[entry["kind"]] = kinds.get(entry["kind"], 0) + 1
+        print(json.dumps(dict(path=str(knowledge_base.directory), artifacts=len(knowledge_base.entries), kinds=kinds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from autogen import OpenAIWrapper
+from openai import APIError, AsyncAzureOpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage
+
+from appgen.utils import logger
+from appgen.utils.token_counter import count_message_tokens, count_tokens
+from appgen.config import CONFIG
+from appgen.utils.cost import estimate_cost_of_completion, a_estimate_cost_of_completion, estimate_request, get_price_registry
+from appgen.utils.llm_cache import get_llm_cache, LLMCache
+
+
+class AsyncOpenAIWrapper:
+    """
+    The async counterpart of autogen's OpenAIWrapper, used by the async execution path.
+
+    It creates an async OpenAI (or Azure OpenAI) client for each config in the config list
+    and falls back to the next config when a request fails. It accepts the same llm_config
+    as autogen, e.g. `AsyncOpenAIWrapper(**role.llm_config)`.
+    """
+
+    client_kwargs = {"api_key", "base_url", "organization", "timeout", "max_retries", "default_headers"}
+    azure_kwargs = {"api_version", "azure_endpoint", "azure_deployment", "azure_ad_token"}
+    extra_kwargs = {"api_type", "cache_seed", "filter_func", "allow_format_str_template", "context"}
+
+    def __init__(self, *, config_list: Optional[List[Dict]] = None, **base_config):
+        self._clients = []
+        self._config_list = []
+        # Whether the str messages are format templates of the context, like in autogen.
+        self.allow_format_str_template = base_config.get("allow_format_str_template", False)
+        for config in config_list or [{}]:
+            config = {**base_config, **config}
+            self._clients.append(self._client(config))
+            excluded = self.client_kwargs | self.azure_kwargs | self.extra_kwargs
+            self._config_list.append({k: v for k, v in config.items() if k not in excluded})
+
+    def _client(self, config: Dict):
+        if config.get("api_type", "").startswith("azure"):
+            client_config = {k: v for k, v in config.items() if k in self.client_kwargs | self.azure_kwargs}
+            if "base_url" in client_config:
+                client_config["azure_endpoint"] = client_config.pop("base_url")
+            return AsyncAzureOpenAI(**client_config)
+        return AsyncOpenAI(**{k: v for k, v in config.items() if k in self.client_kwargs})
+
+    async def create(
+            self,
+            messages: List[Dict],
+            on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+            **kwargs
+        ) -> ChatCompletion:
+        """
+        Request a chat completion, trying each config of the config list in order.
+
+        Args:
+            messages (List[Dict]): The messages of the request.
+            on_token (Callable, optional): If given, the completion is streamed and this
+                coroutine function is awaited with each new piece of content or of the
+                arguments of the tool calls.
+            **kwargs: Any additional parameters of the request.
+
+        Raises:
+            APIError: The error of the last config if all of them failed.
+        """
+        messages = self._instantiate(messages, kwargs.pop("context", None))
+        last_error = None
+        for idx, (client, config) in enumerate(zip(self._clients, self._config_list)):
+            params = {**config, **kwargs}
+            try:
+                if on_token is None:
+                    return await client.chat.completions.create(messages=messages, **params)
+                params["stream"] = True
+                stream = await client.chat.completions.create(messages=messages, **params)
+            except APIError as error:
+                logger.debug(f"Config {idx} of the config list failed: {error}")
+                last_error = error
+                continue
+            return await self._consume_stream(stream, messages, params.get("model"), on_token)
+        raise last_error
+
+    def _instantiate(self, messages: List[Dict], context: Optional[Dict]) -> List[Dict]:
+        "Instantiate the contents of the messages with the context, as autogen's OpenAIWrapper does."
+        if not context:
+            return messages
+        return [
+            {**message, "content": OpenAIWrapper.instantiate(message["content"], context, self.allow_format_str_template)}
+            if message.get("content") else message
+            for message in messages
+        ]
+
+    @staticmethod
+    async def _consume_stream(stream, messages, model, on_token) -> ChatCompletion:
+        """
+        Forward the streamed content and the arguments of the streamed tool calls to on_token
+        and build the complete ChatCompletion.
+        """
+        content, response_id, finish_reason = "", None, None
+        tool_calls = {}
+        async for chunk in stream:
+            response_id = response_id or chunk.id
+            model = chunk.model or model
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta.content:
+                content += choice.delta.content
+                await on_token(choice.delta.content)
+            # The id and the name of a tool call come with its first delta, its arguments are split over the next ones.
+            for delta in choice.delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(delta.index, dict(id="", name="", arguments=""))
+                tool_call["id"] = delta.id or tool_call["id"]
+                if delta.function is not None:
+                    tool_call["name"] += delta.function.name or ""
+                    if delta.function.arguments:
+                        tool_call["arguments"] += delta.function.arguments
+                        await on_token(delta.function.arguments)
+
+        # The streamed chunks do not report the usage, so the tokens are counted locally.
+        n_input_tokens = count_message_tokens(messages, model)
+        n_output_tokens = count_tokens(content + "".join(call["name"] + call["arguments"] for call in tool_calls.values()), model)
+        message = ChatCompletionMessage(
+            role="assistant",
+            content=(content or None) if tool_calls else content,
+            tool_calls=[
+                ChatCompletionMessageToolCall(
+                    id=call["id"],
+                    type="function",
+                    function=Function(name=call["name"], arguments=call["arguments"]),
+                )
+                for _, call in sorted(tool_calls.items())
+            ] or None,
+        )
+        return ChatCompletion(
+            id=response_id or "",
+            object="chat.completion",
+            created=int(time.time()),
+            model=model,
+            choices=[Choice(
+                index=0,
+                finish_reason=finish_reason or ("tool_calls" if tool_calls else "stop"),
+                message=message,
+            )],
+            usage=CompletionUsage(
+                prompt_tokens=n_input_tokens,
+                completion_tokens=n_output_tokens,
+                total_tokens=n_input_tokens + n_output_tokens,
+            ),
+        )
+
+    @staticmethod
+    def extract_text_or_function_call(response: ChatCompletion) -> List:
+        "Return the text or the function call of each choice of the response, like autogen's OpenAIWrapper."
+        return [
+            choice.message if choice.message.function_call is not None else choice.message.content
+            for choice in response.choices
+        ]
+
+
+def make_cache_key(client, messages: List[Dict], context: Optional[Dict] = None, **kwargs) -> str:
+    """
+    Return the cache key of a chat completion request: a hash of the models and temperatures
+    the client may use, the messages (including the system message), the context the templated
+    messages are instantiated with and any extra parameters.
+    """
+    configs = [
+        {"model": config.get("model"), "temperature": config.get("temperature")}
+        for config in getattr(client, "_config_list", [])
+    ]
+    return LLMCache.make_key(configs=configs, messages=messages, context=context, **kwargs)
+
+
+def admit_request(client, run_context, messages: List[Dict], **kwargs) -> Dict:
+    """
+    Check the predicted tokens and cost of a request against the remaining budgets of the run.
+
+    Returns:
+        Dict: The parameters of the request, with `max_tokens` capped if the completion it asks
+            for does not fit in the remaining budgets.
+
+    Raises:
+        BudgetExceededError: If a budget is exhausted or cannot afford the request.
+    """
+    run_context.budget.check()
+    if not run_context.budget.has_limits:
+        return kwargs
+    model = (getattr(client, "_config_list", None) or [{}])[0].get("model")
+    n_input_tokens, n_output_tokens, cost = estimate_request(model, messages, kwargs.get("max_tokens"))
+    max_tokens = run_context.budget.admit(n_input_tokens, n_output_tokens, get_price_registry().get(model), CONFIG.min_completion_tokens)
+    if max_tokens < n_output_tokens:
+        logger.warning(f"The predicted cost of the request (${cost:.2f}, {n_input_tokens + n_output_tokens} tokens) exceeds the remaining budget. Capping its completion at {max_tokens} tokens.")
+        kwargs = {**kwargs, "max_tokens": max_tokens}
+    return kwargs
+
+
+def create_completion(client, run_context, messages: List[Dict], context: Optional[Dict] = None, **kwargs) -> ChatCompletion:
+    """
+    Request a chat completion with the given client, going through the LLM cache when enabled.
+
+    The cost of the completion is only estimated (and added to the running total of the
+    run) when the response did not come from the cache.
+
+    Args:
+        client (OpenAIWrapper): The autogen client used to request the completion.
+        run_context (RunContext): The context of the run that requests the completion.
+        messages (List[Dict]): The messages of the request, including the system message.
+        context (Dict, optional): The context to instantiate the messages with.
+        **kwargs: Any additional parameters of the request.
+
+    Returns:
+        ChatCompletion: The response of the request.
+    """
+    with run_context.tracer.span("chat.completions", kind="llm") as span:
+        cache = get_llm_cache()
+        if cache is not None:
+            key = make_cache_key(client, messages, context=context, **kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                logger.debug(f"LLM cache hit: {key}")
+                response = ChatCompletion.model_validate_json(cached)
+                _set_span_usage(span, response, cache_hit=True)
+                return response
+
+        request = admit_request(client, run_context, messages, **kwargs)
+        response = client.create(context=context, messages=messages, **request)
+        cost = estimate_cost_of_completion(response, run_context)
+        _set_span_usage(span, response, cache_hit=False, cost=cost)
+
+        if cache is not None:
+            cache.set(key, response.model_dump_json())
+        return response
+
+
+async def a_create_completion(
+        client: AsyncOpenAIWrapper,
+        run_context,
+        messages: List[Dict],
+        context: Optional[Dict] = None,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+        **kwargs
+    ) -> ChatCompletion:
+    """
+    The async version of `create_completion` to be used with an AsyncOpenAIWrapper.
+
+    Args:
+        client (AsyncOpenAIWrapper): The async client used to request the completion.
+        run_context (RunContext): The context of the run that requests the completion.
+        messages (List[Dict]): The messages of the request, including the system message.
+        context (Dict, optional): The context to instantiate the messages with.
+        on_token (Callable, optional): If given, the completion is streamed and this coroutine
+            function is awaited with each new piece of content or of the arguments of the
+            tool calls. A cached response is forwarded at once.
+        **kwargs: Any additional parameters of the request.
+
+    Returns:
+        ChatCompletion: The response of the request.
+    """
+    with run_context.tracer.span("chat.completions", kind="llm", stream=on_token is not None) as span:
+        cache = get_llm_cache()
+        if cache is not None:
+            key = make_cache_key(client, messages, context=context, **kwargs)
+            # The SQLite cache may wait for the lock of another process: it is kept off the event loop.
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                logger.debug(f"LLM cache hit: {key}")
+                response = ChatCompletion.model_validate_json(cached)
+                if on_token is not None:
+                    message = response.choices[0].message
+                    for text in [message.content] + [call.function.arguments for call in message.tool_calls or []]:
+                        if text:
+                            await on_token(text)
+                _set_span_usage(span, response, cache_hit=True)
+                return response
+
+        request = admit_request(client, run_context, messages, **kwargs)
+        response = await client.create(context=context, messages=messages, on_token=on_token, **request)
+        cost = await a_estimate_cost_of_completion(response, run_context)
+        _set_span_usage(span, response, cache_hit=False, cost=cost)
+
+        if cache is not None:
+            await asyncio.to_thread(cache.set, key, response.model_dump_json())
+        return response
+
+
+def _set_span_usage(span, response: ChatCompletion, cache_hit: bool, cost: float = 0.0):
+    "Record the model, the token usage and the cost of the completion on its span."
+    usage = response.usage
+    span.set(
+        model=response.model,
+        cache_hit=cache_hit,
+        prompt_tokens=usage.prompt_tokens if usage is not None else 0,
+        completion_tokens=usage.completion_tokens if usage is not None else 0,
+        cost=cost,
+    )
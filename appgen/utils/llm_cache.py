@@ -0,0 +1,184 @@
+"""
+A persistent, content-addressed cache of LLM responses.
+
+The cache is a SQLite database (by default under the workspace) that is shared by all
+roles, actions and runs. Each entry is keyed by a hash of the model, the temperature, the
+context and the messages (including the system message) of the request.
+
+Run `python -m appgen.utils.llm_cache --help` to inspect or prune the cache.
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from appgen.config import CONFIG
+from appgen.utils import logger
+
+
+class LLMCache:
+    """
+    SQLite backed LLM response cache with TTL and LRU eviction.
+
+    The database is opened in WAL mode with a busy timeout, so that the batch workers and the
+    sessions of the same workspace can share it. A failed read or write of the cache is logged
+    and treated as a miss, so that it never fails the LLM call itself.
+
+    Args:
+        path (Path): The path of the SQLite database file.
+        busy_timeout (int): The number of milliseconds to wait for a lock held by another connection.
+        ttl (int, optional): The number of seconds an entry stays valid. None means forever.
+        max_entries (int, optional): The maximum number of entries to keep. The least
+            recently used entries are evicted first. None means unlimited.
+    """
+
+    def __init__(self, path: Path, ttl: Optional[int] = None, max_entries: Optional[int] = None, busy_timeout: int = 5000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=busy_timeout / 1000, check_same_thread=False)
+        self._conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+
+    @staticmethod
+    def make_key(**request) -> str:
+        "Return the content hash of the request (model, temperature, messages, ...)."
+        payload = json.dumps(request, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        "Return the cached response for the key, or None on a miss or if the cache cannot be read."
+        try:
+            return self._get(key)
+        except sqlite3.Error as error:
+            logger.warning(f"Cannot read the LLM cache, the request is not cached: {error}")
+            self.misses += 1
+            return None
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str):
+        "Store the response for the key and evict the expired and least recently used entries."
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now),
+                )
+            self.prune()
+        except sqlite3.Error as error:
+            logger.warning(f"Cannot write to the LLM cache, the response is not cached: {error}")
+
+    def prune(self, ttl: Optional[int] = None, max_entries: Optional[int] = None) -> int:
+        """
+        Delete the entries older than the TTL and the least recently used entries beyond max_entries.
+
+        Args:
+            ttl (int, optional): Overrides the TTL of the cache.
+            max_entries (int, optional): Overrides the max entries of the cache.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        max_entries = self.max_entries if max_entries is None else max_entries
+        deleted = 0
+        with self._lock, self._conn:
+            if ttl is not None:
+                deleted += self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - ttl,)).rowcount
+            if max_entries is not None:
+                deleted += self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key NOT IN (SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT ?)",
+                    (max_entries,),
+                ).rowcount
+        return deleted
+
+    def clear(self) -> int:
+        "Delete all the entries and return the number of deleted entries."
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM llm_cache").rowcount
+
+    def stats(self) -> dict:
+        "Return the hit/miss counters of this process and the size of the cache."
+        with self._lock:
+            entries, total_hits = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM llm_cache").fetchone()
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "total_hits": total_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    "Return the LLM cache shared by the process, or None if the cache is disabled."
+    global _llm_cache
+    if not CONFIG.llm_cache_enabled:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache(
+                path=CONFIG.llm_cache_path,
+                ttl=CONFIG.llm_cache_ttl,
+                max_entries=CONFIG.llm_cache_max_entries,
+            )
+            logger.info(f"LLM cache is loaded: {_llm_cache.path}")
+    return _llm_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the LLM response cache.")
+    parser.add_argument("command", choices=["stats", "prune", "clear"], help="The command to run")
+    parser.add_argument("--path", type=Path, help="Path to the cache database", default=Path(CONFIG.llm_cache_path))
+    parser.add_argument("--ttl", type=int, help="Delete the entries older than this many seconds", default=None)
+    parser.add_argument("--max_entries", type=int, help="Keep at most this many recently used entries", default=None)
+    args = parser.parse_args()
+
+    cache = LLMCache(args.path, ttl=CONFIG.llm_cache_ttl, max_entries=CONFIG.llm_cache_max_entries)
+    if args.command == "prune":
+        print(f"Deleted {cache.prune(ttl=args.ttl, max_entries=args.max_entries)} entries.")
+    elif args.command == "clear":
+        print(f"Deleted {cache.clear()} entries.")
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
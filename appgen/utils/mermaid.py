@@ -1,8 +1,13 @@
 "Source: https://github.com/geekan/MetaGPT/blob/main/metagpt/utils/mermaid.py"
 import asyncio
+import hashlib
+import json
 import os
 import platform
+import shutil
+import weakref
 from pathlib import Path
+from typing import Dict, Optional
 
 from appgen.config import CONFIG
 from appgen.utils import logger
@@ -34,79 +39,208 @@ def extract_mermaid_code(markdown_text):
 
 
 
-async def mermaid_to_file(mermaid_code, output_file_without_suffix, width=2048, height=2048) -> int:
-    """suffix: png/svg/pdf
+class MermaidRenderer:
+    """
+    Renders mermaid diagrams to PNG or SVG files, concurrently and through a cache on disk.
 
-    :param mermaid_code: mermaid code
-    :param output_file_without_suffix: output filename
-    :param width:
-    :param height:
-    :return: 0 if succeed, -1 if failed
+    The rendered files are cached by a hash of the engine, the mermaid code, the size and the
+    format, so that an unchanged diagram is copied instead of rendered again, e.g. when a
+    document is displayed again after the feedback of the user. Identical diagrams requested at
+    the same time are rendered once.
+
+    With the `nodejs` engine each diagram is rendered by an `mmdc` process. With the
+    `playwright` engine a headless Chromium is started once and a pool of pages with mermaid
+    loaded renders the diagrams, which avoids starting a browser for each diagram.
+
+    A renderer belongs to the event loop it is used on, see `get_mermaid_renderer`.
+
+    Args:
+        engine (str): `nodejs` or `playwright`.
+        cache_dir (Path, optional): The directory of the cached files. No cache if None.
+        max_workers (int): The maximum number of diagrams rendered at the same time.
     """
-    mermaid_code = extract_mermaid_code(mermaid_code)
-
-    # Write the Mermaid code to a temporary file
-    dir_name = os.path.dirname(output_file_without_suffix)
-    if dir_name and not os.path.exists(dir_name):
-        os.makedirs(dir_name)
-    tmp = Path(f"{output_file_without_suffix}.mmd")
-    tmp.write_text(mermaid_code, encoding="utf-8")
-
-    engine = CONFIG.mermaid_engine.lower()
-    if engine == "nodejs":
-        if check_cmd_exists(CONFIG.mmdc) != 0:
+
+    def __init__(self, engine: str = "nodejs", cache_dir: Optional[Path] = None, max_workers: int = 4):
+        self.engine = engine.lower()
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_workers = max_workers
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self._mmdc_exists = None
+        self._pages = None
+        self._browser = None
+        self._playwright = None
+        self._pool_lock = asyncio.Lock()
+
+    def get_cache_key(self, mermaid_code: str, width: int, height: int, suffix: str) -> str:
+        data = json.dumps([self.engine, mermaid_code, width, height, suffix])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    async def render(self, mermaid_code: str, output_file_without_suffix, width=2048, height=2048, suffix="png") -> int:
+        """
+        Render the mermaid code to `<output_file_without_suffix>.<suffix>`.
+
+        Returns:
+            int: 0 if it succeeded, -1 if it failed.
+        """
+        mermaid_code = extract_mermaid_code(mermaid_code)
+        output_file = Path(f"{output_file_without_suffix}.{suffix}")
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        Path(f"{output_file_without_suffix}.mmd").write_text(mermaid_code, encoding="utf-8")
+
+        key = self.get_cache_key(mermaid_code, width, height, suffix)
+        cached_file = self.cache_dir / f"{key}.{suffix}" if self.cache_dir else None
+        if cached_file is not None and cached_file.exists():
+            logger.info(f"Using the cached diagram for {output_file}.")
+            shutil.copyfile(cached_file, output_file)
+            return 0
+
+        future = self._rendering.get(key)
+        if future is None:
+            future = self._rendering[key] = asyncio.ensure_future(self._render(mermaid_code, output_file, width, height, cached_file))
+            future.add_done_callback(lambda _: self._rendering.pop(key, None))
+        rendered_file = await asyncio.shield(future)
+        if rendered_file is None:
+            return -1
+        if rendered_file != output_file:
+            # The same diagram was rendered for another output file.
+            shutil.copyfile(rendered_file, output_file)
+        return 0
+
+    async def _render(self, mermaid_code: str, output_file: Path, width: int, height: int, cached_file: Optional[Path]) -> Optional[Path]:
+        "Render the diagram to the output file and the cache, and return the output file or None if it failed."
+        async with self._semaphore:
+            logger.info(f"Generating {output_file}..")
+            if self.engine == "nodejs":
+                result = await self._render_with_mmdc(mermaid_code, output_file, width, height)
+            elif self.engine == "playwright":
+                result = await self._render_with_playwright(mermaid_code, output_file, width, height)
+            else:
+                logger.warning(f"Unsupported mermaid engine: {self.engine}")
+                return None
+        if result != 0 or not output_file.exists():
+            return None
+        if cached_file is not None:
+            cached_file.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(output_file, cached_file)
+        return output_file
+
+    async def _render_with_mmdc(self, mermaid_code: str, output_file: Path, width: int, height: int) -> int:
+        if self._mmdc_exists is None:
+            self._mmdc_exists = check_cmd_exists(CONFIG.mmdc) == 0
+        if not self._mmdc_exists:
             logger.warning(
                 "RUN `npm install -g @mermaid-js/mermaid-cli` to install mmdc,"
-                "or consider changing MERMAID_ENGINE to `playwright`, `pyppeteer`, or `ink`."
+                "or consider changing MERMAID_ENGINE to `playwright`."
             )
             return -1
 
-        for suffix in ["png"]:
-            output_file = f"{output_file_without_suffix}.{suffix}"
-            # Call the `mmdc` command to convert the Mermaid code to a PNG
-            logger.info(f"Generating {output_file}..")
-            logger.info(CONFIG.puppeteer_config)
-            if CONFIG.puppeteer_config:
-                commands = [
-                    CONFIG.mmdc,
-                    "-p",
-                    CONFIG.puppeteer_config,
-                    "-i",
-                    str(tmp),
-                    "-o",
-                    output_file,
-                    "-w",
-                    str(width),
-                    "-H",
-                    str(height),
-                ]
+        input_file = output_file.with_suffix(".mmd")
+        commands = [CONFIG.mmdc]
+        if CONFIG.puppeteer_config:
+            commands += ["-p", CONFIG.puppeteer_config]
+        commands += ["-i", str(input_file), "-o", str(output_file), "-w", str(width), "-H", str(height)]
+        process = await asyncio.create_subprocess_shell(
+            " ".join(commands), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+
+        stdout, stderr = await process.communicate()
+        if stdout:
+            logger.info(stdout.decode())
+        if stderr:
+            logger.error(stderr.decode())
+        return 0 if process.returncode == 0 and output_file.exists() else -1
+
+    async def _get_page_pool(self) -> asyncio.Queue:
+        "Start the browser and open the pages with mermaid loaded, once."
+        async with self._pool_lock:
+            if self._pages is None:
+                from playwright.async_api import async_playwright
+
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch()
+                pages = asyncio.Queue()
+                for _ in range(self.max_workers):
+                    page = await self._browser.new_page()
+                    await page.set_content(MERMAID_PAGE_TEMPLATE.format(mermaid_js_url=CONFIG.mermaid_js_url))
+                    await page.wait_for_function("window.mermaid !== undefined")
+                    pages.put_nowait(page)
+                self._pages = pages
+        return self._pages
+
+    async def _render_with_playwright(self, mermaid_code: str, output_file: Path, width: int, height: int) -> int:
+        try:
+            pages = await self._get_page_pool()
+        except ImportError:
+            logger.warning("RUN `pip install playwright && playwright install chromium` to use the `playwright` mermaid engine.")
+            return -1
+        page = await pages.get()
+        try:
+            await page.set_viewport_size({"width": width, "height": height})
+            svg = await page.evaluate(RENDER_SCRIPT, mermaid_code)
+            if output_file.suffix == ".svg":
+                output_file.write_text(svg, encoding="utf-8")
             else:
-                commands = [CONFIG.mmdc, "-i", str(tmp), "-o", output_file, "-w", str(width), "-H", str(height)]
-            process = await asyncio.create_subprocess_shell(
-                " ".join(commands), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
+                await page.locator("#container svg").screenshot(path=str(output_file))
+            return 0
+        except Exception as error:
+            logger.error(f"Failed to render {output_file}: {error}")
+            return -1
+        finally:
+            pages.put_nowait(page)
 
-            stdout, stderr = await process.communicate()
-            if stdout:
-                logger.info(stdout.decode())
-            if stderr:
-                logger.error(stderr.decode())
-    else:
-        # if engine == "playwright":
-        #     from metagpt.utils.mmdc_playwright import mermaid_to_file
+    async def close(self):
+        "Close the browser of the `playwright` engine, if it was started."
+        if self._browser is not None:
+            await self._browser.close()
+            await self._playwright.stop()
+            self._pages = self._browser = self._playwright = None
+
+
+MERMAID_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<body style="margin: 0; background: white;">
+<div id="container"></div>
+<script src="{mermaid_js_url}"></script>
+<script>mermaid.initialize({{startOnLoad: false}});</script>
+</body>
+</html>"""
+
+RENDER_SCRIPT = """async (code) => {
+    const id = "diagram" + Math.random().toString(36).slice(2);
+    const { svg } = await mermaid.render(id, code);
+    document.getElementById("container").innerHTML = svg;
+    return svg;
+}"""
 
-        #     return await mermaid_to_file(mermaid_code, output_file_without_suffix, width, height)
-        # elif engine == "pyppeteer":
-        #     from metagpt.utils.mmdc_pyppeteer import mermaid_to_file
+_renderers = weakref.WeakKeyDictionary()
 
-        #     return await mermaid_to_file(mermaid_code, output_file_without_suffix, width, height)
-        # elif engine == "ink":
-        #     from metagpt.utils.mmdc_ink import mermaid_to_file
 
-        #     return await mermaid_to_file(mermaid_code, output_file_without_suffix)
-        # else:
-            logger.warning(f"Unsupported mermaid engine: {engine}")
-    return 0
+def get_mermaid_renderer() -> MermaidRenderer:
+    "Return the mermaid renderer of the running event loop, configured with the MERMAID_* settings."
+    loop = asyncio.get_running_loop()
+    if loop not in _renderers:
+        _renderers[loop] = MermaidRenderer(
+            engine=CONFIG.mermaid_engine,
+            cache_dir=CONFIG.mermaid_cache_dir or None,
+            max_workers=CONFIG.mermaid_max_workers,
+        )
+    return _renderers[loop]
+
+
+async def mermaid_to_file(mermaid_code, output_file_without_suffix, width=2048, height=2048, suffix="png") -> int:
+    """
+    Render the mermaid code to `<output_file_without_suffix>.<suffix>` with the renderer of the
+    running event loop.
+
+    :param mermaid_code: mermaid code
+    :param output_file_without_suffix: output filename
+    :param width:
+    :param height:
+    :param suffix: png or svg
+    :return: 0 if succeed, -1 if failed
+    """
+    return await get_mermaid_renderer().render(mermaid_code, output_file_without_suffix, width, height, suffix)
 
 
 # MMC1 = """classDiagram
@@ -0,0 +1,57 @@
+from typing import Iterable, Optional
+
+from appgen.utils.telemetry import current_span
+
+
+def current_task_name() -> Optional[str]:
+    "Return the name of the task span the current thread or asyncio task runs in, if any."
+    span = current_span()
+    task = span.get_ancestor("task") if span is not None else None
+    return task.name if task is not None else None
+
+
+class OutputDict(dict):
+    """
+    A dict of outputs (e.g. the documents or the code files of a run) that remembers which task
+    wrote each key last, so that the outputs of tasks running at the same time can be told apart.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writers = dict.fromkeys(self)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.writers[key] = current_task_name()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.writers.pop(key, None)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def written_by(self, task_name: str) -> dict:
+        "Return the items written by the task."
+        return {key: value for key, value in self.items() if self.writers.get(key) == task_name}
+
+
+class OutputList(list):
+    "A list of outputs that remembers which task appended each item, see `OutputDict`."
+
+    def __init__(self, items: Iterable = ()):
+        super().__init__(items)
+        self.writers = [None] * len(self)
+
+    def append(self, item):
+        super().append(item)
+        self.writers.append(current_task_name())
+
+    def extend(self, items: Iterable):
+        for item in items:
+            self.append(item)
+
+    def written_by(self, task_name: str) -> list:
+        "Return the items appended by the task."
+        return [item for item, writer in zip(self, self.writers) if writer == task_name]
@@ -0,0 +1,420 @@
+"""
+Profile the data sources of a project in one pass, without loading them in memory.
+
+The CSV, Parquet and Excel sources are read in chunks (Parquet through pyarrow when it is
+installed), and the statistics of each column are merged chunk by chunk with vectorized
+pandas and NumPy operations: the type, the null rate, the number of distinct values
+(estimated from the smallest value hashes beyond `max_distinct`), the min/max/mean/std,
+approximate quantiles (from a bounded sample) and the most frequent values. The profile also has a few sample rows and the candidate keys (the columns whose values are
+all set and unique).
+
+The profiles are rendered as a compact Markdown summary for the task prompts, see
+`format_profiles`, and cached on disk by the path of the source, see `ProfileCache`.
+
+    python -m appgen.utils.profiler data/sales.csv data/stores.parquet
+"""
+import argparse
+import csv
+import hashlib
+import json
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field
+
+from appgen.config import CONFIG
+from appgen.utils import logger
+
+SUPPORTED_FORMATS = {
+    ".csv": "csv",
+    ".tsv": "csv",
+    ".txt": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".xlsx": "excel",
+    ".xls": "excel",
+}
+QUANTILES = [0.01, 0.25, 0.5, 0.75, 0.99]
+# The number of distinct values of a column whose frequencies are counted exactly.
+MAX_COUNTED_VALUES = 10_000
+
+
+class ColumnProfile(BaseModel):
+    """The statistics of a column of a data source."""
+    name: str
+    dtype: str
+    count: int = Field(description="The number of values that are set.")
+    null_rate: float
+    distinct: int = Field(description="The number of distinct values, estimated if `distinct_estimated`.")
+    distinct_estimated: bool = False
+    min: Optional[Union[float, str]] = None
+    max: Optional[Union[float, str]] = None
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    quantiles: Dict[str, float] = Field(default_factory=dict)
+    top_values: List[List] = Field(default_factory=list, description="The most frequent values with their counts.")
+
+
+class DataProfile(BaseModel):
+    """The profile of a data source."""
+    source: str
+    format: str
+    n_rows: int
+    n_columns: int
+    columns: List[ColumnProfile]
+    sample_rows: List[Dict] = Field(default_factory=list)
+    candidate_keys: List[str] = Field(default_factory=list)
+
+    def to_markdown(self) -> str:
+        "Return a compact Markdown summary of the profile, for the prompts."
+        lines = [
+            f"### {self.source}",
+            f"Format: {self.format}. Rows: {self.n_rows}. Columns: {self.n_columns}. "
+            f"Candidate keys: {', '.join(self.candidate_keys) or 'none'}.",
+            "",
+            "| column | type | null rate | distinct | min | max | mean | quantiles (1/25/50/75/99%) | top values |",
+            "|---|---|---|---|---|---|---|---|---|",
+        ]
+        for column in self.columns:
+            distinct = f"~{column.distinct}" if column.distinct_estimated else str(column.distinct)
+            quantiles = "/".join(_format_value(value) for value in column.quantiles.values())
+            top_values = ", ".join(f"{_format_value(value)} ({count})" for value, count in column.top_values)
+            lines.append(
+                f"| {column.name} | {column.dtype} | {column.null_rate:.1%} | {distinct} | {_format_value(column.min)} "
+                f"| {_format_value(column.max)} | {_format_value(column.mean)} | {quantiles} | {top_values} |"
+            )
+        if self.sample_rows:
+            lines += ["", "Sample rows:", "```", pd.DataFrame(self.sample_rows).to_string(index=False), "```"]
+        return "\n".join(lines)
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    value = str(value)
+    return value if len(value) <= 30 else value[:27] + "..."
+
+
+class _ColumnStats:
+    "Merges the statistics of a column chunk by chunk."
+
+    def __init__(self, name: str, max_distinct: int, max_sample: int, n_top_values: int, rng: np.random.Generator):
+        self.name = name
+        self.max_distinct = max_distinct
+        self.max_sample = max_sample
+        self.n_top_values = n_top_values
+        self.rng = rng
+        self.dtype = None
+        self.count = 0
+        self.nulls = 0
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.distinct_estimated = False
+        self.values = Counter()
+        self.min = self.max = None
+        self.sum = self.sum_of_squares = 0.0
+        self.sample = np.empty(0, dtype=float)
+        self.n_sampled = 0
+
+    def update(self, series: pd.Series):
+        self.dtype = self.dtype or str(series.dtype)
+        values = series.dropna()
+        self.count += len(values)
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+
+        # The smallest max_distinct hashes of the values: all of them while there are fewer distinct
+        # values, else they estimate the number of distinct values (k minimum values sketch).
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        self.hashes = np.union1d(self.hashes, hashes)
+        if len(self.hashes) > self.max_distinct:
+            self.distinct_estimated = True
+            self.hashes = self.hashes[:self.max_distinct]
+        self.values.update(values.astype(str).value_counts().to_dict())
+        if len(self.values) > MAX_COUNTED_VALUES:
+            # Too many distinct values to count them all: keep the most frequent so far.
+            self.values = Counter(dict(self.values.most_common(MAX_COUNTED_VALUES // 2)))
+
+        if pd.api.types.is_bool_dtype(values):
+            return
+        if pd.api.types.is_numeric_dtype(values):
+            numbers = values.to_numpy(dtype=float)
+            self.min = numbers.min() if self.min is None else min(self.min, numbers.min())
+            self.max = numbers.max() if self.max is None else max(self.max, numbers.max())
+            self.sum += numbers.sum()
+            self.sum_of_squares += np.square(numbers).sum()
+            self._update_sample(numbers)
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            self.min = values.min() if self.min is None else min(self.min, values.min())
+            self.max = values.max() if self.max is None else max(self.max, values.max())
+
+    def _update_sample(self, numbers: np.ndarray):
+        "Keep a uniform sample of at most max_sample numbers of the column (reservoir sampling by chunk)."
+        self.n_sampled += len(numbers)
+        merged = np.concatenate([self.sample, numbers])
+        if len(merged) <= self.max_sample:
+            self.sample = merged
+            return
+        # Each number seen so far has the same chance to be kept.
+        weights = np.concatenate([
+            np.full(len(self.sample), (self.n_sampled - len(numbers)) / max(len(self.sample), 1)),
+            np.ones(len(numbers)),
+        ])
+        keep = self.rng.choice(len(merged), size=self.max_sample, replace=False, p=weights / weights.sum())
+        self.sample = merged[keep]
+
+    def _get_distinct(self) -> int:
+        if not self.distinct_estimated:
+            return len(self.hashes)
+        return int((len(self.hashes) - 1) * 2.0**64 / float(self.hashes[-1]))
+
+    def profile(self, n_rows: int) -> ColumnProfile:
+        column = ColumnProfile(
+            name=self.name,
+            dtype=self.dtype or "unknown",
+            count=self.count,
+            null_rate=self.nulls / n_rows if n_rows else 0.0,
+            distinct=self._get_distinct(),
+            distinct_estimated=self.distinct_estimated,
+            top_values=[[value, count] for value, count in self.values.most_common(self.n_top_values)],
+        )
+        if self.sample.size:
+            mean = self.sum / self.count
+            column.min, column.max, column.mean = float(self.min), float(self.max), mean
+            column.std = float(np.sqrt(max(self.sum_of_squares / self.count - mean ** 2, 0.0)))
+            column.quantiles = {f"{q:.0%}": float(value) for q, value in zip(QUANTILES, np.quantile(self.sample, QUANTILES))}
+        elif self.min is not None:
+            column.min, column.max = str(self.min), str(self.max)
+        return column
+
+
+def get_format(path: Path) -> str:
+    "Return the format of the data source from its extension."
+    suffix = Path(path).suffix.lower()
+    if suffix not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported data source '{path}'. The supported extensions are {sorted(SUPPORTED_FORMATS)}.")
+    return SUPPORTED_FORMATS[suffix]
+
+
+def sniff_separator(path: Path, sample_bytes: int = 64 * 1024) -> str:
+    "Return the separator of the CSV file, sniffed once from its first bytes. Defaults to a comma."
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as file:
+        sample = file.read(sample_bytes)
+    # The last line of the sample may be cut in the middle.
+    sample = sample[:sample.rfind("\n") + 1] or sample
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def iter_chunks(path: Path, chunk_size: int = 100_000) -> Iterator[pd.DataFrame]:
+    "Read the data source in chunks of at most chunk_size rows."
+    path = Path(path)
+    data_format = get_format(path)
+    if data_format == "csv":
+        # The separator is sniffed once, so that the file is read by the fast C parser of pandas.
+        sep = "\t" if path.suffix.lower() == ".tsv" else sniff_separator(path)
+        yield from pd.read_csv(path, sep=sep, engine="c", chunksize=chunk_size)
+    elif data_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            # Without pyarrow, pandas reads the whole file with fastparquet.
+            yield pd.read_parquet(path)
+            return
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        # Excel files cannot be streamed: the first sheet is read at once.
+        sheet = pd.read_excel(path)
+        for start in range(0, len(sheet), chunk_size):
+            yield sheet.iloc[start:start + chunk_size]
+
+
+def profile_source(
+        path: Path,
+        chunk_size: int = 100_000,
+        sample_size: int = 5,
+        max_distinct: int = 1_000_000,
+        max_sample: int = 100_000,
+        n_top_values: int = 5,
+        seed: int = 0
+    ) -> DataProfile:
+    """
+    Profile the data source in one pass over its chunks.
+
+    Args:
+        path (Path): The path of the CSV, Parquet or Excel file.
+        chunk_size (int): The number of rows read at a time.
+        sample_size (int): The number of sample rows of the profile.
+        max_distinct (int): The number of distinct values counted exactly for each column.
+        max_sample (int): The number of values of each numeric column sampled for the quantiles.
+        n_top_values (int): The number of most frequent values of each column.
+        seed (int): The seed of the sampling, so that the profile of a source is reproducible.
+
+    Returns:
+        DataProfile: The profile of the data source.
+    """
+    rng = np.random.default_rng(seed)
+    stats: Dict[str, _ColumnStats] = {}
+    n_rows, sample_rows = 0, []
+    for chunk in iter_chunks(path, chunk_size):
+        for name in chunk.columns:
+            if str(name) not in stats:
+                stats[str(name)] = _ColumnStats(str(name), max_distinct, max_sample, n_top_values, rng)
+            stats[str(name)].update(chunk[name])
+        if len(sample_rows) < sample_size:
+            sample = chunk.head(sample_size - len(sample_rows))
+            sample_rows += sample.astype(object).where(sample.notna(), "").astype(str).to_dict(orient="records")
+        n_rows += len(chunk)
+
+    columns = [column_stats.profile(n_rows) for column_stats in stats.values()]
+    return DataProfile(
+        source=str(path),
+        format=get_format(path),
+        n_rows=n_rows,
+        n_columns=len(columns),
+        columns=columns,
+        sample_rows=sample_rows,
+        candidate_keys=[
+            column.name for column in columns
+            if n_rows and column.count == n_rows and column.distinct == n_rows and not column.distinct_estimated
+        ],
+    )
+
+
+class ProfileCache:
+    """
+    A cache of the profiles of the data sources on disk, with a JSON file per source path.
+
+    Each entry records the fingerprint of the source it was computed from: its size and
+    modification time, or a hash of its content with `use_content_hash` (slower, but it
+    survives copies and touches). The profile is computed again when the source changed.
+
+    Args:
+        directory (Path): The directory of the cached profiles.
+        use_content_hash (bool): Fingerprint the sources by their content instead of their size and mtime.
+    """
+
+    def __init__(self, directory: Path, use_content_hash: bool = False):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.use_content_hash = use_content_hash
+        self.hits = 0
+        self.misses = 0
+
+    def get_fingerprint(self, path: Path, **kwargs) -> str:
+        "Return the fingerprint of the source and of the profiling arguments."
+        path = Path(path)
+        if self.use_content_hash:
+            content = hashlib.sha256()
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(2**20), b""):
+                    content.update(block)
+            source = content.hexdigest()
+        else:
+            stat = path.stat()
+            source = f"{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.sha256(json.dumps([source, kwargs], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _get_entry_path(self, path: Path) -> Path:
+        key = hashlib.sha256(str(Path(path).resolve()).encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.json"
+
+    def get(self, path: Path, fingerprint: str) -> Optional[DataProfile]:
+        "Return the cached profile of the source, or None if the source changed since."
+        entry_path = self._get_entry_path(path)
+        try:
+            entry = json.loads(entry_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or entry["fingerprint"] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return DataProfile.model_validate(entry["profile"])
+
+    def set(self, path: Path, fingerprint: str, profile: DataProfile):
+        entry_path = self._get_entry_path(path)
+        tmp_path = entry_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"fingerprint": fingerprint, "profile": profile.model_dump(mode="json")}), encoding="utf-8")
+        tmp_path.replace(entry_path)
+
+    def profile(self, path: Path, **kwargs) -> DataProfile:
+        "Return the cached profile of the source, profiling it if it changed since it was cached."
+        fingerprint = self.get_fingerprint(path, **kwargs)
+        profile = self.get(path, fingerprint)
+        if profile is not None:
+            logger.info(f"Using the cached profile of the data source '{path}'.")
+            return profile
+        profile = profile_source(path, **kwargs)
+        self.set(path, fingerprint, profile)
+        return profile
+
+
+_profile_cache = None
+_profile_cache_lock = threading.Lock()
+
+
+def get_profile_cache() -> Optional[ProfileCache]:
+    "Return the profile cache shared by the process, or None if the cache is disabled."
+    global _profile_cache
+    if not CONFIG.profile_cache_dir:
+        return None
+    with _profile_cache_lock:
+        if _profile_cache is None:
+            _profile_cache = ProfileCache(CONFIG.profile_cache_dir, use_content_hash=CONFIG.profile_cache_content_hash)
+    return _profile_cache
+
+
+def profile_sources(paths: List[Path], **kwargs) -> List[DataProfile]:
+    "Profile the data sources that exist and are supported, through the profile cache, logging the others."
+    cache = get_profile_cache()
+    profiles = []
+    for path in paths:
+        try:
+            profiles.append(cache.profile(Path(path), **kwargs) if cache is not None else profile_source(Path(path), **kwargs))
+        except (OSError, ValueError) as error:
+            logger.warning(f"Failed to profile the data source '{path}': {error}")
+    return profiles
+
+
+def format_profiles(profiles: List[DataProfile]) -> str:
+    "Return the Markdown summary of the profiles, for the task prompts."
+    if not profiles:
+        return "No data source was profiled."
+    return "\n\n".join(profile.to_markdown() for profile in profiles)
+
+
+def get_schema_fingerprint(profiles: List[DataProfile]) -> str:
+    """
+    Return a hash of the format and the columns (names and types) of the data sources, so that two
+    runs on the same kind of data match even when the files were moved or their rows refreshed.
+    """
+    schemas = sorted([profile.format, [[column.name, column.dtype] for column in profile.columns]] for profile in profiles)
+    return hashlib.sha256(json.dumps(schemas).encode("utf-8")).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile CSV, Parquet or Excel data sources.")
+    parser.add_argument("paths", type=Path, nargs="+", help="The paths of the data sources")
+    parser.add_argument("--chunk_size", type=int, help="The number of rows read at a time", default=100_000)
+    parser.add_argument("--json", action="store_true", help="Print the profiles as JSON instead of Markdown")
+    args = parser.parse_args()
+
+    profiles = profile_sources(args.paths, chunk_size=args.chunk_size)
+    if args.json:
+        print("[" + ",\n".join(profile.model_dump_json(indent=2) for profile in profiles) + "]")
+    else:
+        print(format_profiles(profiles))
+
+
+if __name__ == "__main__":
+    main()
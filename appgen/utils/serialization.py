@@ -0,0 +1,46 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
+
+DOCUMENT_TAG = "__document__"
+
+
+def to_jsonable(value: Any) -> Any:
+    """
+    Convert the value to plain JSON types. Documents are tagged with the name of their
+    schema class, so that `from_jsonable` can rebuild them.
+    """
+    if isinstance(value, BaseModel):
+        return {DOCUMENT_TAG: type(value).__name__, "data": value.model_dump(mode="json")}
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, Path):
+        return str(value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def from_jsonable(value: Any) -> Any:
+    "Rebuild the value converted by `to_jsonable`, including its documents."
+    if isinstance(value, dict):
+        if DOCUMENT_TAG in value:
+            # Imported here since the document schemas import the actions package.
+            from appgen.actions import document_schema
+            schema = getattr(document_schema, value[DOCUMENT_TAG])
+            return schema.model_validate(value["data"])
+        return {key: from_jsonable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_jsonable(item) for item in value]
+    return value
+
+
+def digest(value: Any) -> str:
+    "Return a stable hash of the value."
+    payload = json.dumps(to_jsonable(value), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
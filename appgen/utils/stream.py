@@ -0,0 +1,31 @@
+from typing import Optional
+
+import chainlit as cl
+
+
+class ChainlitTokenStream:
+    """
+    Forwards the tokens of a streamed LLM completion to a Chainlit message.
+
+    Await the instance with each token. Call `send` to keep the streamed message,
+    or `remove` if the complete reply is going to be displayed in another way.
+    """
+
+    def __init__(self, author: str, language: Optional[str] = None):
+        self.message = cl.Message(content="", author=author, language=language)
+        self.has_tokens = False
+
+    async def __call__(self, token: str):
+        self.has_tokens = True
+        await self.message.stream_token(token)
+
+    async def send(self):
+        if self.has_tokens:
+            await self.message.send()
+
+    async def remove(self):
+        "Remove the streamed message, after which the stream can be used for a new message."
+        if self.has_tokens:
+            await self.message.remove()
+            self.message = cl.Message(content="", author=self.message.author, language=self.message.language)
+            self.has_tokens = False
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+from typing import Dict, Optional
+
+from appgen.utils import logger
+from appgen.utils.serialization import to_jsonable, from_jsonable
+
+
+class TaskStore:
+    """
+    Persists the fingerprint and the outputs of each task of a project, so that a task
+    whose inputs did not change can be skipped and its outputs reloaded.
+
+    Each task is saved as a JSON file under `<project_directory>/.appgen/tasks`. The outputs
+    can be edited by hand (e.g. to fix a line of the requirements document): the tasks that
+    depend on them are then re-executed by the next run.
+
+    Args:
+        project_directory (Path): The directory of the project.
+    """
+
+    def __init__(self, project_directory: Path):
+        self.directory = Path(project_directory) / ".appgen" / "tasks"
+
+    def _path(self, task_name: str) -> Path:
+        return self.directory / f"{task_name}.json"
+
+    def load(self, task_name: str) -> Optional[Dict]:
+        "Return the record of the task with its fingerprint and its outputs, or None if there is none."
+        path = self._path(task_name)
+        if not path.exists():
+            return None
+        try:
+            record = json.loads(path.read_text(encoding="utf-8"))
+            record["outputs"] = from_jsonable(record["outputs"])
+            return record
+        except (ValueError, KeyError, AttributeError) as error:
+            logger.warning(f"Ignoring the invalid record of the task '{task_name}': {error}")
+            return None
+
+    def save(self, task_name: str, fingerprint: str, outputs: Dict):
+        "Save the fingerprint and the outputs of the task."
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Keep the store out of the repository of the project when it is pushed to GitHub.
+        gitignore = self.directory.parent / ".gitignore"
+        if not gitignore.exists():
+            gitignore.write_text("*\n")
+        record = {"fingerprint": fingerprint, "outputs": to_jsonable(outputs)}
+        self._path(task_name).write_text(json.dumps(record, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    def invalidate(self, task_name: str):
+        "Remove the record of the task, so that it is re-executed by the next run."
+        self._path(task_name).unlink(missing_ok=True)
@@ -0,0 +1,199 @@
+"""
+Structured spans of a run: task -> role -> action -> LLM call.
+
+Each RunContext has a Tracer whose spans record their duration and attributes (e.g. the
+model, the prompt and completion tokens, the cost and whether the completion came from the
+LLM cache). The current span is kept in a context variable, so that the spans created in
+worker threads (with a copied context) and asyncio tasks get the right parent.
+
+The spans can be exported as JSON lines, or as OTLP/JSON traces that OpenTelemetry tools
+can import, and summarized per task and role at the end of the run.
+"""
+import contextvars
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_current_span = contextvars.ContextVar("appgen_current_span", default=None)
+
+# The OTLP span kinds: SPAN_KIND_INTERNAL and SPAN_KIND_CLIENT.
+OTLP_SPAN_KINDS = {"llm": 3}
+
+
+def current_span() -> Optional["Span"]:
+    "Return the innermost span of the current thread or asyncio task, if any."
+    return _current_span.get()
+
+
+class Span:
+    """
+    A timed operation of a run.
+
+    Args:
+        name (str): The name of the operation, e.g. the name of the task or the action.
+        kind (str): The kind of operation: "task", "role", "action" or "llm".
+        trace_id (str): The id of the run.
+        parent (Span, optional): The span this operation is part of.
+        **attributes: The attributes of the operation.
+    """
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent: Optional["Span"] = None, **attributes):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    @property
+    def duration(self) -> float:
+        "The duration of the span in seconds."
+        return ((self.end_time or time.time_ns()) - self.start_time) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def get_ancestor(self, kind: str) -> Optional["Span"]:
+        "Return the closest span of the given kind, starting with this span."
+        span = self
+        while span is not None and span.kind != kind:
+            span = span.parent
+        return span
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent.span_id if self.parent is not None else None,
+            name=self.name,
+            kind=self.kind,
+            status=self.status,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            duration=self.duration,
+            attributes=self.attributes,
+        )
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": OTLP_SPAN_KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time or time.time_ns()),
+            "attributes": [_otlp_attribute("appgen.kind", self.kind)] + [
+                _otlp_attribute(f"appgen.{key}", value) for key, value in self.attributes.items()
+            ],
+            # STATUS_CODE_OK and STATUS_CODE_ERROR
+            "status": {"code": 1 if self.status == "ok" else 2},
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Tracer:
+    """
+    Creates and collects the spans of a run.
+
+    Args:
+        trace_id (str): The id of the run, a 32 character hex string.
+    """
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, kind: str, **attributes):
+        "Time the operation of the `with` block as a child of the current span."
+        parent = _current_span.get()
+        if parent is not None and parent.trace_id != self.trace_id:
+            parent = None
+        span = Span(name, kind, self.trace_id, parent=parent, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.status = "error"
+            span.set(error=repr(error))
+            raise
+        finally:
+            span.end_time = time.time_ns()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def export_jsonl(self, path: Path):
+        "Write the finished spans as JSON lines."
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf8") as file:
+            for span in self.spans:
+                file.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def export_otlp(self, path: Path, service_name: str = "appgenpro"):
+        "Write the finished spans as an OTLP/JSON trace export request."
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        trace = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": "appgen"},
+                "spans": [span.to_otlp() for span in self.spans],
+            }],
+        }]}
+        Path(path).write_text(json.dumps(trace), encoding="utf8")
+
+    def summary(self) -> List[Dict[str, Any]]:
+        "Return the duration of each task and the LLM usage of each task and role."
+        rows = defaultdict(lambda: dict(duration=0.0, calls=0, cache_hits=0, llm_time=0.0, prompt_tokens=0, completion_tokens=0, cost=0.0))
+        for span in self.spans:
+            task = span.get_ancestor("task")
+            task_name = task.name if task is not None else "-"
+            if span.kind == "task":
+                rows[(task_name, "-")]["duration"] += span.duration
+            if span.kind != "llm":
+                continue
+            role = span.get_ancestor("role")
+            # The row of the task and the row of the role, which is the same row without a role.
+            for key in dict.fromkeys([(task_name, "-"), (task_name, role.name if role is not None else "-")]):
+                row = rows[key]
+                row["calls"] += 1
+                row["cache_hits"] += int(span.attributes.get("cache_hit", False))
+                row["llm_time"] += span.duration
+                row["prompt_tokens"] += span.attributes.get("prompt_tokens", 0)
+                row["completion_tokens"] += span.attributes.get("completion_tokens", 0)
+                row["cost"] += span.attributes.get("cost", 0.0)
+        return [dict(task=task, role=role, **row) for (task, role), row in rows.items()]
+
+    def format_summary(self) -> str:
+        "Format the summary as a plain text table, one row per task followed by its roles."
+        columns = ["duration", "calls", "cache_hits", "llm_time", "prompt_tokens", "completion_tokens", "cost"]
+        header = f"{'task':<24}{'role':<24}" + "".join(f"{column:>18}" for column in columns)
+        lines = [header, "-" * len(header)]
+        for row in self.summary():
+            cells = "".join(
+                f"{row[column]:>18.2f}" if isinstance(row[column], float) else f"{row[column]:>18}"
+                for column in columns
+            )
+            lines.append(f"{row['task']:<24}{row['role']:<24}{cells}")
+        return "\n".join(lines)
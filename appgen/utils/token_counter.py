@@ -0,0 +1,48 @@
+from functools import lru_cache
+from typing import Dict, List
+
+import tiktoken
+
+# Replaces the middle of a text truncated by `truncate_tokens`.
+TRUNCATION_MARKER = "\n...[truncated]...\n"
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    "Return the number of tokens of the text for the given model."
+    if not text:
+        return 0
+    return len(_get_encoding(model).encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[Dict], model: str = "gpt-4") -> int:
+    """
+    Return the number of prompt tokens of the chat messages for the given model.
+    Source: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    """
+    n_tokens = 0
+    for message in messages:
+        n_tokens += 3
+        for key, value in message.items():
+            if isinstance(value, str):
+                n_tokens += count_tokens(value, model)
+            if key == "name":
+                n_tokens += 1
+    return n_tokens + 3
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4") -> str:
+    "Truncate the middle of the text so that it fits in max_tokens, keeping its start and end."
+    encoding = _get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    half = max(max_tokens // 2, 1)
+    return encoding.decode(tokens[:half]) + TRUNCATION_MARKER + encoding.decode(tokens[-half:])
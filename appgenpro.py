@@ -26,18 +26,19 @@ async def start():
         task_chain = TaskChain(
             config_path=f"{EXAMPLES_ROOT}/biapp/bi_app.json", ## TODO: hardcoded for now. it will be made configurable in the future.
             idea=TASK,
-            project_name="bi_report_project", ## TODO: hardcoded for now. it will be made configurable in the future.
+            # Each session has its own project directory, task store and checkpoint.
+            project_name=f"bi_report_project_{cl.user_session.get('id')[:8]}",
             root_dir=Path(WORKSPACE_ROOT),
             use_chainlit=True,
             github_token=CONFIG.github_token
         )
-        task_chain.setup_environment()
+        await task_chain.a_setup_environment()
         await task_chain.a_execute()
     except: 
         TASK_STATUS = cl.TaskStatus.FAILED.name
         cl.run_sync(
             cl.Message(
-                content=f"**There as an unexpected error! Please check the logs for more info.**\n**Total estimated cost: ${CONFIG.total_cost:.2f}**"
+                content=f"**There as an unexpected error! Please check the logs for more info.**\n**Total estimated cost: ${task_chain.run_context.total_cost:.2f}**"
             ).send()
         )
         task_chain.post_processing(task_status=TASK_STATUS)
@@ -49,11 +50,11 @@ async def start():
         TASK_STATUS = cl.TaskStatus.DONE.name
         cl.run_sync(
             cl.Message(
-                content=f"**The {task_chain.project_name} project is completed. Total estimated cost: ${CONFIG.total_cost:.2f}**\n**I will now save all artifacts and do some post-processing. Please don't close the window just yet!.**"
+                content=f"**The {task_chain.project_name} project is completed. Total estimated cost: ${task_chain.run_context.total_cost:.2f}**\n**I will now save all artifacts and do some post-processing. Please don't close the window just yet!.**"
             ).send()
         )
         task_chain.post_processing(task_status=TASK_STATUS)
-        msg = f"Process completed sucessfully! All artifacts have been saved. Final estimated cost: ${CONFIG.total_cost:.2f}"
+        msg = f"Process completed sucessfully! All artifacts have been saved. Final estimated cost: ${task_chain.run_context.total_cost:.2f}"
         logger.debug(msg)
         logger.info(msg)
     
@@ -75,7 +76,11 @@ def main():
             project_name=args.project_name,
             root_dir=args.root_dir,
             use_chainlit=False,
-            github_token=args.github_token
+            github_token=args.github_token,
+            reuse_outputs=not args.rerun_all,
+            resume=args.resume,
+            data_sources=args.data_sources,
+            fork_from=args.fork_from
         )
         task_chain.setup_environment()
         task_chain.execute()
@@ -84,9 +89,9 @@ def main():
         task_chain.post_processing(task_status=cl.TaskStatus.FAILED.name)
         logger.debug(err_msg)
         logger.error(err_msg)
-    finally:
+    else:
         task_chain.post_processing(task_status=cl.TaskStatus.DONE.name)
-        msg = f"Process completed sucessfully! All artifacts have been saved. Final estimated cost: ${CONFIG.total_cost:.2f}"
+        msg = f"Process completed sucessfully! All artifacts have been saved. Final estimated cost: ${task_chain.run_context.total_cost:.2f}"
         logger.debug(msg)
         logger.info(msg)
 
@@ -97,6 +102,10 @@ if __name__ == "__main__":
     parser.add_argument("--project_name", type=str, help="The name of the project", default="bi_report")
     parser.add_argument("--root_dir", type=Path, help="The root directory", default=Path(WORKSPACE_ROOT))
     parser.add_argument("--github_token", type=str, help="The github token", default=CONFIG.github_token)
+    parser.add_argument("--resume", action="store_true", help="Resume the project from the last completed task of its checkpoint")
+    parser.add_argument("--rerun_all", action="store_true", help="Re-execute all the tasks, even those whose inputs did not change")
+    parser.add_argument("--data_sources", type=Path, nargs="*", help="The CSV, Parquet or Excel files the app is built on", default=[])
+    parser.add_argument("--fork_from", type=str, help="Edit the outputs of a past project instead of starting from scratch: 'auto' for the past run with the most similar request, or the name of the project", default=None)
     args = parser.parse_args()
 
     main()
\ No newline at end of file
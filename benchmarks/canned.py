@@ -0,0 +1,89 @@
+"""
+Canned LLM completions for the requests made by the roles and actions of AppGenPro.
+
+The replies follow the formats the framework expects, so that a TaskChain runs end to end
+without an LLM:
+- the state decisions of `Role._think`, as a `choose_state` tool call or a `STATE:`/`RESPONSE:` reply,
+- the documents of `WriteDocument`, by returning the format example of the prompt,
+- the code of `WriteCode`, as a code block with a `# filename:` header,
+- any other reply (e.g. the automatic replies of the user agents) terminates the chat.
+"""
+import json
+import re
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from openai.types.chat import ChatCompletion
+
+from appgen.utils.token_counter import count_message_tokens, count_tokens
+
+FORMAT_EXAMPLE_PATTERN = re.compile(r"# Format example:\n(.*?)\n-----", re.DOTALL)
+FILENAME_PATTERN = re.compile(r"You are ONLY writing the file `([^`]+)`")
+HISTORY_PATTERN = re.compile(r"Conversation records:\n===\n(.*)\n===\n", re.DOTALL)
+
+TERMINATE_REPLY = "Everything looks good. TERMINATE"
+
+
+def make_completion(
+        messages: List[Dict],
+        content: Optional[str] = None,
+        tool_calls: Optional[List[Dict]] = None,
+        model: str = "gpt-4"
+    ) -> ChatCompletion:
+    "Build a ChatCompletion with the given content or tool calls, and its token usage."
+    completion_text = content or "".join(call["function"]["arguments"] for call in tool_calls or [])
+    prompt_tokens = count_message_tokens(messages, model)
+    completion_tokens = count_tokens(completion_text, model)
+    return ChatCompletion.model_validate({
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+            "message": {"role": "assistant", "content": content, "tool_calls": tool_calls},
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    })
+
+
+def canned_reply(messages: List[Dict], tools: Optional[List[Dict]] = None) -> Dict:
+    "Return the content or the tool calls of the canned reply to the request."
+    last_content = messages[-1].get("content") or "" if messages else ""
+
+    history = HISTORY_PATTERN.search(last_content)
+    if history is not None:
+        # A state decision: perform the first action, unless the sender asked to terminate.
+        state = -1 if history.group(1).rstrip().endswith("TERMINATE") else 0
+        response = "" if state == -1 else "I will take care of this request now."
+        if tools:
+            arguments = json.dumps({"state": state, "response": response})
+            return {"tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": arguments},
+            }]}
+        return {"content": f"STATE: {state}\nRESPONSE: {response}"}
+
+    if (format_example := FORMAT_EXAMPLE_PATTERN.search(last_content)) is not None:
+        return {"content": format_example.group(1)}
+
+    if (filename := FILENAME_PATTERN.search(last_content)) is not None:
+        return {"content": f"```python\n# filename: {filename.group(1)}\nprint('{filename.group(1)}')\n```"}
+
+    has_code = any("```" in (message.get("content") or "") for message in messages)
+    if "code" in last_content.lower() and not has_code:
+        return {"content": "```python\n# filename: main.py\nprint('main')\n```"}
+
+    return {"content": TERMINATE_REPLY}
+
+
+def canned_completion(messages: List[Dict], model: str = "gpt-4", tools: Optional[List[Dict]] = None, **kwargs) -> ChatCompletion:
+    "Return the canned ChatCompletion of the request."
+    return make_completion(messages, model=model, **canned_reply(messages, tools))
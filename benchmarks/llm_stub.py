@@ -0,0 +1,154 @@
+"""
+Replaces the LLM calls of AppGenPro with recorded or canned completions.
+
+`LLMStub.patch()` patches autogen's `OpenAIWrapper.create` (used by the agents and the sync
+execution path) and `AsyncOpenAIWrapper.create` (used by the async execution path), so that
+no request reaches the network. The stub measures the time spent in the LLM calls and their
+token usage, so that the framework overhead can be told apart from the LLM latency.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+from unittest import mock
+
+from autogen import OpenAIWrapper
+from openai.types.chat import ChatCompletion
+
+from appgen.utils import logger
+from appgen.utils.llm import AsyncOpenAIWrapper
+from appgen.utils.llm_cache import LLMCache
+from benchmarks.canned import canned_completion
+
+# The parameters of a request that do not change its completion.
+IGNORED_PARAMS = {"context", "cache_seed", "stream", "timeout", "on_token", "filter_func", "allow_format_str_template"}
+
+
+def make_request_key(messages: List[Dict], **params) -> str:
+    "Return the key of a request in a fixture: a hash of its messages and parameters."
+    messages = [{k: v for k, v in message.items() if k != "context"} for message in messages]
+    params = {k: v for k, v in params.items() if k not in IGNORED_PARAMS and k != "config_list"}
+    return LLMCache.make_key(messages=messages, **params)
+
+
+class LLMStub:
+    """
+    Answers the LLM requests from a fixture of recorded completions, or with canned completions.
+
+    A fixture is a JSONL file with one `{"key": ..., "response": ...}` object per request.
+    A request is answered by the first unused completion recorded for its key. If there is
+    none (e.g. a prompt changed since the recording), the next unused completion of the
+    fixture is replayed in order, or a canned completion when the fixture is exhausted.
+
+    Args:
+        fixture (Path, optional): The fixture to replay. Defaults to None (canned completions only).
+        record (Path, optional): Forward the requests to the real LLM and record them to this fixture.
+        latency (float): The simulated latency of each request in seconds.
+    """
+
+    def __init__(self, fixture: Optional[Path] = None, record: Optional[Path] = None, latency: float = 0.0):
+        self.latency = latency
+        self.record_path = Path(record) if record else None
+        self._by_key = defaultdict(deque)
+        self._in_order = deque()
+        self._used = set()
+        if fixture is not None:
+            with open(fixture, "r", encoding="utf8") as file:
+                for idx, line in enumerate(file):
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._by_key[entry["key"]].append(idx)
+                        self._in_order.append((idx, ChatCompletion.model_validate(entry["response"])))
+        self._responses = dict(self._in_order)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = dict(calls=0, llm_time=0.0, prompt_tokens=0, completion_tokens=0, fixture_hits=0, fixture_misses=0)
+
+    def _replay(self, key: str, messages: List[Dict], params: Dict) -> ChatCompletion:
+        with self._lock:
+            while self._by_key[key]:
+                idx = self._by_key[key].popleft()
+                if idx not in self._used:
+                    self._used.add(idx)
+                    self.stats["fixture_hits"] += 1
+                    return self._responses[idx]
+            self.stats["fixture_misses"] += 1
+            while self._in_order:
+                idx, response = self._in_order.popleft()
+                if idx not in self._used:
+                    self._used.add(idx)
+                    return response
+        return canned_completion(messages, **params)
+
+    def _record(self, key: str, response: ChatCompletion):
+        with self._lock, open(self.record_path, "a", encoding="utf8") as file:
+            file.write(json.dumps({"key": key, "response": response.model_dump(mode="json")}) + "\n")
+
+    def _account(self, response: ChatCompletion, elapsed: float):
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["llm_time"] += elapsed
+            if response.usage is not None:
+                self.stats["prompt_tokens"] += response.usage.prompt_tokens
+                self.stats["completion_tokens"] += response.usage.completion_tokens
+
+    @staticmethod
+    def _get_params(client, kwargs: Dict) -> Dict:
+        "Return the parameters of the request, including those of the first config of the client."
+        config = dict(getattr(client, "_config_list", [{}])[0])
+        config.pop("api_key", None)
+        return {**config, **kwargs}
+
+    def create(self, client, original, **kwargs) -> ChatCompletion:
+        "The stub of `OpenAIWrapper.create`."
+        start = time.perf_counter()
+        messages = kwargs.get("messages", [])
+        params = self._get_params(client, {k: v for k, v in kwargs.items() if k != "messages"})
+        key = make_request_key(messages, **params)
+        if self.record_path is not None:
+            response = original(client, **kwargs)
+            self._record(key, response)
+        else:
+            time.sleep(self.latency)
+            response = self._replay(key, messages, {k: v for k, v in params.items() if k not in IGNORED_PARAMS})
+        self._account(response, time.perf_counter() - start)
+        return response
+
+    async def a_create(self, client, original, messages: List[Dict], on_token=None, **kwargs) -> ChatCompletion:
+        "The stub of `AsyncOpenAIWrapper.create`."
+        start = time.perf_counter()
+        params = self._get_params(client, kwargs)
+        key = make_request_key(messages, **params)
+        if self.record_path is not None:
+            response = await original(client, messages=messages, on_token=on_token, **kwargs)
+            self._record(key, response)
+        else:
+            await asyncio.sleep(self.latency)
+            response = self._replay(key, messages, {k: v for k, v in params.items() if k not in IGNORED_PARAMS})
+            if on_token is not None and response.choices[0].message.content:
+                await on_token(response.choices[0].message.content)
+        self._account(response, time.perf_counter() - start)
+        return response
+
+    @contextmanager
+    def patch(self):
+        "Patch the LLM clients of autogen and AppGenPro with the stub."
+        original_create = OpenAIWrapper.create
+        original_a_create = AsyncOpenAIWrapper.create
+        stub = self
+
+        def create(client, **kwargs):
+            return stub.create(client, original_create, **kwargs)
+
+        async def a_create(client, messages, on_token=None, **kwargs):
+            return await stub.a_create(client, original_a_create, messages, on_token=on_token, **kwargs)
+
+        with mock.patch.object(OpenAIWrapper, "create", create), mock.patch.object(AsyncOpenAIWrapper, "create", a_create):
+            logger.info("The LLM calls are answered by the stub.")
+            yield self
@@ -0,0 +1,157 @@
+"""
+Load test the async execution path of AppGenPro against the mock LLM server.
+
+The driver runs N sessions through `TaskChain.a_execute` on one event loop, as the Chainlit
+app does for concurrent chats, and reports the throughput and the latency percentiles of the
+sessions. The agents reply automatically and the LLM cache is disabled. Unless a server URL
+is given, a mock LLM server is started in a subprocess with the given latency and token rate.
+
+    python -m benchmarks.load_test --sessions 20 --concurrency 10 --latency 0.5 --tokens_per_second 50
+"""
+import argparse
+import asyncio
+import json
+import math
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+from appgen import TaskChain
+from appgen.config import CONFIG
+from appgen.utils import logger
+from appgen.utils.const import EXAMPLES_ROOT
+
+DEFAULT_IDEA = "A sales dashboard showing the monthly revenue per region and the top 10 products."
+
+
+def use_llm_server(url: str, model: str):
+    "Send the LLM calls of the app to the server at the url, without any cache nor knowledge base."
+    config_list = [{"model": model, "api_key": "mock", "base_url": url}]
+    CONFIG.config_list = config_list
+    CONFIG.llm_config["config_list"] = config_list
+    CONFIG.llm_config["cache_seed"] = None
+    CONFIG.llm_cache_enabled = False
+    CONFIG.knowledge_base_enabled = False
+
+
+def start_llm_server(port: int, latency: float, tokens_per_second: float) -> subprocess.Popen:
+    "Start the mock LLM server in a subprocess and wait until it answers."
+    server = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_llm_server",
+        "--port", str(port), "--latency", str(latency), "--tokens_per_second", str(tokens_per_second)
+    ])
+    for _ in range(100):
+        try:
+            get_server_stats(f"http://127.0.0.1:{port}/v1")
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"The mock LLM server did not start on port {port}.")
+
+
+def get_server_stats(url: str) -> Dict:
+    with urllib.request.urlopen(url.removesuffix("/v1") + "/stats", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def percentile(values: List[float], q: float) -> float:
+    "Return the q-th percentile (0-100) of the values, with the nearest-rank method."
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+async def run_session(idx: int, config_path: Path, idea: str, root_dir: Path) -> Dict:
+    "Run a TaskChain session on the event loop and return its duration and status."
+    start = time.perf_counter()
+    result = dict(session=idx, status="failed", error=None)
+    try:
+        task_chain = TaskChain(
+            config_path=config_path,
+            idea=idea,
+            project_name=f"session_{idx}",
+            root_dir=root_dir,
+            use_chainlit=False,
+            use_async=True,
+            reuse_outputs=False,
+            auto_reply=True
+        )
+        task_chain.setup_environment()
+        await task_chain.a_execute()
+        result.update(status="done", total_cost=task_chain.run_context.total_cost)
+    except Exception:
+        result["error"] = traceback.format_exc()
+        logger.error(f"Session {idx} failed: {result['error']}")
+    result["duration"] = time.perf_counter() - start
+    return result
+
+
+async def run_load(n_sessions: int, concurrency: int, config_path: Path, idea: str, root_dir: Path) -> Dict:
+    "Run the sessions with at most `concurrency` of them at the same time and summarize them."
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(idx):
+        async with semaphore:
+            return await run_session(idx, config_path, idea, root_dir)
+
+    start = time.perf_counter()
+    sessions = await asyncio.gather(*[run(idx) for idx in range(n_sessions)])
+    wall_time = time.perf_counter() - start
+    durations = [session["duration"] for session in sessions if session["status"] == "done"]
+    return dict(
+        sessions=n_sessions,
+        concurrency=concurrency,
+        done=len(durations),
+        failed=n_sessions - len(durations),
+        wall_time=wall_time,
+        sessions_per_minute=60 * len(durations) / wall_time if wall_time else 0.0,
+        latency_p50=percentile(durations, 50),
+        latency_p95=percentile(durations, 95),
+        latency_p99=percentile(durations, 99),
+        latency_max=max(durations, default=0.0),
+        errors=[session["error"] for session in sessions if session["error"]][:5],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the async TaskChain against a mock LLM server.")
+    parser.add_argument("--sessions", type=int, help="The number of sessions to run", default=10)
+    parser.add_argument("--concurrency", type=int, help="The maximum number of simultaneous sessions", default=10)
+    parser.add_argument("--config", type=Path, help="Path to the config file", default=EXAMPLES_ROOT / "biapp" / "bi_app.json")
+    parser.add_argument("--idea", type=str, help="The app idea", default=DEFAULT_IDEA)
+    parser.add_argument("--server_url", type=str, help="The URL of a running LLM server, e.g. http://127.0.0.1:8001/v1", default=None)
+    parser.add_argument("--port", type=int, help="The port of the mock LLM server to start", default=8001)
+    parser.add_argument("--latency", type=float, help="The time to the first token of the mock LLM in seconds", default=0.5)
+    parser.add_argument("--tokens_per_second", type=float, help="The completion token rate of the mock LLM", default=50.0)
+    parser.add_argument("--model", type=str, help="The model name sent to the server", default="gpt-4-1106-preview")
+    parser.add_argument("--output", type=Path, help="Write the report to this JSON file", default=None)
+    args = parser.parse_args()
+
+    server = None
+    url = args.server_url
+    if url is None:
+        server = start_llm_server(args.port, args.latency, args.tokens_per_second)
+        url = f"http://127.0.0.1:{args.port}/v1"
+    use_llm_server(url, args.model)
+    try:
+        with tempfile.TemporaryDirectory() as root_dir:
+            report = asyncio.run(run_load(args.sessions, args.concurrency, args.config, args.idea, Path(root_dir)))
+        report["server"] = get_server_stats(url)
+    finally:
+        if server is not None:
+            server.terminate()
+
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf8")
+
+
+if __name__ == "__main__":
+    main()
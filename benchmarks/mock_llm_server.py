@@ -0,0 +1,136 @@
+"""
+A local stand-in for the OpenAI chat completions API, to load test AppGenPro offline.
+
+The server answers `POST /v1/chat/completions` with the canned completions of
+`benchmarks.canned` (state decisions, documents and code), streamed or not, after a
+configurable latency and at a configurable token rate. `GET /stats` returns the number of
+requests and tokens served so far.
+
+    python -m benchmarks.mock_llm_server --port 8001 --latency 0.5 --tokens_per_second 50
+
+Point the OAI_CONFIG_LIST of `config.yaml` to it to use it from the app:
+    OAI_CONFIG_LIST:
+      - model: 'gpt-4-1106-preview'
+        api_key: 'mock'
+        base_url: 'http://localhost:8001/v1'
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tiktoken
+
+from benchmarks.canned import canned_reply, make_completion
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    The HTTP server of the mock LLM.
+
+    Args:
+        address (tuple): The host and port to listen on.
+        latency (float): The time to the first token of each completion, in seconds.
+        tokens_per_second (float): The rate at which the completion tokens are generated.
+            0 means instantly.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, tokens_per_second: float = 0.0):
+        super().__init__(address, MockLLMHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.stats = dict(requests=0, streamed_requests=0, prompt_tokens=0, completion_tokens=0)
+        self._lock = threading.Lock()
+
+    def account(self, completion, stream: bool):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["streamed_requests"] += int(stream)
+            self.stats["prompt_tokens"] += completion.usage.prompt_tokens
+            self.stats["completion_tokens"] += completion.usage.completion_tokens
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/stats":
+            self.send_error(404)
+            return
+        self._send_json(self.server.stats)
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        messages, model = request.get("messages", []), request.get("model", "gpt-4")
+        reply = canned_reply(messages, request.get("tools"))
+        completion = make_completion(messages, model=model, **reply)
+        stream = bool(request.get("stream")) and reply.get("content") is not None
+        self.server.account(completion, stream)
+
+        time.sleep(self.server.latency)
+        if stream:
+            self._stream(completion)
+            return
+        if self.server.tokens_per_second:
+            time.sleep(completion.usage.completion_tokens / self.server.tokens_per_second)
+        self._send_json(completion.model_dump(mode="json", exclude_none=True))
+
+    def _stream(self, completion):
+        "Send the content of the completion token by token as server-sent events."
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        encoding = tiktoken.get_encoding("cl100k_base")
+        content = completion.choices[0].message.content
+        chunk = dict(id=completion.id, object="chat.completion.chunk", created=completion.created, model=completion.model)
+        for idx, token in enumerate(encoding.encode(content, disallowed_special=())):
+            delta = {"role": "assistant", "content": encoding.decode([token])} if idx == 0 else {"content": encoding.decode([token])}
+            self._send_event(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            if self.server.tokens_per_second:
+                time.sleep(1 / self.server.tokens_per_second)
+        self._send_event(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_event(self, data: dict):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve canned completions with the OpenAI chat completions API.")
+    parser.add_argument("--host", type=str, help="The host to listen on", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="The port to listen on", default=8001)
+    parser.add_argument("--latency", type=float, help="The time to the first token in seconds", default=0.0)
+    parser.add_argument("--tokens_per_second", type=float, help="The completion token rate (0 means instantly)", default=0.0)
+    args = parser.parse_args()
+
+    server = MockLLMServer((args.host, args.port), latency=args.latency, tokens_per_second=args.tokens_per_second)
+    print(f"Mock LLM server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark the orchestration overhead of a TaskChain, without network access.
+
+The LLM calls are answered by recorded completions (a fixture) or by canned completions,
+see `LLMStub`. For each task, the benchmark reports the wall time, the time spent in the
+LLM calls, the framework overhead (the difference of both), the number of calls, the token
+counts and the peak of the memory allocated by Python.
+
+    # Replay canned completions
+    python -m benchmarks.run_benchmark --config examples/biapp/bi_app.json
+
+    # Record a fixture with the real LLM (requires OAI_CONFIG_LIST), then replay it
+    python -m benchmarks.run_benchmark --record benchmarks/fixtures/bi_app.jsonl
+    python -m benchmarks.run_benchmark --fixture benchmarks/fixtures/bi_app.jsonl --output report.json
+"""
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict
+from unittest import mock
+
+from appgen import TaskChain
+from appgen.config import CONFIG
+from appgen.tasks import Task
+from appgen.utils.const import EXAMPLES_ROOT
+from benchmarks.llm_stub import LLMStub
+
+DEFAULT_IDEA = "A sales dashboard showing the monthly revenue per region and the top 10 products."
+COLUMNS = ["wall_time", "llm_time", "overhead", "calls", "prompt_tokens", "completion_tokens", "peak_memory_mb"]
+
+
+class StageMeter:
+    "Measures the wall time, the LLM usage and the memory peak of the stages of a run."
+
+    def __init__(self, stub: LLMStub):
+        self.stub = stub
+        self.rows = []
+
+    def measure(self, name: str, func, *args, **kwargs):
+        before = dict(self.stub.stats)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            wall_time = time.perf_counter() - start
+            llm_time = self.stub.stats["llm_time"] - before["llm_time"]
+            self.rows.append(dict(
+                stage=name,
+                wall_time=wall_time,
+                llm_time=llm_time,
+                overhead=wall_time - llm_time,
+                calls=self.stub.stats["calls"] - before["calls"],
+                prompt_tokens=self.stub.stats["prompt_tokens"] - before["prompt_tokens"],
+                completion_tokens=self.stub.stats["completion_tokens"] - before["completion_tokens"],
+                peak_memory_mb=tracemalloc.get_traced_memory()[1] / 2**20,
+            ))
+
+    def total(self) -> Dict:
+        total = {column: sum(row[column] for row in self.rows) for column in COLUMNS}
+        total["peak_memory_mb"] = max((row["peak_memory_mb"] for row in self.rows), default=0)
+        return dict(stage="total", **total)
+
+
+def run_benchmark(config_path: Path, idea: str, stub: LLMStub, root_dir: Path) -> Dict:
+    """
+    Run the TaskChain of the config with the LLM stub and return the measures of each stage:
+    the setup, each task and the post-processing.
+    """
+    # The LLM cache would hide the calls from the stub.
+    CONFIG.llm_cache_enabled = False
+    # The past artifacts of the knowledge base would change the prompts, and the canned run must not be added to it.
+    CONFIG.knowledge_base_enabled = False
+    meter = StageMeter(stub)
+    original_execute = Task.execute
+
+    def execute(task, environment):
+        return meter.measure(task.name, original_execute, task, environment)
+
+    tracemalloc.start()
+    try:
+        with stub.patch(), mock.patch.object(Task, "execute", execute):
+            task_chain = TaskChain(
+                config_path=config_path,
+                idea=idea,
+                project_name="benchmark",
+                root_dir=root_dir,
+                use_chainlit=False,
+                reuse_outputs=False,
+                auto_reply=True
+            )
+            meter.measure("setup", task_chain.setup_environment)
+            task_chain.execute()
+            meter.measure("post_processing", task_chain.post_processing)
+    finally:
+        tracemalloc.stop()
+    return dict(
+        stages=meter.rows,
+        total=meter.total(),
+        fixture_hits=stub.stats["fixture_hits"],
+        fixture_misses=stub.stats["fixture_misses"],
+    )
+
+
+def format_report(report: Dict) -> str:
+    "Format the report as a plain text table."
+    header = f"{'stage':<24}" + "".join(f"{column:>18}" for column in COLUMNS)
+    lines = [header, "-" * len(header)]
+    for row in report["stages"] + [report["total"]]:
+        cells = "".join(
+            f"{row[column]:>18.3f}" if isinstance(row[column], float) else f"{row[column]:>18}"
+            for column in COLUMNS
+        )
+        lines.append(f"{row['stage']:<24}{cells}")
+    lines.append(f"fixture hits: {report['fixture_hits']}, fixture misses: {report['fixture_misses']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a TaskChain with recorded or canned LLM completions.")
+    parser.add_argument("--config", type=Path, help="Path to the config file", default=EXAMPLES_ROOT / "biapp" / "bi_app.json")
+    parser.add_argument("--idea", type=str, help="The app idea", default=DEFAULT_IDEA)
+    parser.add_argument("--fixture", type=Path, help="The fixture of recorded completions to replay", default=None)
+    parser.add_argument("--record", type=Path, help="Call the real LLM and record the completions to this fixture", default=None)
+    parser.add_argument("--latency", type=float, help="The simulated latency of each LLM call in seconds", default=0.0)
+    parser.add_argument("--root_dir", type=Path, help="The directory of the project (a temporary one by default)", default=None)
+    parser.add_argument("--output", type=Path, help="Write the report to this JSON file", default=None)
+    args = parser.parse_args()
+
+    stub = LLMStub(fixture=args.fixture, record=args.record, latency=args.latency)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmark(args.config, args.idea, stub, args.root_dir or Path(tmp_dir))
+
+    print(format_report(report))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import pytest
+
+from appgen.utils.budget import BudgetExceededError, BudgetTracker
+from appgen.utils.telemetry import Tracer
+
+# $0.01 per 1K prompt tokens and $0.03 per 1K completion tokens.
+PRICE = (0.01, 0.03)
+
+
+def test_a_run_without_limits_admits_any_call():
+    budget = BudgetTracker()
+    assert not budget.has_limits
+    assert budget.admit(100_000, 4000, PRICE, min_output_tokens=256) == 4000
+
+
+def test_the_completion_is_capped_to_the_remaining_tokens():
+    budget = BudgetTracker(max_tokens=10_000)
+    budget.charge(0.0, 5000)
+    assert budget.admit(4000, 2000, PRICE, min_output_tokens=256) == 1000
+
+
+def test_the_completion_is_capped_to_the_remaining_cost():
+    budget = BudgetTracker(max_cost=1.0)
+    budget.charge(0.4, 0)
+    # $0.60 left, $0.10 of which pay for the prompt: $0.50 pay for 16666 completion tokens.
+    assert budget.admit(10_000, 20_000, PRICE) == 16_666
+    assert budget.admit(10_000, 1000, PRICE) == 1000
+
+
+def test_a_call_that_cannot_afford_the_minimum_completion_is_refused():
+    budget = BudgetTracker(max_tokens=10_000)
+    budget.charge(0.0, 9000)
+    with pytest.raises(BudgetExceededError, match="the run 'run'") as error:
+        budget.admit(900, 1000, PRICE, min_output_tokens=256)
+    assert error.value.scope == "run"
+
+
+def test_an_unknown_price_only_limits_the_tokens():
+    budget = BudgetTracker(max_cost=0.01, max_tokens=10_000)
+    assert budget.admit(1000, 2000, None) == 2000
+
+
+def test_the_budgets_of_the_current_task_and_role_apply():
+    tracer = Tracer(trace_id="run")
+    budget = BudgetTracker(max_tokens=100_000)
+    budget.set_task_budget("GatherRequirements", max_tokens=5000)
+    budget.set_role_budget("DataAnalyst", max_tokens=3000)
+
+    assert budget.admit(1000, 4000, PRICE) == 4000
+    with tracer.span("GatherRequirements", kind="task"):
+        assert budget.admit(1000, 8000, PRICE) == 4000
+        with tracer.span("DataAnalyst", kind="role"), tracer.span("chat.completions", kind="llm"):
+            assert budget.admit(1000, 8000, PRICE) == 2000
+            budget.charge(0.0, 2500)
+            with pytest.raises(BudgetExceededError) as error:
+                budget.admit(1000, 8000, PRICE, min_output_tokens=256)
+    assert (error.value.scope, error.value.name) == ("role", "DataAnalyst")
+    assert budget.run.tokens == budget.tasks["GatherRequirements"].tokens == 2500
+
+
+def test_check_raises_once_a_ceiling_is_reached():
+    budget = BudgetTracker(max_cost=1.0, soft_limit=0.5)
+    budget.charge(0.6, 0)
+    assert budget.is_soft_exceeded()
+    budget.check()
+    budget.charge(0.4, 0)
+    with pytest.raises(BudgetExceededError):
+        budget.check()
+
+
+def test_the_usage_is_restored_from_a_checkpoint():
+    tracer = Tracer(trace_id="run")
+    budget = BudgetTracker(max_tokens=10_000)
+    budget.set_role_budget("DataAnalyst", max_tokens=3000)
+    with tracer.span("DataAnalyst", kind="role"):
+        budget.charge(0.5, 2000)
+
+    resumed = BudgetTracker(max_tokens=10_000)
+    resumed.set_role_budget("DataAnalyst", max_tokens=3000)
+    resumed.set_usage(budget.get_usage())
+    assert (resumed.run.cost, resumed.run.tokens) == (0.5, 2000)
+    assert resumed.admit(1000, 8000, PRICE) == 7000
+    with tracer.span("DataAnalyst", kind="role"):
+        assert resumed.admit(500, 8000, PRICE) == 500
@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+from appgen import Environment
+from appgen.actions.document_schema import BacklogSchema
+from appgen.utils.checkpoint import load_checkpoint, save_checkpoint
+from appgen.utils.outputs import OutputDict, OutputList
+
+
+def make_environment(project_directory: Path) -> Environment:
+    return Environment(
+        request_prompt="A dashboard of the sales.",
+        codebase={},
+        requirements=[],
+        design=[],
+        backlog=[],
+        team={},
+        project_directory=project_directory,
+    )
+
+
+def test_the_state_is_saved_and_loaded(tmp_path):
+    path = tmp_path / ".appgen" / "checkpoint.json.gz"
+    backlog = BacklogSchema.model_validate_json(BacklogSchema.get_format_example())
+    save_checkpoint(path, dict(
+        completed=["GatherRequirements"],
+        docs={"backlog": backlog},
+        directory=tmp_path,
+        costs=(0.5, 1.5),
+    ))
+
+    state = load_checkpoint(path)
+    assert state["completed"] == ["GatherRequirements"]
+    assert state["docs"]["backlog"] == backlog
+    assert state["directory"] == str(tmp_path)
+    assert state["costs"] == [0.5, 1.5]
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_a_missing_or_corrupt_checkpoint_is_none(tmp_path):
+    path = tmp_path / "checkpoint.json.gz"
+    assert load_checkpoint(path) is None
+    path.write_text(json.dumps({"completed": []}))
+    assert load_checkpoint(path) is None
+
+
+def test_the_environment_is_restored_from_its_checkpoint(tmp_path):
+    path = tmp_path / "checkpoint.json.gz"
+    environment = make_environment(tmp_path)
+    environment.requirements.append("The dashboard shows the sales per month.")
+    environment.codebase["app.py"] = "print(1)"
+    environment.run_context.artifacts["code"]["app.py"] = "print(1)"
+    environment.run_context.total_cost = 1.25
+    save_checkpoint(path, dict(environment=environment.get_state()))
+
+    restored = make_environment(tmp_path)
+    restored.set_state(load_checkpoint(path)["environment"])
+    assert restored.requirements == ["The dashboard shows the sales per month."]
+    assert restored.design == []
+    assert restored.codebase == {"app.py": "print(1)"}
+    assert restored.run_context.artifacts == {"docs": {}, "code": {"app.py": "print(1)"}}
+    assert restored.run_context.total_cost == 1.25
+    # The restored outputs still tell apart the outputs of the next tasks.
+    assert isinstance(restored.requirements, OutputList)
+    assert isinstance(restored.codebase, OutputDict)
+    assert all(isinstance(artifacts, OutputDict) for artifacts in restored.run_context.artifacts.values())
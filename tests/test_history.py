@@ -0,0 +1,78 @@
+import pytest
+
+from appgen.utils import history
+from appgen.utils.history import HistoryManager
+from appgen.utils.token_counter import count_message_tokens
+
+
+class FakeClient:
+
+    @staticmethod
+    def extract_text_or_function_call(response):
+        return [response]
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    "Replace the summary completions with a fixed summary, and record their prompts."
+    prompts = []
+
+    def create_completion(client, run_context, messages, **kwargs):
+        prompts.append(messages)
+        return "The client wants a dashboard of the sales."
+
+    monkeypatch.setattr(history, "create_completion", create_completion)
+    return prompts
+
+
+def make_messages(n: int, words: int = 200) -> list:
+    return [
+        {"role": "user" if idx % 2 == 0 else "assistant", "content": f"Message {idx}: " + "sales " * words}
+        for idx in range(n)
+    ]
+
+
+def test_a_history_within_the_budget_is_not_compacted(summaries):
+    messages = make_messages(3, words=10)
+    assert HistoryManager(max_tokens=4000).compact(messages, FakeClient(), None) is messages
+    messages = make_messages(50)
+    assert HistoryManager().compact(messages, FakeClient(), None) is messages
+    assert summaries == []
+
+
+def test_the_middle_of_a_history_over_the_budget_is_summarized(summaries):
+    messages = make_messages(12)
+    manager = HistoryManager(max_tokens=1500, keep_last_n=2)
+    compacted = manager.compact(messages, FakeClient(), None)
+
+    assert count_message_tokens(compacted) <= 1500
+    assert compacted[0]["content"].startswith("Message 0")
+    assert "dashboard of the sales" in compacted[1]["content"]
+    assert [message["content"][:10] for message in compacted[-2:]] == ["Message 10", "Message 11"]
+    assert len(summaries) == 1
+
+
+def test_only_the_new_messages_are_summarized_again(summaries):
+    messages = make_messages(12)
+    manager = HistoryManager(max_tokens=1500, keep_last_n=2)
+    manager.compact(messages, FakeClient(), None)
+    manager.compact(messages + make_messages(1), FakeClient(), None)
+
+    assert len(summaries) == 2
+    assert "Message 10" in summaries[1][0]["content"]
+    assert "Message 9:" not in summaries[1][0]["content"]
+
+
+def test_the_longest_messages_are_truncated_to_fit_the_budget(summaries):
+    messages = make_messages(3, words=3000)
+    compacted = HistoryManager(max_tokens=4000, keep_last_n=2)._build(messages, "A summary.", end=1)
+
+    assert count_message_tokens(compacted) <= 4000
+    assert all("[truncated]" in message["content"] for message in compacted if "A summary." not in message["content"])
+
+
+def test_a_budget_too_small_for_the_kept_messages_does_not_hang(summaries):
+    messages = make_messages(8)
+    compacted = HistoryManager(max_tokens=20, keep_last_n=2).compact(messages, FakeClient(), None)
+    assert len(compacted) == 4
+    assert count_message_tokens(compacted) < count_message_tokens(messages)
@@ -0,0 +1,109 @@
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from appgen.actions import write_document
+from appgen.actions.write_document import WriteDocument
+from appgen.utils.json_stream import IncrementalJSONObjectParser
+
+
+def feed_in_chunks(text: str, size: int) -> list:
+    parser = IncrementalJSONObjectParser()
+    members = []
+    for idx in range(0, len(text), size):
+        members.extend(parser.feed(text[idx:idx + size]))
+    return members + parser.close()
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_members_are_returned_as_soon_as_they_are_complete(size):
+    text = '```json\n{"a": "x, {y}", "b": [1, {"c": "]"}], "d": {"e": "\\"}"}}\n```'
+    assert feed_in_chunks(text, size) == [
+        ("a", "x, {y}", None),
+        ("b", [1, {"c": "]"}], None),
+        ("d", {"e": '"}'}, None),
+    ]
+
+
+def test_a_member_is_not_returned_before_the_next_separator():
+    parser = IncrementalJSONObjectParser()
+    assert parser.feed('{"a": 1') == []
+    assert parser.feed(', "b"') == [("a", 1, None)]
+    assert parser.feed(': 2}') == [("b", 2, None)]
+    assert parser.done
+    assert parser.feed(', "c": 3}') == []
+
+
+def test_raw_newlines_in_strings_are_accepted():
+    assert feed_in_chunks('{"a": "line 1\nline 2"}', 5) == [("a", "line 1\nline 2", None)]
+
+
+def test_an_invalid_member_is_returned_with_its_error():
+    (key, value, error), valid = feed_in_chunks('{"a": [1, 2,], "b": true}', 4)
+    assert (key, value) == ("a", None)
+    assert error
+    assert valid == ("b", True, None)
+
+
+def test_a_truncated_object_marks_its_last_member_as_incomplete():
+    members = feed_in_chunks('{"a": 1, "b": "trunc', 4)
+    assert members[0] == ("a", 1, None)
+    assert members[1][:2] == ("b", None)
+    assert members[1][2]
+
+
+class NoteSchema(BaseModel):
+    Title: str = "Note"
+    Summary: str = ""
+    Items: List[str] = []
+
+    @staticmethod
+    def get_format_example(**kwargs):
+        return json.dumps({"Title": "Note", "Summary": "A summary.", "Items": ["An item."]})
+
+
+class FakeClient:
+
+    @staticmethod
+    def extract_text_or_function_call(response):
+        return [response]
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    "Replace the completions of the document action with the given replies, and record their prompts."
+    replies = dict(texts=[], prompts=[])
+
+    def create_completion(client, run_context, messages, **kwargs):
+        replies["prompts"].append(messages)
+        return replies["texts"].pop(0)
+
+    monkeypatch.setattr(write_document, "create_completion", create_completion)
+    return replies
+
+
+def test_only_the_invalid_and_missing_fields_are_requested_again(replies):
+    action = WriteDocument("write_note", "Write a note.", NoteSchema, "note")
+    replies["texts"] = [
+        '{"Summary": "Done.", "Items": "not a list"}',
+        '{"Items": ["First", "Second"]}',
+    ]
+    fields, errors = action._generate_fields(FakeClient(), prefix=[])
+
+    assert fields == {"Summary": "Done.", "Items": ["First", "Second"]}
+    assert errors == {}
+    retry_prompt = replies["prompts"][1][-1]["content"]
+    assert "- Items:" in retry_prompt
+    assert "- Summary:" not in retry_prompt
+
+
+def test_fields_still_invalid_after_the_retries_are_reported(replies):
+    action = WriteDocument("write_note", "Write a note.", NoteSchema, "note", max_field_retries=1)
+    replies["texts"] = ['{"Summary": "Done."}', '{"Items": 1}']
+    fields, errors = action._generate_fields(FakeClient(), prefix=[])
+
+    assert fields == {"Summary": "Done."}
+    assert list(errors) == ["Items"]
+    assert replies["texts"] == []
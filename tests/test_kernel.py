@@ -0,0 +1,15 @@
+from appgen.utils.kernel import KernelPool
+
+
+def test_the_first_session_gets_a_kernel_started_in_advance(tmp_path):
+    pool = KernelPool(size=1, work_dirs=[tmp_path])
+    try:
+        spare = pool._spares[str(tmp_path)][0]
+        kernel = pool.get("run", "DataAnalyst", tmp_path)
+        assert kernel is spare
+        assert kernel.execute("x = 1 + 1") == (0, "")
+        assert pool.get("run", "DataAnalyst", tmp_path).execute("print(x)") == (0, "2\n")
+        # Another session gets the kernel started in advance after the first one.
+        assert pool.get("run", "DataEngineer", tmp_path) is not kernel
+    finally:
+        pool.shutdown()
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from appgen.utils import llm_cache
+from appgen.utils.llm_cache import LLMCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    "Control the time seen by the cache."
+    clock = dict(now=1000.0)
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock["now"])
+    return clock
+
+
+def test_the_key_depends_on_the_content_of_the_request():
+    messages = [{"role": "user", "content": "Hi"}]
+    key = LLMCache.make_key(model="gpt-4", messages=messages)
+    assert key == LLMCache.make_key(messages=list(messages), model="gpt-4")
+    assert key != LLMCache.make_key(model="gpt-4", messages=messages, context={"name": "x"})
+    assert key != LLMCache.make_key(model="gpt-4o", messages=messages)
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = LLMCache(tmp_path / "cache.db")
+    assert cache.get("key") is None
+    cache.set("key", "response")
+    assert cache.get("key") == "response"
+    assert cache.stats() == dict(path=str(tmp_path / "cache.db"), entries=1, total_hits=1, hits=1, misses=1)
+
+
+def test_expired_entries_are_misses(tmp_path, clock):
+    cache = LLMCache(tmp_path / "cache.db", ttl=60)
+    cache.set("key", "response")
+    clock["now"] += 59
+    assert cache.get("key") == "response"
+    clock["now"] += 2
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_the_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = LLMCache(tmp_path / "cache.db", max_entries=2)
+    for key in ["a", "b"]:
+        cache.set(key, key)
+        clock["now"] += 1
+    # Reading "a" makes "b" the least recently used entry.
+    assert cache.get("a") == "a"
+    clock["now"] += 1
+    cache.set("c", "c")
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+
+
+def test_prune_overrides_the_limits_of_the_cache(tmp_path, clock):
+    cache = LLMCache(tmp_path / "cache.db")
+    for key in ["a", "b", "c"]:
+        cache.set(key, key)
+        clock["now"] += 10
+    assert cache.prune(ttl=15) == 2
+    assert cache.clear() == 1
+
+
+def test_the_database_is_shared_in_wal_mode(tmp_path):
+    cache = LLMCache(tmp_path / "cache.db")
+    other = LLMCache(tmp_path / "cache.db")
+    cache.set("key", "response")
+    assert other.get("key") == "response"
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_a_locked_database_is_a_miss_instead_of_an_error(tmp_path):
+    cache = LLMCache(tmp_path / "cache.db", busy_timeout=50)
+    cache.set("key", "response")
+    connection = sqlite3.connect(str(tmp_path / "cache.db"))
+    connection.execute("BEGIN EXCLUSIVE")
+    try:
+        cache.set("other", "response")
+        assert cache.get("key") is None
+    finally:
+        connection.rollback()
+    assert cache.get("key") == "response"
+    assert cache.get("other") is None
@@ -0,0 +1,80 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from appgen.roles.role import STATE_CLARIFICATION_MESSAGE, Role, StateDecision, extract_state_info
+
+
+def make_response(content: str = None, arguments: str = None):
+    "Return a completion with the given text reply or `choose_state` tool call arguments."
+    tool_calls = None
+    if arguments is not None:
+        tool_calls = [SimpleNamespace(function=SimpleNamespace(name="choose_state", arguments=arguments))]
+    message = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def role():
+    "Return a role with two actions, without any agent or client."
+    role = Role.__new__(Role)
+    role.actions = [SimpleNamespace(name="write_prd"), SimpleNamespace(name="write_design")]
+    role.max_state_retries = 2
+    return role
+
+
+@pytest.mark.parametrize("reply, expected", [
+    ("STATE: 1\nRESPONSE: Let me write it.", ("Let me write it.", 1)),
+    ("**STATE:** -1\n**RESPONSE:** All done.", ("All done.", -1)),
+    ("STATE:0 RESPONSE:Sure.", ("Sure.", 0)),
+    ("state: 1\nI will design it.", ("I will design it.", 1)),
+    ('```json\n{"state": 0, "response": "On it."}\n```', ("On it.", 0)),
+])
+def test_text_replies_are_parsed_leniently(reply, expected):
+    assert extract_state_info(reply) == expected
+
+
+def test_a_text_reply_without_a_state_is_rejected():
+    with pytest.raises(ValueError, match="STATE"):
+        extract_state_info("I will write the requirements.")
+
+
+def test_the_tool_schema_requires_the_state_and_the_response():
+    tool = StateDecision.as_tool()
+    assert tool["function"]["name"] == "choose_state"
+    assert set(tool["function"]["parameters"]["required"]) == {"state", "response"}
+
+
+def test_the_tool_call_arguments_are_parsed(role):
+    response = make_response(arguments=json.dumps({"state": 1, "response": "Designing."}))
+    assert role._parse_state_decision(response) == ("Designing.", 1)
+
+
+def test_a_text_reply_is_parsed_when_there_is_no_tool_call(role):
+    assert role._parse_state_decision(make_response("STATE: 0\nRESPONSE: Writing.")) == ("Writing.", 0)
+
+
+@pytest.mark.parametrize("response", [
+    make_response(arguments='{"state": 2, "response": "Out of range."}'),
+    make_response(arguments='{"state": 1}'),
+    make_response(arguments='{"state": 1, "response": "Unclosed'),
+    make_response("No state at all."),
+])
+def test_invalid_decisions_are_rejected(role, response):
+    with pytest.raises(ValueError):
+        role._parse_state_decision(response)
+
+
+def test_the_fallback_parses_malformed_tool_call_arguments(role):
+    response = make_response(arguments='{"state": 1, "response": "Designing.')
+    rsp, state = role._get_fallback_decision(response)
+    assert state == 1
+    assert "Designing." in rsp
+
+
+def test_the_fallback_does_not_terminate_on_an_invalid_reply(role):
+    for response in [make_response("I am not sure what to do."), make_response("STATE: 5\nRESPONSE: Out of range.")]:
+        rsp, state = role._get_fallback_decision(response)
+        # A non-empty response with the state -1 is sent back to the sender, who can answer it.
+        assert (rsp, state) == (STATE_CLARIFICATION_MESSAGE, -1)
@@ -0,0 +1,63 @@
+import pytest
+
+from appgen.task_chain import TaskChain
+from appgen.tasks import Task
+
+
+def make_chain(*tasks) -> TaskChain:
+    "Return a TaskChain with the given tasks and without any config, team or environment."
+    chain = TaskChain.__new__(TaskChain)
+    chain.tasks = list(tasks)
+    return chain
+
+
+def test_undeclared_dependencies_keep_the_config_order():
+    chain = make_chain(Task(name="A"), Task(name="B"), Task(name="C"))
+    assert chain._build_dag() == {"A": set(), "B": {"A"}, "C": {"B"}}
+
+
+def test_declared_dependencies_and_produced_fields():
+    chain = make_chain(
+        Task(name="A", depends_on=[], produces=["requirements"]),
+        Task(name="B", depends_on=[]),
+        Task(name="C", task_prompt="Design from {requirements}.", depends_on=["B"]),
+    )
+    assert chain._build_dag() == {"A": set(), "B": set(), "C": {"A", "B"}}
+
+
+def test_custom_placeholders_are_not_consumed_fields():
+    chain = make_chain(
+        Task(name="A", depends_on=[], produces=["requirements"]),
+        Task(name="B", task_prompt="Use {requirements}.", placeholders={"requirements": "none"}, depends_on=[]),
+    )
+    assert chain._build_dag() == {"A": set(), "B": set()}
+
+
+def test_duplicate_task_names_are_rejected():
+    chain = make_chain(Task(name="A"), Task(name="A"))
+    with pytest.raises(ValueError, match="not unique"):
+        chain._build_dag()
+
+
+@pytest.mark.parametrize("depends_on", [["C"], ["B"], ["Unknown"]])
+def test_dependencies_on_later_or_unknown_tasks_are_rejected(depends_on):
+    chain = make_chain(Task(name="A", depends_on=[]), Task(name="B", depends_on=depends_on), Task(name="C", depends_on=[]))
+    with pytest.raises(ValueError, match="unknown or later tasks"):
+        chain._build_dag()
+
+
+def test_topological_order_follows_the_config_order_for_ties():
+    chain = make_chain(
+        Task(name="A", depends_on=["C"]),
+        Task(name="B", depends_on=[]),
+        Task(name="C", depends_on=[]),
+    )
+    chain.dag = {"A": {"C"}, "B": set(), "C": set()}
+    assert [task.name for task in chain._topological_order()] == ["B", "C", "A"]
+
+
+def test_topological_order_detects_cycles():
+    chain = make_chain(Task(name="A"), Task(name="B"), Task(name="C"))
+    chain.dag = {"A": set(), "B": {"C"}, "C": {"B"}}
+    with pytest.raises(ValueError, match=r"\['B', 'C'\].*cycle"):
+        chain._topological_order()
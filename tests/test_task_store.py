@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from appgen import Environment
+from appgen.tasks import Task
+from appgen.utils.task_store import TaskStore
+
+
+@pytest.fixture
+def environment(tmp_path):
+    return Environment(
+        request_prompt="A dashboard of the sales.",
+        codebase={},
+        requirements=["The dashboard shows the sales per month."],
+        design=[],
+        backlog=[],
+        team={},
+        project_directory=tmp_path,
+    )
+
+
+def make_task(**kwargs) -> Task:
+    return Task(name="DesignSolution", task_prompt="Design a solution for {requirements}.", **kwargs)
+
+
+def test_the_fingerprint_is_stable(environment):
+    assert make_task().fingerprint(environment, upstream={"A": "1"}) == make_task().fingerprint(environment, upstream={"A": "1"})
+
+
+def test_the_fingerprint_changes_with_the_consumed_fields(environment):
+    fingerprint = make_task().fingerprint(environment)
+    environment.requirements.append("The dashboard can be filtered by region.")
+    assert make_task().fingerprint(environment) != fingerprint
+
+
+def test_the_fingerprint_ignores_the_fields_that_are_not_consumed(environment):
+    fingerprint = make_task().fingerprint(environment)
+    environment.design.append("A star schema.")
+    environment.request_prompt = "Another request."
+    assert make_task().fingerprint(environment) == fingerprint
+
+
+def test_the_fingerprint_changes_with_the_config_and_the_upstream_outputs(environment):
+    fingerprint = make_task().fingerprint(environment, upstream={"A": "1"})
+    assert make_task(placeholders={"style": "terse"}).fingerprint(environment, upstream={"A": "1"}) != fingerprint
+    assert make_task().fingerprint(environment, upstream={"A": "2"}) != fingerprint
+
+
+def test_the_fingerprint_changes_with_the_fork_source(environment):
+    fingerprint = make_task().fingerprint(environment)
+    environment.fork = dict(project="sales", request="A dashboard.", outputs={"DesignSolution": {"design": ["A star schema."]}})
+    forked = make_task().fingerprint(environment)
+    assert forked != fingerprint
+    environment.fork = dict(project="revenue", request="A dashboard.", outputs={"DesignSolution": {"design": ["A star schema."]}})
+    assert make_task().fingerprint(environment) != forked
+
+
+def test_the_record_of_a_task_is_saved_and_loaded(tmp_path):
+    store = TaskStore(tmp_path)
+    outputs = {"requirements": ["A requirement."], "codebase": {"app.py": "print(1)"}}
+    store.save("GatherRequirements", "abc", outputs)
+
+    assert store.load("GatherRequirements") == {"fingerprint": "abc", "outputs": outputs}
+    assert store.load("DesignSolution") is None
+    assert (tmp_path / ".appgen" / ".gitignore").read_text() == "*\n"
+
+
+def test_an_edited_record_is_reloaded_and_an_invalid_one_ignored(tmp_path):
+    store = TaskStore(tmp_path)
+    store.save("GatherRequirements", "abc", {"requirements": ["A requirement."]})
+    path = tmp_path / ".appgen" / "tasks" / "GatherRequirements.json"
+
+    record = json.loads(path.read_text())
+    record["outputs"]["requirements"] = ["An edited requirement."]
+    path.write_text(json.dumps(record))
+    assert store.load("GatherRequirements")["outputs"] == {"requirements": ["An edited requirement."]}
+
+    path.write_text("{not json")
+    assert store.load("GatherRequirements") is None
+
+
+def test_an_invalidated_task_has_no_record(tmp_path):
+    store = TaskStore(tmp_path)
+    store.save("GatherRequirements", "abc", {})
+    store.invalidate("GatherRequirements")
+    store.invalidate("GatherRequirements")
+    assert store.load("GatherRequirements") is None